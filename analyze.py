@@ -1,25 +1,74 @@
+import collections
+import csv
+import functools
+import hashlib
+import html
+import itertools
+import json
+import math
 import os
 import pickle
 import random
 import re
+import sqlite3
 import sys
+import threading
 import time
+import unicodedata
 import warnings
-import webbrowser
-
-import gender_guesser.detector as gender
-from mastodon import (
-    Mastodon,
+from concurrent.futures import (
+    FIRST_EXCEPTION,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
 )
-from requests_oauthlib import OAuth2Session
+from contextlib import closing
+
 from unidecode import unidecode
 
-if os.path.exists("detector.pickle"):
-    detector = pickle.load(open("detector.pickle", "rb"))
-else:
+# The name index and the Mastodon, requests and OAuth libraries are loaded
+# on first use, so that importing this module (and server.py, whose login
+# pages need none of them) stays fast. Call preload() to load them up front,
+# e.g. in a gunicorn master process started with --preload, so forked
+# workers share them copy-on-write.
+
+
+def load_detector():
+    """
+    Load gender_guesser's detector, which the name index is built from.
+    """
+    if os.path.exists("detector.pickle"):
+        with open("detector.pickle", "rb") as f:
+            return pickle.load(f)
+
+    import gender_guesser.detector as gender
+
     detector = gender.Detector(case_sensitive=False)
     with open("detector.pickle", "wb+") as f:
         pickle.dump(detector, f)
+    return detector
+
+
+def get_detector():
+    """
+    The detector cascade_gender asks: the name index, which answers like
+    gender_guesser's detector for the USA and any country.
+    """
+    return get_name_index()
+
+
+def preload():
+    """
+    Load what's otherwise loaded on first use: the libraries the server's
+    login and analyses import, and the name index.
+    """
+    import authlib.integrations.flask_client  # noqa: F401
+    import mastodon  # noqa: F401
+    import requests  # noqa: F401
+    import requests_oauthlib  # noqa: F401
+    import webfinger  # noqa: F401
+
+    get_name_index()
 
 
 class User:
@@ -90,7 +139,7 @@ class User:
 
 def split(s):
     try:
-        return s.split()[0]
+        return s.split(maxsplit=1)[0]
     except IndexError:
         return s
 
@@ -99,47 +148,111 @@ def rm_punctuation(s, _pat=re.compile(r"\W+")):
     return _pat.sub(" ", s)
 
 
+PRONOUNS = [
+    ("non binary", "nonbinary"),
+    ("non-binary", "nonbinary"),
+    ("nonbinary", "nonbinary"),
+    ("enby", "nonbinary"),
+    ("nb", "nonbinary"),
+    ("genderqueer", "nonbinary"),
+    ("man", "male"),
+    ("male", "male"),
+    ("boy", "male"),
+    ("guy", "male"),
+    ("woman", "female"),
+    ("womanist", "female"),
+    ("female", "female"),
+    ("girl", "female"),
+    ("gal", "female"),
+    ("latina", "female"),
+    ("latino", "male"),
+    ("dad", "male"),
+    ("mum", "female"),
+    ("mom", "female"),
+    ("father", "male"),
+    ("grandfather", "male"),
+    ("mother", "female"),
+    ("grandmother", "female"),
+    ("they", "nonbinary"),
+    ("xe", "nonbinary"),
+    ("xi", "nonbinary"),
+    ("xir", "nonbinary"),
+    ("ze", "nonbinary"),
+    ("zie", "nonbinary"),
+    ("zir", "nonbinary"),
+    ("hir", "nonbinary"),
+    ("she", "female"),
+    ("hers", "female"),
+    ("her", "female"),
+    ("he", "male"),
+    ("his", "male"),
+    ("him", "male"),
+]
+
+
+# Terms in other languages. Bare words that are also common words, like
+# "er", "il" or "el", only count in pronoun pairs.
+PRONOUNS_DE = [
+    ("sie/ihr", "female"),
+    ("sie/ihre", "female"),
+    ("er/ihm", "male"),
+    ("er/ihn", "male"),
+    ("er/sein", "male"),
+    ("dey/denen", "nonbinary"),
+    ("xier", "nonbinary"),
+    ("nichtbinär", "nonbinary"),
+    ("nicht-binär", "nonbinary"),
+    ("nicht binär", "nonbinary"),
+    ("frau", "female"),
+    ("mann", "male"),
+    ("mutter", "female"),
+    ("vater", "male"),
+]
+
+PRONOUNS_FR = [
+    ("elle/elle", "female"),
+    ("elle/la", "female"),
+    ("elle", "female"),
+    ("il/lui", "male"),
+    ("il/le", "male"),
+    ("iel", "nonbinary"),
+    ("non-binaire", "nonbinary"),
+    ("non binaire", "nonbinary"),
+    ("femme", "female"),
+    ("homme", "male"),
+    ("mère", "female"),
+    ("père", "male"),
+]
+
+PRONOUNS_ES = [
+    ("ella", "female"),
+    ("ella/la", "female"),
+    ("él", "male"),
+    ("él/lo", "male"),
+    ("elle", "nonbinary"),
+    ("no binarie", "nonbinary"),
+    ("no binario", "nonbinary"),
+    ("no binaria", "nonbinary"),
+    ("mujer", "female"),
+    ("hombre", "male"),
+    ("madre", "female"),
+    ("padre", "male"),
+]
+
+PRONOUN_LEXICON = {
+    "en": PRONOUNS,
+    "de": PRONOUNS_DE,
+    "fr": PRONOUNS_FR,
+    "es": PRONOUNS_ES,
+}
+
+
 def make_pronoun_patterns():
-    for p, g in [
-        ("non binary", "nonbinary"),
-        ("non-binary", "nonbinary"),
-        ("nonbinary", "nonbinary"),
-        ("enby", "nonbinary"),
-        ("nb", "nonbinary"),
-        ("genderqueer", "nonbinary"),
-        ("man", "male"),
-        ("male", "male"),
-        ("boy", "male"),
-        ("guy", "male"),
-        ("woman", "female"),
-        ("womanist", "female"),
-        ("female", "female"),
-        ("girl", "female"),
-        ("gal", "female"),
-        ("latina", "female"),
-        ("latino", "male"),
-        ("dad", "male"),
-        ("mum", "female"),
-        ("mom", "female"),
-        ("father", "male"),
-        ("grandfather", "male"),
-        ("mother", "female"),
-        ("grandmother", "female"),
-        ("they", "nonbinary"),
-        ("xe", "nonbinary"),
-        ("xi", "nonbinary"),
-        ("xir", "nonbinary"),
-        ("ze", "nonbinary"),
-        ("zie", "nonbinary"),
-        ("zir", "nonbinary"),
-        ("hir", "nonbinary"),
-        ("she", "female"),
-        ("hers", "female"),
-        ("her", "female"),
-        ("he", "male"),
-        ("his", "male"),
-        ("him", "male"),
-    ]:
+    """
+    Regular expressions for the English terms. PronounMatcher matches the
+    same texts, see tests/test_declared_gender.py.
+    """
+    for p, g in PRONOUNS:
         for text in (
             r"\b" + p + r"\b",
             r"\b" + p + r"/",
@@ -149,13 +262,162 @@ def make_pronoun_patterns():
             yield re.compile(text), g
 
 
-_PRONOUN_PATTERNS = list(make_pronoun_patterns())
+_WORD = re.compile(r"\w+")
+_PRONOUN_IS = re.compile(r"pronoun\.is/")
 
 
-class Cache(object):
+class PronounMatcher(object):
+    """
+    Finds the terms of a pronoun lexicon, {language: [(term, gender)]}, in
+    lowercase text, as whole words, in one pass over its words.
+
+    Terms are compiled into a trie keyed alternately by a word and by the
+    separator to the next word, so "non-binary" is "non", "-", "binary".
+    Spaces around slashes are ignored, so "she / her" matches "she/her".
+    Terms listed with different genders in different languages, like
+    "elle", are ambiguous and left out.
+    """
+
+    # Key of the genders of the term ending at a node.
+    END = None
+
+    def __init__(self, lexicon):
+        genders = {}
+        for terms in lexicon.values():
+            for term, gender in terms:
+                genders.setdefault(term, set()).add(gender)
+
+        self.root = {}
+        for term, term_genders in genders.items():
+            if len(term_genders) > 1:
+                continue
+
+            node = self.root
+            for part in self.parts(term):
+                node = node.setdefault(part, {})
+            node[self.END] = term_genders.pop()
+
+        # pronoun.is/ links are English only, and matched as prefixes.
+        self.pronoun_is = lexicon.get("en", [])
+
+    @staticmethod
+    def _separator(sep):
+        return sep.strip() if "/" in sep else sep
+
+    def parts(self, term):
+        words = list(_WORD.finditer(term))
+        yield words[0].group()
+        for prev, word in zip(words, words[1:]):
+            yield self._separator(term[prev.end() : word.start()])
+            yield word.group()
+
+    def match(self, text):
+        """
+        Get the set of genders of the terms in text, and whether any of its
+        words starts a term.
+        """
+        found = set()
+        # Most texts have no word that starts a term.
+        candidate = not self.root.keys().isdisjoint(_WORD.findall(text))
+        words = list(_WORD.finditer(text)) if candidate else []
+
+        for i, word in enumerate(words):
+            node = self.root.get(word.group())
+            j = i
+            while node is not None:
+                if self.END in node:
+                    found.add(node[self.END])
+                j += 1
+                if j == len(words):
+                    break
+                sep = self._separator(
+                    text[words[j - 1].end() : words[j].start()]
+                )
+                node = node.get(sep)
+                if node is not None:
+                    node = node.get(words[j].group())
+
+        if "pronoun.is/" in text:
+            for m in _PRONOUN_IS.finditer(text):
+                for term, gender in self.pronoun_is:
+                    if text.startswith(term, m.end()):
+                        found.add(gender)
+                        candidate = True
+
+        return found, candidate
+
+
+_pronoun_matcher = PronounMatcher(PRONOUN_LEXICON)
+
+
+class PrefilterStats(object):
+    """
+    How many texts declared_gender could rule out at a glance, because none
+    of their words starts a pronoun term.
+    """
+
     def __init__(self):
+        self.fast = self.slow = 0
+        # Counted from the threads of batches, lists and collectors.
+        self._lock = threading.Lock()
+
+    def count(self, fast):
+        with self._lock:
+            if fast:
+                self.fast += 1
+            else:
+                self.slow += 1
+
+    @property
+    def fast_percentage(self):
+        return div(100 * self.fast, self.fast + self.slow)
+
+
+prefilter_stats = PrefilterStats()
+
+
+def strip_html(s, _tag=re.compile(r"<[^>]*>"), _emoji=re.compile(r":\w+:")):
+    """
+    Plain text of a bio or field value: tags and custom emoji shortcodes are
+    replaced with spaces, and entities are unescaped.
+    """
+    if "<" in s:
+        s = _tag.sub(" ", s)
+    if ":" in s:
+        s = _emoji.sub(" ", s)
+    if "&" in s:
+        s = html.unescape(s)
+    return s
+
+
+# Accounts, and classifications, a Cache keeps at most. Batches share one
+# Cache for every handle, so older ones are dropped past that.
+MAX_CACHED_ACCOUNTS = 100000
+
+
+class Cache(object):
+    def __init__(
+        self,
+        index=None,
+        instance=None,
+        viewer=None,
+        max_accounts=MAX_CACHED_ACCOUNTS,
+    ):
         self._users = {}
+        self._classified = {}
+        self.max_accounts = max_accounts
         self._hits = self._misses = 0
+        # Shared by the worker threads of a batch run.
+        self._lock = threading.Lock()
+        self._classify_lock = threading.Lock()
+        # A GraphIndex that the instance's classifications and follow graphs
+        # are read from and saved to, if any. Follow graphs are only indexed
+        # as seen by viewer, the id of the account analyzing them.
+        self.index = index
+        self.instance = instance
+        self.viewer = viewer
+        self._unsaved = {}
+        self.index_hits = 0
 
     @property
     def hit_percentage(self):
@@ -169,8 +431,9 @@ class Cache(object):
         Looks for cached users by their ids
         """
         users = [self._users[uid] for uid in user_ids if uid in self._users]
-        self._hits += len(users)
-        self._misses += len(user_ids) - len(users)
+        with self._lock:
+            self._hits += len(users)
+            self._misses += len(user_ids) - len(users)
         return users
 
     def UncachedUsers(self, user_ids):
@@ -192,12 +455,90 @@ class Cache(object):
         Example:
             >>> {108192926138721866: {"username": "alexkalopsia"}}
         """
-        for user in users:
-            self._users[user.id] = user
+        with self._lock:
+            for user in users:
+                self._users[user.id] = user
+            self._evict(self._users)
+
+    def _evict(self, cached):
+        # The oldest entries go first; called with the dict's lock held.
+        if self.max_accounts is None:
+            return
+        while len(cached) > self.max_accounts:
+            del cached[next(iter(cached))]
+
+    def Classify(self, user, budget=None):
+        """
+        classify_user, once per user id, for accounts seen in several
+        collections or lists. If budget is given, it's charged for the
+        accounts classified, not for those the cache already had.
+        """
+        try:
+            return self._classified[user.id]
+        except KeyError:
+            pass
+        # Collections and lists analyzed concurrently often start with the
+        # same accounts. Classifying is CPU-bound, so little is lost by
+        # doing it one account at a time.
+        with self._classify_lock:
+            if user.id in self._classified:
+                return self._classified[user.id]
+            if budget is None:
+                result = classify_user(user)
+            else:
+                result = budget.classify(user)
+            self._classified[user.id] = result
+            self._evict(self._classified)
+        if self.index is not None:
+            with self._lock:
+                self._unsaved[user.id] = result
+        return result
+
+    def IndexedClassifications(self, user_ids):
+        """
+        Look up the classifications of user_ids in the index, and get the
+        ones found by id. Classify returns them from now on.
+        """
+        found = self.index.classifications(self.instance, user_ids)
+        with self._classify_lock:
+            self._classified.update(found)
+            self._evict(self._classified)
+        with self._lock:
+            self.index_hits += len(found)
+        return found
+
+    def SaveClassifications(self):
+        """
+        Save the classifications made since the last call to the index.
+        """
+        with self._lock:
+            unsaved, self._unsaved = self._unsaved, {}
+        if unsaved:
+            self.index.add_classifications(self.instance, unsaved)
 
 
-def declared_gender(description):
+def normalize_text(description):
+    """
+    Lowercase text for declared_gender to look for pronouns in.
+    """
     dl = description.lower()
+    if not dl.isascii():
+        # Compose accents, so that "père" is one word however it's typed.
+        dl = unicodedata.normalize("NFC", dl)
+    return dl
+
+
+def declared_gender(description):
+    return pronouns_gender(normalize_text(description))
+
+
+def pronouns_gender(dl):
+    """
+    declared_gender of text already normalized with normalize_text.
+    """
+    guesses, candidate = _pronoun_matcher.match(dl)
+    prefilter_stats.count(fast=not (candidate or "pronoun.is" in dl))
+
     if (
         "pronoun.is" in dl
         and "pronoun.is/she" not in dl
@@ -205,80 +546,351 @@ def declared_gender(description):
     ):
         return "nonbinary"
 
-    guesses = set()
-    for p, g in _PRONOUN_PATTERNS:
-        if p.search(dl):
-            guesses.add(g)
-            if len(guesses) > 1:
-                return "andy"  # Several guesses: don't know.
-
     if len(guesses) == 1:
         return next(iter(guesses))
 
     return "andy"  # Zero or several guesses: don't know.
 
 
+class DisplayName(object):
+    """
+    A display name and the variants of it that guess_gender and the
+    cascade ask about, each made once: its first word, and on first use,
+    their ASCII-folded and punctuation-stripped forms.
+    """
+
+    __slots__ = ("name", "first", "_variants")
+
+    def __init__(self, name):
+        self.name = name
+        self.first = split(name)
+        self._variants = None
+
+    def variants(self):
+        """
+        Get {kind of NAME_PROBES: (name, name without punctuation)}, with
+        the ASCII-folded kinds computed on first use.
+        """
+        if self._variants is None:
+            self._variants = self._stripped(
+                first_name=self.first, display_name=self.name
+            )
+        return self._variants
+
+    def ascii_variants(self):
+        variants = self.variants()
+        if "display_name_ascii" not in variants:
+            with warnings.catch_warnings():
+                # Suppress unidecode warning "Surrogate character will be
+                # ignored".
+                warnings.filterwarnings("ignore")
+                ascii_name = unidecode(self.name)
+
+            variants.update(
+                self._stripped(
+                    display_name_ascii=ascii_name,
+                    first_name_ascii=split(ascii_name),
+                    known=variants,
+                )
+            )
+        return variants
+
+    @staticmethod
+    def _stripped(known=None, **names):
+        # Most variants are the same string, so strip each string once.
+        stripped = {name: s for name, s in (known or {}).values()}
+        variants = {}
+        for kind, name in names.items():
+            if name not in stripped:
+                stripped[name] = rm_punctuation(name)
+            variants[kind] = (name, stripped[name])
+        return variants
+
+
+class AccountText(object):
+    """
+    The text of an account that classify_account looks at, normalized once
+    when the account is classified: the normalize_text of its pronouns
+    field, or of its bio if it has none, and its DisplayName.
+    """
+
+    __slots__ = ("pronouns", "source", "display_name")
+
+    def __init__(self, pronouns, source, display_name):
+        self.pronouns = pronouns
+        self.source = source
+        self.display_name = display_name
+
+
+def normalize_account(user):
+    # Look for explicit Pronouns field, otherwise check bio
+    description, source = user.note, "bio"
+    for field in user.fields:
+        if "Pronouns" in field.get("name"):
+            description, source = field["value"], "pronouns_field"
+            break
+
+    return AccountText(
+        normalize_text(strip_html(description)),
+        source,
+        DisplayName(user.display_name),
+    )
+
+
 def analyze_user(user, verbose=False):
     """Get (gender, declared) tuple.
 
     gender is "male", "female", "nonbinary", or "andy" meaning unknown.
     declared is True or False.
     """
-    with warnings.catch_warnings():
-        # Suppress unidecode warning "Surrogate character will be ignored".
-        warnings.filterwarnings("ignore")
+    g, declared, _ = classify_user(user, verbose)
+    return g, declared
 
-        # Look for explicit Pronouns field, otherwise check bio
-        pronouns_field = next(
-            (
-                field["value"]
-                for field in user.fields
-                if "Pronouns" in field.get("name")
-            ),
-            None,
-        )
-        description = (
-            pronouns_field if pronouns_field is not None else user.note
+
+def classify_user(user, verbose=False):
+    """Get (gender, declared, source) tuple.
+
+    Like analyze_user, source tells what decided the gender: "pronouns_field",
+    "bio", or "display_name:" followed by the variant of the name probe that
+    recognized the display name, see cascade_gender. Plain "display_name"
+    means no probe recognized it.
+    """
+    g, declared, source = classify_account(normalize_account(user))
+
+    if verbose and not declared:
+        print(
+            "{:20s}\t{:40s}\t{:s}".format(
+                user.username.encode("utf-8"),
+                user.display_name.encode("utf-8"),
+                g,
+            )
         )
-        g = declared_gender(description)
 
-        if g != "andy":
-            return g, True
-
-        # We haven't found a preferred pronoun.
-        for name, country in [
-            (split(user.display_name), "usa"),
-            (user.display_name, "usa"),
-            (split(unidecode(user.display_name)), "usa"),
-            (unidecode(user.display_name), "usa"),
-            (split(user.display_name), None),
-            (user.display_name, None),
-            (unidecode(user.display_name), None),
-            (split(unidecode(user.display_name)), None),
-        ]:
+    return g, declared, source
+
+
+def classify_account(account):
+    """
+    classify_user of the AccountText of a user.
+    """
+    g = pronouns_gender(account.pronouns)
+    if g != "andy":
+        return g, True, account.source
+
+    # We haven't found a preferred pronoun.
+    g, variant = guess_gender(account.display_name)
+
+    if g.startswith("mostly_"):
+        g = g.split("mostly_")[1]
+
+    return g, False, _GUESS_SOURCES.get(variant, "display_name")
+
+
+# The variants of a display name the detector is asked about in turn, and
+# the country it's asked for. Each is tried as is, then without punctuation.
+NAME_PROBES = (
+    ("first_name", "usa"),
+    ("display_name", "usa"),
+    ("first_name_ascii", "usa"),
+    ("display_name_ascii", "usa"),
+    ("first_name", None),
+    ("display_name", None),
+    ("display_name_ascii", None),
+    ("first_name_ascii", None),
+)
+_PROBE_LABELS = [
+    (kind, country, f"{kind}/{country or 'any'}")
+    for kind, country in NAME_PROBES
+]
+# The source classify_account gives for each variant, made once.
+_GUESS_SOURCES = {
+    variant: "display_name:" + variant
+    for _, _, label in _PROBE_LABELS
+    for variant in (label, label + "/no_punctuation")
+}
+
+
+def cascade_gender(display_name, detector=None):
+    """
+    Get (gender, variant) from the first probe of NAME_PROBES the detector
+    doesn't find androgynous, where variant names the probe, with
+    "/no_punctuation" appended if it matched without punctuation. variant
+    is None if every probe is androgynous. display_name is a string or a
+    DisplayName.
+    """
+    detector = detector or get_detector()
+    if isinstance(display_name, str):
+        display_name = DisplayName(display_name)
+    variants = display_name.variants()
+    # The detector's answer only depends on what it's asked.
+    asked = set()
+    g = "andy"
+
+    for kind, country, label in _PROBE_LABELS:
+        if kind not in variants:
+            variants = display_name.ascii_variants()
+
+        name, stripped = variants[kind]
+        if (name, country) not in asked:
+            asked.add((name, country))
             g = detector.get_gender(name, country)
             if g != "andy":
                 # Not androgynous.
-                break
+                return g, label
 
-            g = detector.get_gender(rm_punctuation(name), country)
+        if (stripped, country) not in asked:
+            asked.add((stripped, country))
+            g = detector.get_gender(stripped, country)
             if g != "andy":
-                # Not androgynous.
-                break
+                return g, label + "/no_punctuation"
 
-        if verbose:
-            print(
-                "{:20s}\t{:40s}\t{:s}".format(
-                    user.username.encode("utf-8"),
-                    user.display_name.encode("utf-8"),
-                    g,
-                )
+    return "andy", None
+
+
+def build_name_table(detector):
+    """
+    Precompute cascade_gender for display names by their first word. Maps
+    every lowercased name in the detector's data to a pair of (gender,
+    variant) outcomes: the first for any display name starting with the
+    name, or None if it depends on the rest of the display name, and the
+    second for a display name that is just the name.
+
+    The first two probes only look at the first word, and unless they find
+    it androgynous, they decide. Names not in the data get "unknown" right
+    away, so they need no entry.
+    """
+    outcomes = {}
+    table = {}
+
+    for name in detector.names:
+        outcome = None
+        g = detector.get_gender(name, "usa")
+        if g != "andy":
+            outcome = (g, "first_name/usa")
+        else:
+            g = detector.get_gender(rm_punctuation(name), "usa")
+            if g != "andy":
+                outcome = (g, "first_name/usa/no_punctuation")
+
+        if outcome is not None:
+            outcome = outcomes.setdefault(outcome, outcome)
+            table[name] = (outcome, outcome)
+        else:
+            single_outcome = cascade_gender(name, detector)
+            single_outcome = outcomes.setdefault(
+                single_outcome, single_outcome
             )
+            table[name] = (None, single_outcome)
+
+    return table
+
+
+NAME_INDEX = "names.idx"
+_name_index = None
+_name_index_lock = threading.Lock()
+_UNKNOWN_NAME = ("unknown", "first_name/usa")
+_UNKNOWN_DISPLAY_NAME = ("unknown", "display_name/usa")
+
+
+def name_index_source():
+    """
+    Get a hash of what the name index is built from: the detector's data,
+    NAME_PROBES, and the code of build_name_table and of the cascade it
+    precomputes. An index built from anything else is stale.
+    """
+    import importlib.util
+
+    h = hashlib.sha256(repr(NAME_PROBES).encode("utf-8"))
+
+    def add_code(code):
+        h.update(code.co_code)
+        h.update(repr(code.co_names).encode("utf-8"))
+        for const in code.co_consts:
+            # Nested code, e.g. of comprehensions, reprs with its address.
+            if isinstance(const, type(code)):
+                add_code(const)
+            else:
+                h.update(repr(const).encode("utf-8"))
+
+    functions = [build_name_table, cascade_gender, rm_punctuation]
+    functions += [
+        f for f in vars(DisplayName).values() if hasattr(f, "__code__")
+    ]
+    for f in functions:
+        add_code(f.__code__)
+
+    spec = importlib.util.find_spec("gender_guesser")
+    if spec is not None:
+        data = os.path.join(
+            os.path.dirname(spec.origin), "data", "nam_dict.txt"
+        )
+        with open(data, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+def load_name_index(path=NAME_INDEX):
+    """
+    Map the name index at path, building it first from the detector and
+    its name table if it's missing or stale. Building takes a while, and
+    the whole detector, so it's done once for every process.
+    """
+    from nameindex import NameIndex, write_name_index
+
+    source = name_index_source()
+    try:
+        return NameIndex(path, source)
+    except (OSError, ValueError):
+        pass
+
+    detector = load_detector()
+    write_name_index(path, detector, build_name_table(detector), source)
+    return NameIndex(path, source)
+
+
+def get_name_index():
+    global _name_index
+    if _name_index is None:
+        with _name_index_lock:
+            if _name_index is None:
+                _name_index = load_name_index()
+    return _name_index
+
+
+def get_name_table():
+    """
+    The table guess_gender looks names up in: the name index, which maps
+    names to their build_name_table entry.
+    """
+    return get_name_index()
+
 
-        if g.startswith("mostly_"):
-            g = g.split("mostly_")[1]
+def guess_gender(display_name):
+    """
+    Like cascade_gender, but decided with a lookup in the name table for
+    all but the rare display names that need the whole cascade.
+    """
+    if isinstance(display_name, str):
+        display_name = DisplayName(display_name)
+    table = get_name_table()
+    first = display_name.first
+    entry = table.get(first.lower())
+    if entry is None:
+        return _UNKNOWN_NAME
+
+    outcome, single_outcome = entry
+    if outcome is not None:
+        return outcome
+
+    if display_name.name == first:
+        return single_outcome
 
-        return g, False
+    # The first word is androgynous, so the third probe, of the whole
+    # display name, decides, unless that's a name too.
+    if display_name.name.lower() not in table:
+        return _UNKNOWN_DISPLAY_NAME
+
+    return cascade_gender(display_name)
 
 
 def div(num, denom):
@@ -288,56 +900,173 @@ def div(num, denom):
     return 0
 
 
+GENDERS = ("nonbinary", "male", "female", "andy")
+ANDY = GENDERS.index("andy")
+_GENDER_CODES = {g: i for i, g in enumerate(GENDERS)}
+# Elide gender-unknown and androgynous names.
+_GENDER_CODES["unknown"] = ANDY
+
+
 class Stat(object):
-    def __init__(self):
-        self.n = 0
-        self.n_declared = 0
+    """
+    View of one gender's counts in an Analysis.
+    """
+
+    __slots__ = ("_an", "_i")
+
+    def __init__(self, an, i):
+        self._an = an
+        self._i = i
+
+    @property
+    def n(self):
+        return self._an._n[self._i]
+
+    @n.setter
+    def n(self, value):
+        if self._i != ANDY:
+            self._an.n_known += value - self._an._n[self._i]
+        self._an._n[self._i] = value
+
+    @property
+    def n_declared(self):
+        return self._an._n_declared[self._i]
+
+    @n_declared.setter
+    def n_declared(self, value):
+        self._an._n_declared[self._i] = value
 
 
 class Analysis(object):
+    """
+    Counts of users and of users with declared pronouns per gender, kept in
+    fixed-size arrays indexed by position in GENDERS. n_known is the number of
+    users with a known gender. complete is False if some pages couldn't be
+    fetched, so the counts only cover part of the collection, and
+    rate_limited is True too if the server's rate limit was why.
+
+    Analyses can be added or subtracted, and pickle as a flat tuple.
+    """
+
+    __slots__ = (
+        "_n",
+        "_n_declared",
+        "n_known",
+        "ids_sampled",
+        "ids_fetched",
+        "complete",
+        "rate_limited",
+    )
+
     def __init__(self, ids_sampled, ids_fetched):
-        self.nonbinary = Stat()
-        self.male = Stat()
-        self.female = Stat()
-        self.andy = Stat()
+        self._n = [0] * len(GENDERS)
+        self._n_declared = [0] * len(GENDERS)
+        self.n_known = 0
         self.ids_sampled = ids_sampled
         self.ids_fetched = ids_fetched
+        self.complete = True
+        self.rate_limited = False
+
+    nonbinary = property(lambda self: Stat(self, 0))
+    male = property(lambda self: Stat(self, 1))
+    female = property(lambda self: Stat(self, 2))
+    andy = property(lambda self: Stat(self, ANDY))
 
     def update(self, gender, declared):
-        # Elide gender-unknown and androgynous names.
-        attr = getattr(self, "andy" if gender == "unknown" else gender)
-        attr.n += 1
+        i = _GENDER_CODES[gender]
+        self._n[i] += 1
+        if i != ANDY:
+            self.n_known += 1
         if declared:
-            attr.n_declared += 1
+            self._n_declared[i] += 1
 
     def guessed(self, gender=None):
         if gender:
-            attr = getattr(self, gender)
-            return attr.n - attr.n_declared
+            i = _GENDER_CODES[gender]
+            return self._n[i] - self._n_declared[i]
 
-        return (
-            self.guessed("nonbinary")
-            + self.guessed("male")
-            + self.guessed("female")
-        )
+        return self.n_known - self.declared()
 
     def declared(self, gender=None):
         if gender:
-            attr = getattr(self, gender)
-            return attr.n_declared
+            return self._n_declared[_GENDER_CODES[gender]]
+
+        return sum(self._n_declared) - self._n_declared[ANDY]
 
+    def pct(self, gender):
+        return div(100 * self._n[_GENDER_CODES[gender]], self.n_known)
+
+    def summary(self):
+        """
+        Every count and percentage at once, as a dict keyed by name and then
+        by gender.
+        """
+        n_declared = self.declared()
+        return {
+            "ids_sampled": self.ids_sampled,
+            "ids_fetched": self.ids_fetched,
+            "n": dict(zip(GENDERS, self._n)),
+            "declared": dict(zip(GENDERS, self._n_declared)),
+            "guessed": {
+                g: n - d for g, n, d in zip(GENDERS, self._n, self._n_declared)
+            },
+            "pct": {
+                g: div(100 * n, self.n_known) for g, n in zip(GENDERS, self._n)
+            },
+            "total_declared": n_declared,
+            "total_guessed": self.n_known - n_declared,
+            "complete": self.complete,
+            "rate_limited": self.rate_limited,
+        }
+
+    def as_tuple(self):
         return (
-            self.nonbinary.n_declared
-            + self.male.n_declared
-            + self.female.n_declared
+            self.ids_sampled,
+            self.ids_fetched,
+            *self._n,
+            *self._n_declared,
         )
 
-    def pct(self, gender):
-        attr = getattr(self, gender)
-        return div(
-            100 * attr.n, self.nonbinary.n + self.male.n + self.female.n
+    @classmethod
+    def from_tuple(cls, t, complete=True):
+        an = cls(t[0], t[1])
+        k = len(GENDERS)
+        an._n = list(t[2 : 2 + k])
+        an._n_declared = list(t[2 + k : 2 + 2 * k])
+        an.n_known = sum(an._n) - an._n[ANDY]
+        an.complete = complete
+        return an
+
+    def __reduce__(self):
+        return (Analysis.from_tuple, (self.as_tuple(), self.complete))
+
+    def _combine(self, other, sign):
+        an = Analysis.from_tuple(
+            tuple(
+                (a or 0) + sign * (b or 0)
+                for a, b in zip(self.as_tuple(), other.as_tuple())
+            ),
+            self.complete and other.complete,
+        )
+        an.rate_limited = self.rate_limited or other.rate_limited
+        return an
+
+    def __add__(self, other):
+        return self._combine(other, 1)
+
+    def __sub__(self, other):
+        return self._combine(other, -1)
+
+    def __eq__(self, other):
+        if not isinstance(other, Analysis):
+            return NotImplemented
+        return (self.as_tuple(), self.complete) == (
+            other.as_tuple(),
+            other.complete,
         )
 
+    __hash__ = None
+
 
 def dry_run_analysis():
     following = Analysis(250, 400)
@@ -397,12 +1126,178 @@ def dry_run_analysis():
     return following, followers, timeline, boosts, replies, mentions
 
 
-def analyze_users(users, ids_fetched=None):
-    an = Analysis(ids_sampled=len(users), ids_fetched=ids_fetched)
+# Default limits of one user's analyses, see Budget.
+MAX_ACCOUNTS = 20000
+MAX_BIO_BYTES = 20 * 2**20
+MAX_CPU_SECONDS = 10.0
+
+
+class Budget(object):
+    """
+    Resource limits of one user's analyses, shared by their collectors:
+    accounts classified, bytes of bio and field text classified, and CPU
+    seconds spent classifying. None means no limit. Through a Cache, each
+    account is only charged when the cache classifies it, once however
+    many collectors ask for it. The limits bound the work of one user's
+    analyses; the memory of a Cache shared by many is bounded by its
+    max_accounts.
+
+    Once a limit is reached, collectors stop taking accounts, so their
+    Analysis is of a smaller sample, and flagged incomplete.
+
+    With provenance, sources also counts the accounts classified by the
+    source that decided them, see classify_user. Accounts whose
+    classification was indexed aren't classified again, nor counted.
+    """
+
+    def __init__(
+        self,
+        max_accounts=MAX_ACCOUNTS,
+        max_bio_bytes=MAX_BIO_BYTES,
+        max_cpu_seconds=MAX_CPU_SECONDS,
+        provenance=False,
+    ):
+        self.max_accounts = max_accounts
+        self.max_bio_bytes = max_bio_bytes
+        self.max_cpu_seconds = max_cpu_seconds
+        self.accounts = self.bio_bytes = 0
+        self.cpu_seconds = 0.0
+        self.sources = collections.Counter() if provenance else None
+        # Shared by the threads of iter_lists.
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        """
+        A Budget with the limits in the ANALYSIS_MAX_ACCOUNTS,
+        ANALYSIS_MAX_BIO_BYTES and ANALYSIS_MAX_CPU_SECONDS environment
+        variables, or the defaults. 0 means no limit. Sources are counted
+        if ANALYSIS_PROVENANCE is set.
+        """
+
+        def limit(name, type, default):
+            value = type(os.environ.get(name, default))
+            return value or None
+
+        return cls(
+            limit("ANALYSIS_MAX_ACCOUNTS", int, MAX_ACCOUNTS),
+            limit("ANALYSIS_MAX_BIO_BYTES", int, MAX_BIO_BYTES),
+            limit("ANALYSIS_MAX_CPU_SECONDS", float, MAX_CPU_SECONDS),
+            provenance=bool(os.environ.get("ANALYSIS_PROVENANCE")),
+        )
+
+    @property
+    def exceeded(self):
+        """
+        The name of a limit that was reached, or None.
+        """
+        for name in ("accounts", "bio_bytes", "cpu_seconds"):
+            limit = getattr(self, "max_" + name)
+            if limit is not None and getattr(self, name) >= limit:
+                return name
+        return None
+
+    def classify(self, user, classify=None):
+        """
+        classify(user), by default classify_user, charged to the budget.
+        """
+        # Under gevent, every greenlet of a worker shares a thread, but
+        # classifying neither waits on I/O nor switches greenlets, so this
+        # only counts the CPU time of this account.
+        start = time.thread_time()
+        result = (classify or classify_user)(user)
+        cpu_seconds = time.thread_time() - start
+
+        bio_bytes = utf8_len(user.note)
+        for field in user.fields:
+            bio_bytes += utf8_len(field["value"])
+        with self._lock:
+            self.accounts += 1
+            self.bio_bytes += bio_bytes
+            self.cpu_seconds += cpu_seconds
+            if self.sources is not None:
+                self.sources[result[2]] += 1
+        return result
+
+    def usage(self):
+        return {
+            "accounts": self.accounts,
+            "max_accounts": self.max_accounts,
+            "bio_bytes": self.bio_bytes,
+            "max_bio_bytes": self.max_bio_bytes,
+            "cpu_seconds": self.cpu_seconds,
+            "max_cpu_seconds": self.max_cpu_seconds,
+            "exceeded": self.exceeded,
+            "sources": None if self.sources is None else dict(self.sources),
+        }
+
+
+def utf8_len(s):
+    # Most bios are ASCII, and don't need encoding to be measured.
+    return len(s) if s.isascii() else len(s.encode("utf-8", "ignore"))
+
+
+def budget_summary(usage):
+    """
+    One line describing a Budget's usage().
+    """
+    summary = (
+        "Classified {} accounts, {:.1f} KB of bios, in {:.2f} s of CPU time"
+    ).format(
+        usage["accounts"], usage["bio_bytes"] / 1024, usage["cpu_seconds"]
+    )
+    if usage["exceeded"]:
+        summary += "; stopped at the limit of {} {}".format(
+            usage["max_" + usage["exceeded"]],
+            usage["exceeded"].replace("_", " "),
+        )
+    return summary
+
+
+def provenance_summary(sources):
+    """
+    Lines describing the sources in a Budget's usage(), most frequent
+    first, with the share of accounts each decided.
+    """
+    total = sum(sources.values())
+    return [
+        "{:>42s}\t{:>8d}\t{:>6.2f}%".format(source, n, div(100 * n, total))
+        for source, n in sorted(sources.items(), key=lambda s: (-s[1], s[0]))
+    ]
+
+
+def analyze_users(
+    users,
+    ids_fetched=None,
+    export=None,
+    collection=None,
+    budget=None,
+    cache=None,
+):
+    """
+    Classify users into an Analysis, through cache if given. If given,
+    export is called with (collection, user, gender, declared, source) for
+    every user, and budget is charged for them; users past its limits are
+    left out.
+    """
+    an = Analysis(ids_sampled=0, ids_fetched=ids_fetched)
+    if cache is not None:
+        classify = budget_classifier(cache, budget)
+    elif budget is not None:
+        classify = budget.classify
+    else:
+        classify = classify_user
 
     for user in users:
-        g, declared = analyze_user(user)
+        if budget is not None and budget.exceeded:
+            an.complete = False
+            break
+
+        g, declared, source = classify(user)
+        an.ids_sampled += 1
         an.update(g, declared)
+        if export is not None:
+            export(collection, user, g, declared, source)
 
     return an
 
@@ -412,38 +1307,390 @@ def batch(it, size):
         yield it[i : i + size]
 
 
-def get_mastodon_api(access_token, instance="mastodon.social"):
-    return Mastodon(
-        access_token=access_token, api_base_url=f"https://{instance}"
-    )
+# Seconds to wait for a response to one API call, at most. Calls made by
+# call_with_retries wait no longer than the time left before its deadline.
+REQUEST_TIMEOUT = 10
 
+# Failed calls are retried up to MAX_RETRIES times, waiting RETRY_BACKOFF
+# seconds before the first retry and twice as long before each next one, up
+# to MAX_RETRY_BACKOFF.
+MAX_RETRIES = 3
+RETRY_BACKOFF = 0.5
+MAX_RETRY_BACKOFF = 4
 
-# 80 ids per call (total 800).
-MAX_GET_FOLLOWING_IDS_CALLS = 10
-MAX_GET_FOLLOWER_IDS_CALLS = 10
+# Seconds all the analyses of one user may take, after which they stop
+# fetching pages and report what they have.
+ANALYSIS_TIME_BUDGET = 60
 
-# 100 users per call.
-MAX_USERS_LOOKUP_CALLS = 30
-MAX_TIMELINE_CALLS = 10
 
+def retryable_errors():
+    from mastodon import (
+        MastodonNetworkError,
+        MastodonRatelimitError,
+        MastodonServerError,
+    )
 
-def get_following_lists(user_id, access_token, instance):
-    api = get_mastodon_api(access_token, instance)
+    return MastodonNetworkError, MastodonRatelimitError, MastodonServerError
 
-    # Only store what we need, avoid oversized session cookie.
-    def process_lists():
-        for list in reversed(api.lists()):
-            yield {
-                "id": list.get("id"),
-                "name": list.get("title"),
-            }
 
-    return list(process_lists())
+def endpoint_unavailable(exc):
+    """
+    Whether exc, raised by an API call, says the server doesn't have its
+    endpoint, rather than that what was asked for doesn't exist: the
+    server's version is too old for it, or it answered 405, or 404 without
+    a "Record not found".
+    """
+    from mastodon import MastodonAPIError, MastodonVersionError
 
+    if isinstance(exc, MastodonVersionError):
+        return True
+    if not isinstance(exc, MastodonAPIError) or len(exc.args) < 4:
+        return False
+    status, message = exc.args[1], exc.args[3]
+    return status == 405 or (status == 404 and message != "Record not found")
 
-def analyze_self(handle, api):
-    user = get_user_from_handle(handle, api)
-    return analyze_user(user)
+
+def time_left(deadline):
+    return float("inf") if deadline is None else deadline - time.monotonic()
+
+
+def call_with_retries(fn, deadline=None, api=None):
+    """
+    Call fn, retrying on network, server and rate limit errors with
+    exponential backoff. Rate limits of api, the client fn calls, are
+    waited out until the X-RateLimit-Reset it last got. Retries that would
+    end past deadline, a time.monotonic() value, aren't attempted and the
+    last error is raised.
+    """
+    from mastodon import MastodonRatelimitError
+
+    errors = retryable_errors()
+
+    for attempt in range(MAX_RETRIES + 1):
+        # For the sessions of make_pooled_session to time out by deadline.
+        outer, _call_deadline.deadline = _call_deadline.deadline, deadline
+        try:
+            return fn()
+        except errors as exc:
+            delay = min(RETRY_BACKOFF * 2**attempt, MAX_RETRY_BACKOFF)
+            reset = getattr(api, "ratelimit_reset", None)
+            if isinstance(exc, MastodonRatelimitError) and isinstance(
+                reset, (int, float)
+            ):
+                # The limit is per window, so retrying sooner fails again.
+                delay = max(delay, reset - time.time())
+            if attempt == MAX_RETRIES or delay >= time_left(deadline):
+                raise
+            time.sleep(delay)
+        finally:
+            _call_deadline.deadline = outer
+
+
+class _CallDeadline(threading.local):
+    # The deadline of the call_with_retries running in each thread.
+    deadline = None
+
+
+_call_deadline = _CallDeadline()
+
+
+class Paginator(object):
+    """
+    Iterate over the page fetch_first() returns and the pages following it,
+    for at most max_calls pages in all. Calls are retried with
+    call_with_retries, and if a page still can't be fetched, or deadline
+    passes, iteration stops early and complete is False, and rate_limited
+    True if it was for the rate limit.
+    """
+
+    def __init__(self, fetch_first, api, max_calls, deadline=None):
+        self._fetch_first = fetch_first
+        self._api = api
+        self._max_calls = max_calls
+        self._deadline = deadline
+        self.complete = True
+        self.rate_limited = False
+
+    def __iter__(self):
+        from mastodon import MastodonRatelimitError
+
+        errors = retryable_errors()
+        fetch = self._fetch_first
+
+        for _ in range(self._max_calls):
+            if time_left(self._deadline) <= 0:
+                self.complete = False
+                return
+
+            try:
+                page = call_with_retries(fetch, self._deadline, self._api)
+            except errors as exc:
+                self.complete = False
+                self.rate_limited = isinstance(exc, MastodonRatelimitError)
+                return
+
+            if not page:
+                return
+
+            yield page
+            fetch = functools.partial(self._api.fetch_next, page)
+
+
+class Reservoir(object):
+    """
+    Uniform random sample of at most size items from a stream of unknown
+    length, in O(size) memory (Vitter's Algorithm L). Pass a seeded
+    random.Random as rng for reproducible samples.
+    """
+
+    def __init__(self, size, rng=None):
+        self.size = size
+        self.items = []
+        self.seen = 0
+        self._rng = rng or random.Random()
+        # Index of the next item to go into a full reservoir.
+        self._next = size - 1
+        self._w = 1.0
+
+    def _uniform(self):
+        # random() may return 0.0, whose log is undefined.
+        u = 0.0
+        while u == 0.0:
+            u = self._rng.random()
+        return u
+
+    def _skip(self):
+        self._w *= math.exp(math.log(self._uniform()) / self.size)
+        self._next += (
+            math.floor(math.log(self._uniform()) / math.log1p(-self._w)) + 1
+        )
+
+    def add(self, item):
+        """
+        Offer item to the sample, and get the index it's stored at in items,
+        or None if it wasn't kept.
+        """
+        i = self.seen
+        self.seen += 1
+
+        if i < self.size:
+            self.items.append(item)
+            if i == self.size - 1:
+                self._skip()
+            return i
+
+        if i == self._next:
+            slot = self._rng.randrange(self.size)
+            self.items[slot] = item
+            self._skip()
+            return slot
+
+        return None
+
+    def extend(self, items):
+        for item in items:
+            self.add(item)
+
+
+def get_mastodon_api(access_token, instance="mastodon.social", session=None):
+    """
+    Get a Mastodon API client. If the MASTODON_REPLAY environment variable
+    names an archive, get one that replays its responses instead, and if
+    MASTODON_RECORD does, record every response to it; see replay.py.
+    """
+    replay_path = os.environ.get("MASTODON_REPLAY")
+    if replay_path:
+        from replay import ReplayApi
+
+        return ReplayApi.load(replay_path)
+
+    from mastodon import Mastodon
+
+    # Rate limits are retried by call_with_retries, within the time budget,
+    # rather than waited out for up to five minutes.
+    api = Mastodon(
+        access_token=access_token,
+        api_base_url=f"https://{instance}",
+        session=session or make_pooled_session(),
+        request_timeout=REQUEST_TIMEOUT,
+        ratelimit_method="throw",
+    )
+
+    record_path = os.environ.get("MASTODON_RECORD")
+    if record_path:
+        from replay import RecordingApi
+
+        return RecordingApi(api, record_path)
+
+    return api
+
+
+def get_viewer_id(api):
+    """
+    Get the id of the account api's access token belongs to, which the
+    follow graphs of a GraphIndex are kept per.
+    """
+    return call_with_retries(api.account_verify_credentials).id
+
+
+def next_page_params(page):
+    """
+    The pagination parameters fetch_next would use for the page after page,
+    or None. Mastodon.py 2 keeps them on the page, older versions on its
+    last item.
+    """
+    params = getattr(page, "_pagination_next", None)
+    if params is None and isinstance(page, list) and page:
+        params = getattr(page[-1], "_pagination_next", None)
+    return params
+
+
+class SingleFlight(object):
+    """
+    Collapses concurrent calls with the same key into one: the first caller
+    runs the function, and callers arriving while it runs wait for and share
+    its result or exception. Callers inside call_with_retries wait no longer
+    than its deadline, then raise a MastodonNetworkError to be retried.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.calls = self.shared = 0
+
+    def do(self, key, fn):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {"done": threading.Event()}
+                self.calls += 1
+            else:
+                self.shared += 1
+
+        if not leader:
+            deadline = _call_deadline.deadline
+            timeout = None if deadline is None else max(time_left(deadline), 0)
+            if not call["done"].wait(timeout):
+                from mastodon import MastodonNetworkError
+
+                raise MastodonNetworkError(
+                    "Timed out waiting for a coalesced call"
+                )
+            if "error" in call:
+                raise call["error"]
+            return call["result"]
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        except Exception as exc:
+            call["error"] = exc
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call["done"].set()
+
+
+_flights = SingleFlight()
+
+
+class CoalescingApi(object):
+    """
+    Wraps a Mastodon API so that concurrent identical requests for accounts
+    and for followers and following pages share one upstream call keyed on
+    (instance, credentials, endpoint, cursor). Only requests made with the
+    same access token are shared, since what a locked account or a search
+    shows depends on who's asking. Requests that are always personal, like
+    timelines and lists, are passed through.
+    """
+
+    COALESCED = (
+        "account",
+        "account_followers",
+        "account_following",
+        "account_lookup",
+        "account_search",
+        "accounts",
+    )
+
+    def __init__(self, api, instance, flights=None):
+        self._api = api
+        self._instance = instance
+        self._flights = flights or _flights
+        # A hash, so that tokens aren't kept in the keys of calls. Replays
+        # have no token.
+        token = getattr(api, "access_token", None)
+        if not isinstance(token, str):
+            token = ""
+        self._credentials = hashlib.sha256(token.encode()).hexdigest()
+
+    def __getattr__(self, name):
+        method = getattr(self._api, name)
+        if name not in self.COALESCED:
+            return method
+
+        def coalesced(*args, **kwargs):
+            key = (
+                self._instance,
+                self._credentials,
+                name,
+                repr(args),
+                repr(sorted(kwargs.items())),
+            )
+            return self._flights.do(key, lambda: method(*args, **kwargs))
+
+        return coalesced
+
+    def fetch_next(self, page):
+        params = next_page_params(page)
+        endpoint = params and params.get("_pagination_endpoint", "")
+        if not endpoint or not endpoint.endswith(("/followers", "/following")):
+            return self._api.fetch_next(page)
+
+        key = (
+            self._instance,
+            self._credentials,
+            endpoint,
+            json.dumps(params, sort_keys=True, default=str),
+        )
+        return self._flights.do(key, lambda: self._api.fetch_next(page))
+
+
+# 80 ids per call (total 800).
+MAX_GET_FOLLOWING_IDS_CALLS = 10
+MAX_GET_FOLLOWER_IDS_CALLS = 10
+# Pages of ids sampled: the ids of the last call were never counted, it
+# only looked for more, so it isn't made.
+MAX_FOLLOWING_PAGES = MAX_GET_FOLLOWING_IDS_CALLS - 1
+MAX_FOLLOWER_PAGES = MAX_GET_FOLLOWER_IDS_CALLS - 1
+
+# 100 users per call.
+MAX_USERS_LOOKUP_CALLS = 30
+MAX_TIMELINE_CALLS = 10
+
+# 40 users per call.
+MAX_ACCOUNTS_LOOKUP_CALLS = 5
+
+
+def get_following_lists(user_id, access_token, instance):
+    api = get_mastodon_api(access_token, instance)
+
+    # Only store what we need in the session.
+    def process_lists():
+        for list in reversed(api.lists()):
+            yield {
+                "id": list.get("id"),
+                "name": list.get("title"),
+            }
+
+    return list(process_lists())
+
+
+def analyze_self(handle, api, handle_cache=None):
+    user = get_user_from_handle(handle, api, handle_cache)
+    return analyze_user(user)
 
 
 def fetch_users(users, cache):
@@ -467,71 +1714,299 @@ def fetch_users(users, cache):
     return users
 
 
-def analyze_following(user_id, list_id, api, cache):
+def last(iterable):
+    item = None
+    for item in iterable:
+        pass
+    return item
 
-    following_accounts = []
 
-    if list_id is not None:
-        accounts = api.list_accounts(id=list_id, limit=80)
-    else:
-        accounts = api.account_following(id=user_id, limit=80)
+def sample_analysis(sample):
+    an = Analysis(ids_sampled=len(sample.items), ids_fetched=sample.seen)
+    for _, (g, declared, _) in sample.items:
+        an.update(g, declared)
+    return an
 
-    for _ in range(MAX_GET_FOLLOWING_IDS_CALLS - 1):
-        if not accounts:
-            break
 
-        following_accounts.extend(accounts)
+def budget_classifier(cache, budget):
+    """
+    Get a function classifying a user through cache, charged to budget if
+    it's not None.
+    """
+    if budget is None:
+        return cache.Classify
+    return functools.partial(cache.Classify, budget=budget)
 
-        accounts = api.fetch_next(accounts)
 
-        if accounts is None:
+def indexed_rest(page_ids, indexed_ids, positions):
+    """
+    If the page ends with a run of indexed_ids, in the same order, get the
+    indexed ids following that run, else None. positions maps each indexed
+    id to its index in indexed_ids.
+    """
+    for i, id in enumerate(page_ids):
+        start = positions.get(id)
+        if start is None:
+            continue
+        end = start + len(page_ids) - i
+        if indexed_ids[start:end] == page_ids[i:]:
+            return indexed_ids[end:]
+        return None
+    return None
+
+
+def iter_sample(
+    fetch_first,
+    api,
+    cache,
+    max_calls,
+    collection,
+    export,
+    rng,
+    deadline,
+    budget=None,
+    user_id=None,
+):
+    """
+    Classify a random sample of the accounts on up to max_calls pages,
+    yielding an Analysis of the sample so far after each page, and a final
+    one that is flagged incomplete if pagination or budget stopped it
+    early. Accounts are classified only when they make it into the sample,
+    and exported once the sample is final.
+
+    If cache has an index and a viewer, and user_id is given, the
+    collection of user_id as the viewer saw it is answered from the index
+    when it's fresh. Otherwise pages are fetched until one only has indexed
+    accounts, and the rest are taken from the index.
+    """
+    # Get a maximum of 3000 users (randomly sampled)
+    sample = Reservoir(100 * MAX_USERS_LOOKUP_CALLS, rng)
+    pages = Paginator(fetch_first, api, max_calls, deadline)
+    classify = budget_classifier(cache, budget)
+    complete = True
+
+    # Exports need the accounts themselves, which aren't indexed. Who may
+    # see a follow graph depends on the viewer, so it's only reused by them.
+    index = None
+    if user_id is not None and export is None and cache.viewer is not None:
+        index = cache.index
+    indexed = known = None
+    if index is not None:
+        indexed = index.edges(
+            cache.instance, cache.viewer, user_id, collection
+        )
+    if indexed is not None:
+        indexed_ids, age = indexed
+        known = cache.IndexedClassifications(indexed_ids)
+        positions = {id: i for i, id in enumerate(indexed_ids)}
+        if age < index.ttl and all(id in known for id in indexed_ids):
+            for id in indexed_ids:
+                sample.add((None, known[id]))
+            yield sample_analysis(sample)
+            return
+
+    ids = []
+    for page in pages:
+        for user in fetch_users(page, cache):
+            if budget is not None and budget.exceeded:
+                complete = False
+                break
+
+            ids.append(user.id)
+            slot = sample.add(None)
+            if slot is not None:
+                # Accounts are only kept if they're to be exported.
+                sample.items[slot] = (
+                    user if export is not None else None,
+                    classify(user),
+                )
+
+        rest = None
+        if complete and indexed is not None:
+            rest = indexed_rest(
+                [user.id for user in page], indexed_ids, positions
+            )
+        if rest is not None and all(id in known for id in rest):
+            # Accounts are listed newest first, so the rest of the
+            # collection hasn't changed since it was indexed, save for
+            # accounts that left it.
+            for id in rest:
+                ids.append(id)
+                sample.add((None, known[id]))
             break
 
-    if following_accounts is None:
-        return Analysis(0, 0)
+        yield sample_analysis(sample)
+        if not complete:
+            break
 
-    # Get a maximum of 3000 users (randomly sampled)
-    if len(following_accounts) > 100 * MAX_USERS_LOOKUP_CALLS:
-        following_sample = random.sample(
-            following_accounts, 100 * MAX_USERS_LOOKUP_CALLS
+    an = sample_analysis(sample)
+    an.complete = complete and pages.complete
+    an.rate_limited = pages.rate_limited
+    yield an
+
+    if index is not None and an.complete:
+        index.set_edges(cache.instance, cache.viewer, user_id, collection, ids)
+    if cache.index is not None:
+        cache.SaveClassifications()
+
+    if export is not None:
+        for user, (g, declared, source) in sample.items:
+            export(collection, user, g, declared, source)
+
+
+def iter_following(
+    user_id,
+    list_id,
+    api,
+    cache,
+    export=None,
+    rng=None,
+    deadline=None,
+    budget=None,
+):
+    """
+    Like analyze_following, but yield the Analysis so far after each page.
+    """
+    if list_id is not None:
+        fetch_first = functools.partial(
+            api.list_accounts, id=list_id, limit=80
         )
     else:
-        following_sample = following_accounts
+        fetch_first = functools.partial(
+            api.account_following, id=user_id, limit=80
+        )
+
+    return iter_sample(
+        fetch_first,
+        api,
+        cache,
+        MAX_FOLLOWING_PAGES,
+        "following",
+        export,
+        rng,
+        deadline,
+        budget,
+        # A list's accounts aren't the user's follow graph.
+        user_id if list_id is None else None,
+    )
 
-    users = fetch_users(following_sample, cache)
-    return analyze_users(users, ids_fetched=len(following_sample))
 
+def analyze_following(
+    user_id,
+    list_id,
+    api,
+    cache,
+    export=None,
+    rng=None,
+    deadline=None,
+    budget=None,
+):
+    return last(
+        iter_following(
+            user_id, list_id, api, cache, export, rng, deadline, budget
+        )
+    )
 
-def analyze_followers(user_id, api, cache):
 
-    follower_accounts = []
-    accounts = api.account_followers(id=user_id, limit=80)
+def iter_followers(
+    user_id, api, cache, export=None, rng=None, deadline=None, budget=None
+):
+    """
+    Like analyze_followers, but yield the Analysis so far after each page.
+    """
+    return iter_sample(
+        functools.partial(api.account_followers, id=user_id, limit=80),
+        api,
+        cache,
+        MAX_FOLLOWER_PAGES,
+        "followers",
+        export,
+        rng,
+        deadline,
+        budget,
+        user_id,
+    )
 
-    for _ in range(MAX_GET_FOLLOWER_IDS_CALLS - 1):
-        if not accounts:
-            break
 
-        follower_accounts.extend(accounts)
+def analyze_followers(
+    user_id, api, cache, export=None, rng=None, deadline=None, budget=None
+):
+    return last(
+        iter_followers(user_id, api, cache, export, rng, deadline, budget)
+    )
 
-        accounts = api.fetch_next(accounts)
 
-        if accounts is None:
-            break
+# Lists analyzed at once by iter_lists.
+MAX_LIST_CONCURRENCY = 4
 
-    if follower_accounts is None:
-        return Analysis(0, 0)
 
-    # Get a maximum of 3000 users (randomly sampled)
-    if len(follower_accounts) > 100 * MAX_USERS_LOOKUP_CALLS:
-        followers_sample = random.sample(
-            follower_accounts, 100 * MAX_USERS_LOOKUP_CALLS
+def iter_lists(
+    lists,
+    api,
+    cache,
+    concurrency=MAX_LIST_CONCURRENCY,
+    export=None,
+    rng=None,
+    deadline=None,
+    budget=None,
+):
+    """
+    Analyze the members of every list in lists, dicts with "id" and "name"
+    like get_following_lists returns, up to concurrency lists at a time.
+    Yield (list, Analysis) pairs as the lists finish. The lists share
+    cache, so accounts on several of them are classified once.
+    """
+
+    def analyze_list(lst, list_rng):
+        return last(
+            iter_sample(
+                functools.partial(api.list_accounts, id=lst["id"], limit=80),
+                api,
+                cache,
+                MAX_FOLLOWING_PAGES,
+                f"list:{lst['id']}",
+                export,
+                list_rng,
+                deadline,
+                budget,
+            )
         )
-    else:
-        followers_sample = follower_accounts
 
-    # Sample of 40
-    users = fetch_users(followers_sample, cache)
-    return analyze_users(users, ids_fetched=len(followers_sample))
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Seed every list's sample up front, so they're reproducible no
+        # matter which thread gets to the rng first.
+        futures = {
+            executor.submit(
+                analyze_list,
+                lst,
+                None if rng is None else random.Random(rng.random()),
+            ): lst
+            for lst in lists
+        }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def analyze_lists(
+    lists,
+    api,
+    cache,
+    concurrency=MAX_LIST_CONCURRENCY,
+    export=None,
+    rng=None,
+    deadline=None,
+    budget=None,
+):
+    """
+    Like iter_lists, but return {list id: Analysis}, in the order of lists.
+    """
+    results = {
+        lst["id"]: an
+        for lst, an in iter_lists(
+            lists, api, cache, concurrency, export, rng, deadline, budget
+        )
+    }
+    return {lst["id"]: results[lst["id"]] for lst in lists}
 
 
 """
@@ -539,92 +2014,217 @@ Analyze the timeline containing the user's following and followers' toots
 """
 
 
-def analyze_timeline(user_id, list_id, api, cache):
+def iter_timeline(
+    user_id, list_id, api, cache, export=None, deadline=None, budget=None
+):
+    """
+    Like analyze_timeline, but yield the Analysis so far after each page,
+    and a final one that is flagged incomplete if pagination or budget
+    stopped it early.
+    """
     # Timeline-functions are limited to 40 statuses
-    timeline_accounts = []
-
     if list_id is not None:
-        statuses = api.timeline_list(id=list_id, limit=40)
+        fetch_first = functools.partial(
+            api.timeline_list, id=list_id, limit=40
+        )
     else:
-        statuses = api.timeline_home(limit=40)
+        fetch_first = functools.partial(api.timeline_home, limit=40)
 
-    # Max 400 toots, 40 at a time.
-    for _ in range(MAX_TIMELINE_CALLS):
-        if not statuses:
-            break
+    an = Analysis(0, 0)
+    classify = budget_classifier(cache, budget)
+    complete = True
 
-        timeline_accounts.extend(
-            [s.account for s in statuses if s.account.id != user_id]
-        )
+    # Max 400 toots, 40 at a time.
+    pages = Paginator(fetch_first, api, MAX_TIMELINE_CALLS, deadline)
+    for page in pages:
+        accounts = [s.account for s in page if s.account.id != user_id]
+        for user in fetch_users(accounts, cache):
+            if budget is not None and budget.exceeded:
+                complete = False
+                break
 
-        statuses = api.fetch_next(statuses)
+            g, declared, source = classify(user)
+            an.update(g, declared)
+            an.ids_sampled += 1
+            if export is not None:
+                export("timeline", user, g, declared, source)
 
-        if statuses is None:
+        an.ids_fetched += len(accounts)
+        yield Analysis.from_tuple(an.as_tuple())
+        if not complete:
             break
 
-    if not timeline_accounts:
-        return Analysis(0, 0)
+    an.complete = complete and pages.complete
+    an.rate_limited = pages.rate_limited
+    yield an
 
-    # Reduce to unique list of ids
-    timeline_accounts = list(timeline_accounts)
-    users = fetch_users(timeline_accounts, cache)
-    return analyze_users(users, ids_fetched=len(timeline_accounts))
+
+def analyze_timeline(
+    user_id, list_id, api, cache, export=None, deadline=None, budget=None
+):
+    return last(
+        iter_timeline(user_id, list_id, api, cache, export, deadline, budget)
+    )
 
 
 """
-Analyze the timeline containing the user's own toots.
-This method is never called when deploying the server. 
+Analyze the accounts the user boosts, replies to and mentions in their own toots.
 """
 
 
-def analyze_my_timeline(user_id, api, cache):
-    timeline_ids = []
+def get_accounts(account_ids, api):
+    """
+    Fetch several accounts with one call to the multi-account endpoint,
+    falling back to one call per account on Mastodon.py or servers that
+    don't support it. Other errors are raised, for call_with_retries.
+    """
+    from mastodon import MastodonError, MastodonNotFoundError
 
-    # Timeline-functions are limited to 40 statuses
-    statuses = api.timeline_home(limit=40)
+    try:
+        return api.accounts(account_ids)
+    except AttributeError:
+        pass
+    except MastodonError as exc:
+        if not endpoint_unavailable(exc):
+            raise
 
-    # Max 400 toots, 40 at a time.
-    for _ in range(1, MAX_TIMELINE_CALLS):
+    accounts = []
+    for account_id in account_ids:
+        try:
+            accounts.append(api.account(account_id))
+        except MastodonNotFoundError:
+            continue
 
-        if not statuses:
-            break
+    return accounts
 
-        timeline_ids.extend(
-            [s.account.id for s in statuses if s.account.id != user_id]
-        )
 
-        statuses = api.fetch_next(statuses)
+def lookup_users(user_ids, api, cache, deadline=None):
+    """
+    Resolve a list of account ids, possibly repeated, to accounts. Only ids
+    missing from the cache are fetched, 40 per call. Returns the accounts,
+    False if some calls failed or the deadline passed, True otherwise, and
+    whether a call failed for the rate limit.
+    """
+    from mastodon import MastodonRatelimitError
+
+    errors = retryable_errors()
+    users = cache.UsersLookup(user_ids)
+
+    uncached_ids = cache.UncachedUsers(user_ids)
+    uncached_ids = uncached_ids[: 40 * MAX_ACCOUNTS_LOOKUP_CALLS]
 
-        if statuses is None:
+    fetched = {}
+    complete = True
+    rate_limited = False
+    for account_ids in batch(uncached_ids, 40):
+        if time_left(deadline) <= 0:
+            complete = False
+            break
+
+        try:
+            accounts = call_with_retries(
+                functools.partial(get_accounts, account_ids, api),
+                deadline,
+                api,
+            )
+        except errors as exc:
+            complete = False
+            rate_limited = isinstance(exc, MastodonRatelimitError)
             break
 
-    reblog_ids = []
+        for account in accounts:
+            fetched[account.id] = account
+
+    cache.AddUsers(fetched.values())
+    users.extend(fetched[uid] for uid in user_ids if uid in fetched)
+    return users, complete, rate_limited
+
+
+def analyze_my_timeline(
+    user_id, api, cache, export=None, deadline=None, budget=None
+):
+    reblog_accounts = []
     reply_ids = []
-    timeline_ids = []
-    # TODO: This is from Twitter and doesn't match Mastodon statuses
-    for s in statuses:
+    mention_ids = []
+
+    # Timeline-functions are limited to 40 statuses
+    pages = Paginator(
+        functools.partial(api.account_statuses, user_id, limit=40),
+        api,
+        MAX_TIMELINE_CALLS,
+        deadline,
+    )
+
+    # Max 400 toots, 40 at a time.
+    for s in itertools.chain.from_iterable(pages):
         if s.reblog is not None:
-            reblog_ids.append(s.reblog.account.id)
-        elif s.in_reply_to_id is not None:
-            for i in s.mentions:
-                reply_ids.append(i.id)
-        elif len(s.mentions) > 0:
-            for i in s.mentions:
-                timeline_ids.append(i.id)
-
-    outdict = {
-        "boosts": reblog_ids,
-        "replies": reply_ids,
-        "mentions": timeline_ids,
-    }
-    # newdict = {}
-    # for ids in outdict.keys():
-    #    users = fetch_users(outdict.get(ids), cache)
-    #    newdict[ids] = analyze_users(users, ids_fetched=len(outdict.get(ids)))
-    return outdict
+            if s.reblog.account.id != user_id:
+                reblog_accounts.append(s.reblog.account)
+            continue
+
+        reply_id = s.in_reply_to_account_id
+        if reply_id is not None and reply_id != user_id:
+            reply_ids.append(reply_id)
+
+        mention_ids.extend(
+            m.id for m in s.mentions if m.id not in (user_id, reply_id)
+        )
+
+    # Boosted toots embed their author, no need to look them up again.
+    cache.AddUsers(reblog_accounts)
+
+    boosts = analyze_users(
+        reblog_accounts,
+        ids_fetched=len(reblog_accounts),
+        export=export,
+        collection="boosts",
+        budget=budget,
+        cache=cache,
+    )
+    boosts.complete = boosts.complete and pages.complete
+    boosts.rate_limited = pages.rate_limited
+    results = {"boosts": boosts}
+
+    # Accounts classified in the index needn't be fetched, unless they're
+    # to be exported.
+    index = cache.index if export is None else None
+    for collection, ids in [("replies", reply_ids), ("mentions", mention_ids)]:
+        known = {}
+        if index is not None:
+            known = cache.IndexedClassifications(ids)
+
+        users, complete, rate_limited = lookup_users(
+            [id for id in ids if id not in known], api, cache, deadline
+        )
+        an = analyze_users(
+            users,
+            ids_fetched=len(ids),
+            export=export,
+            collection=collection,
+            budget=budget,
+            cache=cache,
+        )
+        for id in ids:
+            if id in known:
+                g, declared, _ = known[id]
+                an.ids_sampled += 1
+                an.update(g, declared)
+
+        an.complete = an.complete and pages.complete and complete
+        an.rate_limited = pages.rate_limited or rate_limited
+        results[collection] = an
+
+    if cache.index is not None:
+        cache.SaveClassifications()
+
+    return results
 
 
 def get_access_token(client_id, client_secret, instance):
+    import webbrowser
+
+    from requests_oauthlib import OAuth2Session
+
     AUTHORIZATION_URL = f"https://{instance}/oauth/authorize"
     TOKEN_URL = f"https://{instance}/oauth/token"
     REDIRECT_URI = "urn:ietf:wg:oauth:2.0:oob"
@@ -688,15 +2288,693 @@ def parse_mastodon_handle(handle):
     return username, instance
 
 
-def get_user_from_handle(handle, api):
-    username, _ = parse_mastodon_handle(handle)
-    accounts = api.account_search(username, limit=1)
+class HandleCache(object):
+    """
+    Persistent handle -> account id mappings, kept in SQLite for ttl
+    seconds.
+    """
+
+    def __init__(self, path="handles.db", ttl=24 * 60 * 60):
+        self.path = path
+        self.ttl = ttl
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS handles ("
+                "handle TEXT PRIMARY KEY, account_id TEXT NOT NULL, "
+                "resolved REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def get(self, handle):
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT account_id FROM handles "
+                "WHERE handle = ? AND resolved > ?",
+                (handle, time.time() - self.ttl),
+            ).fetchone()
+
+        return None if row is None else json.loads(row[0])
+
+    def set(self, handle, account_id):
+        with self._connect() as db:
+            db.execute(
+                "INSERT OR REPLACE INTO handles VALUES (?, ?, ?)",
+                (handle, json.dumps(account_id), time.time()),
+            )
 
-    if accounts:
-        account = accounts[0]
-        return account
+    def delete(self, handle):
+        with self._connect() as db:
+            db.execute("DELETE FROM handles WHERE handle = ?", (handle,))
+
+
+class GraphIndex(object):
+    """
+    Classifications of accounts, and the accounts each user follows and is
+    followed by, kept in SQLite. Classifications are shared by the analyses
+    of every user of an instance, so that accounts in many of their
+    networks are classified once. Follow graphs are kept per viewer, the
+    account whose token fetched them, since locked accounts and accounts
+    hiding their collections only show them to some. Follow graphs indexed
+    less than ttl seconds ago are used as they are, and follow graphs and
+    classifications less than max_age seconds old are topped up with what
+    changed since.
+    """
+
+    # Bumped when the tables change. They only hold what can be fetched
+    # again, so older ones are dropped.
+    SCHEMA_VERSION = 2
+
+    def __init__(
+        self, path="graph.db", ttl=24 * 60 * 60, max_age=7 * 24 * 60 * 60
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_age = max_age
+        with self._connect() as db:
+            (version,) = db.execute("PRAGMA user_version").fetchone()
+            if version < self.SCHEMA_VERSION:
+                db.executescript(
+                    "DROP TABLE IF EXISTS graphs; DROP TABLE IF EXISTS edges;"
+                    "PRAGMA user_version = {}".format(self.SCHEMA_VERSION)
+                )
+            db.executescript(
+                "CREATE TABLE IF NOT EXISTS accounts ("
+                "instance TEXT NOT NULL, id TEXT NOT NULL, "
+                "gender TEXT NOT NULL, declared INTEGER NOT NULL, "
+                "source TEXT NOT NULL, classified REAL NOT NULL, "
+                "PRIMARY KEY (instance, id));"
+                "CREATE TABLE IF NOT EXISTS graphs ("
+                "instance TEXT NOT NULL, viewer TEXT NOT NULL, "
+                "user_id TEXT NOT NULL, collection TEXT NOT NULL, "
+                "fetched REAL NOT NULL, "
+                "PRIMARY KEY (instance, viewer, user_id, collection));"
+                "CREATE TABLE IF NOT EXISTS edges ("
+                "instance TEXT NOT NULL, viewer TEXT NOT NULL, "
+                "user_id TEXT NOT NULL, collection TEXT NOT NULL, "
+                "account_id TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS edges_by_user "
+                "ON edges (instance, viewer, user_id, collection);"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def classifications(self, instance, ids):
+        """
+        Get {id: (gender, declared, source)} for those of ids classified
+        less than max_age seconds ago.
+        """
+        keys = {json.dumps(id): id for id in ids}
+        found = {}
+        with self._connect() as db:
+            # Within SQLite's limit on query parameters.
+            for chunk in batch(list(keys), 500):
+                rows = db.execute(
+                    "SELECT id, gender, declared, source FROM accounts "
+                    "WHERE instance = ? AND classified > ? "
+                    "AND id IN ({})".format(", ".join("?" * len(chunk))),
+                    (instance, time.time() - self.max_age, *chunk),
+                )
+                for key, gender, declared, source in rows:
+                    found[keys[key]] = (gender, bool(declared), source)
+        return found
+
+    def add_classifications(self, instance, classified):
+        """
+        Save classified, {id: (gender, declared, source)}.
+        """
+        now = time.time()
+        with self._connect() as db:
+            db.executemany(
+                "INSERT OR REPLACE INTO accounts VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (instance, json.dumps(id), g, declared, source, now)
+                    for id, (g, declared, source) in classified.items()
+                ],
+            )
+
+    def edges(self, instance, viewer, user_id, collection):
+        """
+        Get (account ids, age in seconds) of the collection of user_id,
+        "following" or "followers", as viewer saw it, or None if viewer
+        didn't index it in the last max_age seconds.
+        """
+        key = (instance, json.dumps(viewer), json.dumps(user_id), collection)
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT fetched FROM graphs WHERE instance = ? AND viewer = ? "
+                "AND user_id = ? AND collection = ? AND fetched > ?",
+                key + (time.time() - self.max_age,),
+            ).fetchone()
+            if row is None:
+                return None
+
+            ids = [
+                json.loads(account_id)
+                for account_id, in db.execute(
+                    "SELECT account_id FROM edges WHERE instance = ? "
+                    "AND viewer = ? AND user_id = ? AND collection = ? "
+                    "ORDER BY rowid",
+                    key,
+                )
+            ]
+        return ids, time.time() - row[0]
+
+    def set_edges(self, instance, viewer, user_id, collection, ids):
+        """
+        Save the account ids of the collection of user_id, as viewer saw
+        it, in the order they were fetched.
+        """
+        key = (instance, json.dumps(viewer), json.dumps(user_id), collection)
+        with self._connect() as db:
+            db.execute(
+                "DELETE FROM edges WHERE instance = ? AND viewer = ? "
+                "AND user_id = ? AND collection = ?",
+                key,
+            )
+            db.executemany(
+                "INSERT INTO edges VALUES (?, ?, ?, ?, ?)",
+                [key + (json.dumps(id),) for id in ids],
+            )
+            db.execute(
+                "INSERT OR REPLACE INTO graphs VALUES (?, ?, ?, ?, ?)",
+                key + (time.time(),),
+            )
+
+
+def lookup_account(handle, api):
+    """
+    Find the account of handle with the accounts/lookup endpoint, falling
+    back to a search, which is much slower and only trusted on an exact
+    match, on servers or Mastodon.py versions without it. Returns None if
+    there's no such account.
+    """
+    from mastodon import MastodonError, MastodonNotFoundError
+
+    username, instance = parse_mastodon_handle(handle)
+    acct = f"{username}@{instance}" if instance else username
+
+    account_lookup = getattr(api, "account_lookup", None)
+    if account_lookup is not None:
+        try:
+            return account_lookup(acct)
+        except MastodonError as exc:
+            if not endpoint_unavailable(exc):
+                if isinstance(exc, MastodonNotFoundError):
+                    return None
+                raise
+
+    accounts = api.account_search(acct, limit=5)
+    for account in accounts:
+        if account.acct.lower() in (username.lower(), acct.lower()):
+            return account
+
+    # A bare username can only be searched for.
+    if instance is None and accounts:
+        return accounts[0]
+
+    return None
+
+
+def _handle_key(handle, api):
+    # Account ids are only meaningful on the instance that issued them.
+    username, instance = parse_mastodon_handle(handle.lower())
+    base_url = getattr(api, "api_base_url", "")
+    return f"{base_url} {username}@{instance or ''}"
+
+
+def get_user_from_handle(handle, api, handle_cache=None):
+    from mastodon import MastodonNotFoundError
+
+    key = _handle_key(handle, api)
+    if handle_cache is not None:
+        account_id = handle_cache.get(key)
+        if account_id is not None:
+            try:
+                return api.account(account_id)
+            except MastodonNotFoundError:
+                handle_cache.delete(key)
+
+    account = lookup_account(handle, api)
+    if account is not None and handle_cache is not None:
+        handle_cache.set(key, account.id)
+
+    return account
+
+
+def resolve_account_id(handle, api, handle_cache=None):
+    """
+    Like get_user_from_handle, but only get the account id, which needs no
+    request at all if it's in handle_cache.
+    """
+    if handle_cache is not None:
+        account_id = handle_cache.get(_handle_key(handle, api))
+        if account_id is not None:
+            return account_id
+
+    user = get_user_from_handle(handle, api, handle_cache)
+    return None if user is None else user.id
+
+
+class Progress(object):
+    """
+    Live progress of one user's analyses, rewritten in place on one line of
+    out: pages fetched out of those expected, accounts classified per
+    second, and an estimate of the time left.
+    """
+
+    # Methods that fetch a page of a collection, or the page after it.
+    PAGED = (
+        "account_following",
+        "account_followers",
+        "account_statuses",
+        "timeline_home",
+        "timeline_list",
+        "list_accounts",
+        "fetch_next",
+    )
+
+    def __init__(self, budget, expected_pages, out=sys.stderr, interval=0.2):
+        self.budget = budget
+        self.expected_pages = expected_pages
+        self.pages = 0
+        self._out = out
+        self._interval = interval
+        self._start = self._shown = time.monotonic()
+        self._closed = False
+        # Pages are fetched by several collectors at once.
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def expected(user):
+        """
+        Estimate the pages analyze_handle fetches for user, an account.
+        """
+
+        def pages(n, size, max_calls):
+            return max(1, min(max_calls, math.ceil(n / size)))
+
+        return (
+            pages(user.following_count, 80, MAX_FOLLOWING_PAGES)
+            + pages(user.followers_count, 80, MAX_FOLLOWER_PAGES)
+            + MAX_TIMELINE_CALLS
+            + pages(user.statuses_count, 40, MAX_TIMELINE_CALLS)
+        )
+
+    def wrap(self, api):
+        """
+        Get api, with the pages it fetches counted.
+        """
+        progress = self
+
+        class ProgressApi(object):
+            def __getattr__(self, name):
+                method = getattr(api, name)
+                if name not in Progress.PAGED:
+                    return method
+
+                def counted(*args, **kwargs):
+                    page = method(*args, **kwargs)
+                    if page:
+                        progress.page()
+                    return page
+
+                return counted
+
+        return ProgressApi()
+
+    def page(self):
+        with self._lock:
+            if self._closed:
+                return
+            self.pages += 1
+            now = time.monotonic()
+            if now - self._shown < self._interval:
+                return
+            self._shown = now
+        self._out.write("\r" + self.line())
+        self._out.flush()
+
+    def line(self):
+        elapsed = time.monotonic() - self._start
+        # Estimates fall short when users gain followers meanwhile.
+        expected = max(self.expected_pages, self.pages)
+        return (
+            "{}/{} pages, {} accounts, {:.0f} accounts/s, "
+            "ETA {:.0f} s ".format(
+                self.pages,
+                expected,
+                self.budget.accounts,
+                div(self.budget.accounts, elapsed),
+                div(elapsed * (expected - self.pages), self.pages),
+            )
+        )
+
+    def close(self):
+        with self._lock:
+            # Collectors left running after a failure keep fetching pages.
+            self._closed = True
+        self._out.write("\r" + self.line() + "\n")
+        self._out.flush()
+
+
+def analyze_handle(
+    handle,
+    api,
+    cache,
+    exporter=None,
+    rng=None,
+    handle_cache=None,
+    budget=None,
+    concurrency=1,
+    progress=None,
+):
+    """
+    Run every analysis for one user handle, keyed by collection name.
+    Per-account decisions are written to exporter, if given, and rng is
+    used for sampling. The analyses share ANALYSIS_TIME_BUDGET and budget,
+    by default Budget.from_env(), and those cut short are flagged
+    incomplete.
+
+    Up to concurrency collectors run at once, and the first one to fail
+    fails the rest. With a seeded rng they take the same samples either
+    way, as long as neither the deadline nor budget cuts them short, since
+    which accounts make it in time depends on how the collectors
+    interleave. If progress is a file, their Progress is shown on it.
+    """
+    if progress is not None:
+        # Progress needs the size of the collections.
+        user = get_user_from_handle(handle, api, handle_cache)
+        user_id = None if user is None else user.id
     else:
-        return None
+        user_id = resolve_account_id(handle, api, handle_cache)
+    if user_id is None:
+        raise ValueError(f"Failed to find user {handle}.")
+
+    export = None
+    if exporter is not None:
+        export = functools.partial(exporter.write, handle)
+
+    if budget is None:
+        budget = Budget.from_env()
+    if progress is not None:
+        progress = Progress(budget, Progress.expected(user), progress)
+        api = progress.wrap(api)
+    deadline = time.monotonic() + ANALYSIS_TIME_BUDGET
+
+    # Seed the samples up front, so they're reproducible no matter which
+    # thread gets to the rng first.
+    following_rng, followers_rng = (
+        (None, None)
+        if rng is None
+        else (random.Random(rng.random()), random.Random(rng.random()))
+    )
+    collectors = [
+        functools.partial(
+            analyze_following,
+            user_id,
+            None,
+            api,
+            cache,
+            export,
+            following_rng,
+            deadline,
+            budget,
+        ),
+        functools.partial(
+            analyze_followers,
+            user_id,
+            api,
+            cache,
+            export,
+            followers_rng,
+            deadline,
+            budget,
+        ),
+        functools.partial(
+            analyze_timeline,
+            user_id,
+            None,
+            api,
+            cache,
+            export,
+            deadline,
+            budget,
+        ),
+        functools.partial(
+            analyze_my_timeline, user_id, api, cache, export, deadline, budget
+        ),
+    ]
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = [executor.submit(collector) for collector in collectors]
+        done, _ = wait(futures, return_when=FIRST_EXCEPTION)
+        # Raise the first failure before waiting on the results of earlier
+        # collectors, which may still be running.
+        for future in futures:
+            if future in done and future.exception() is not None:
+                raise future.exception()
+        following, followers, timeline, mine = [
+            future.result() for future in futures
+        ]
+    finally:
+        # Once a collector fails, the others' results would be thrown away:
+        # those not started are cancelled, and those running left behind.
+        executor.shutdown(wait=False, cancel_futures=True)
+        if progress is not None:
+            progress.close()
+
+    results = {
+        "following": following,
+        "followers": followers,
+        "timeline": timeline,
+    }
+    results.update(mine)
+    return results
+
+
+# The collections analyze_handle analyzes, in order.
+COLLECTIONS = (
+    "following",
+    "followers",
+    "timeline",
+    "boosts",
+    "replies",
+    "mentions",
+)
+
+RESULT_FIELDS = [
+    "handle",
+    "collection",
+    "ids_sampled",
+    "ids_fetched",
+    "nonbinary",
+    "nonbinary_declared",
+    "male",
+    "male_declared",
+    "female",
+    "female_declared",
+    "andy",
+    "complete",
+    "rate_limited",
+    "error",
+]
+
+
+def incomplete_label(label, an):
+    """
+    label, marked if an is incomplete, and why if it's the rate limit.
+    """
+    if an.rate_limited:
+        return f"{label} (rate limited)"
+    return label if an.complete else f"{label} (incomplete)"
+
+
+def analysis_rows(handle, results):
+    for collection, an in results.items():
+        yield {
+            "handle": handle,
+            "collection": collection,
+            "ids_sampled": an.ids_sampled,
+            "ids_fetched": an.ids_fetched,
+            "nonbinary": an.nonbinary.n,
+            "nonbinary_declared": an.nonbinary.n_declared,
+            "male": an.male.n,
+            "male_declared": an.male.n_declared,
+            "female": an.female.n,
+            "female_declared": an.female.n_declared,
+            "andy": an.andy.n,
+            "complete": an.complete,
+            "rate_limited": an.rate_limited,
+            "error": "",
+        }
+
+
+def read_done_handles(path):
+    """
+    Handles that already have results in a previous batch output file, so an
+    interrupted batch can pick up where it stopped. Failed handles are retried.
+    """
+    if not os.path.exists(path):
+        return set()
+
+    with open(path, newline="", encoding="utf-8") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = []
+            for line in f:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    # Truncated last line of an interrupted run.
+                    continue
+
+    return {row["handle"] for row in rows if not row.get("error")}
+
+
+def make_pooled_session(pool_size=10):
+    """
+    A requests session keeping up to pool_size connections per host open,
+    whose requests made by call_with_retries time out by its deadline.
+    """
+    import requests
+
+    class DeadlineAdapter(requests.adapters.HTTPAdapter):
+        def send(self, request, timeout=None, **kwargs):
+            deadline = _call_deadline.deadline
+            if deadline is not None and not isinstance(timeout, tuple):
+                left = time_left(deadline)
+                # urllib3 doesn't take a timeout of 0.
+                timeout = max(min(left, timeout or left), 0.01)
+            return super().send(request, timeout=timeout, **kwargs)
+
+    session = requests.Session()
+    adapter = DeadlineAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size
+    )
+    session.mount("https://", adapter)
+    return session
+
+
+def iter_concurrently(handles, analyze, concurrency=4):
+    """
+    Call analyze(handle) for every handle, up to concurrency at a time, and
+    yield (handle, result, error) as each one finishes, where error is the
+    exception it raised, if any. Once the caller stops iterating, e.g. on
+    Ctrl-C, handles that haven't started are cancelled rather than run, so
+    close the iterator when stopping early.
+    """
+    executor = ThreadPoolExecutor(max_workers=concurrency)
+    try:
+        futures = {
+            executor.submit(analyze, handle): handle for handle in handles
+        }
+        for future in as_completed(futures):
+            try:
+                result, error = future.result(), None
+            except Exception as exc:
+                result, error = None, exc
+            yield futures[future], result, error
+    finally:
+        # Handles still running finish, but their results are discarded.
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def run_batch(
+    handles,
+    api,
+    cache,
+    output,
+    concurrency=4,
+    progress=sys.stderr,
+    exporter=None,
+    handle_cache=None,
+    seed=None,
+):
+    """
+    Analyze many handles concurrently with one shared client and cache,
+    appending each handle's rows to output (JSONL, or CSV if the name ends in
+    .csv) as soon as it finishes. Handles already in output are skipped.
+    Each handle's samples are seeded with seed and the handle, if given.
+
+    Every handle is analyzed through api, so handles on other instances are
+    analyzed as far as api's instance knows them, like in the server.
+    """
+    as_csv = output.endswith(".csv")
+    write_header = as_csv and (
+        not os.path.exists(output) or os.path.getsize(output) == 0
+    )
+    if as_csv and not write_header:
+        with open(output, newline="", encoding="utf-8") as f:
+            header = next(csv.reader(f), [])
+        if header != RESULT_FIELDS:
+            raise ValueError(
+                f"{output} has other columns than this version writes, "
+                "it can't be resumed; write to a new file instead"
+            )
+
+    done = read_done_handles(output)
+    todo = [h for h in dict.fromkeys(handles) if h not in done]
+
+    def analyze(handle):
+        return analyze_handle(
+            handle,
+            api,
+            cache,
+            exporter,
+            None if seed is None else random.Random(f"{seed}:{handle}"),
+            handle_cache=handle_cache,
+        )
+
+    start = time.time()
+    n_accounts = 0
+
+    with open(output, "a", newline="", encoding="utf-8") as f, closing(
+        iter_concurrently(todo, analyze, concurrency)
+    ) as finished:
+        if as_csv:
+            writer = csv.DictWriter(f, fieldnames=RESULT_FIELDS)
+            if write_header:
+                writer.writeheader()
+
+        for i, (handle, results, error) in enumerate(finished, 1):
+            if error is None:
+                rows = list(analysis_rows(handle, results))
+            else:
+                row = dict.fromkeys(RESULT_FIELDS, "")
+                row.update(handle=handle, error=str(error))
+                rows = [row]
+
+            for row in rows:
+                if as_csv:
+                    writer.writerow(row)
+                else:
+                    f.write(json.dumps(row) + "\n")
+            f.flush()
+
+            n_accounts += sum(row["ids_sampled"] or 0 for row in rows)
+            elapsed = time.time() - start
+            print(
+                "[{}/{}] {}{}\t{:.1f} accounts/s".format(
+                    i,
+                    len(todo),
+                    handle,
+                    " (failed)" if rows[0]["error"] else "",
+                    div(n_accounts, elapsed),
+                ),
+                file=progress,
+            )
+
+    print(
+        "Analyzed {} handles ({} skipped) in {:.2f} seconds, "
+        "cache hit ratio {}%".format(
+            len(todo), len(done), time.time() - start, cache.hit_percentage
+        ),
+        file=progress,
+    )
 
 
 if __name__ == "__main__":
@@ -707,78 +2985,295 @@ if __name__ == "__main__":
         "Mastodon following accounts, followers and"
         "your timeline"
     )
-    p.add_argument("user_handle", nargs=1)
+    p.add_argument("user_handle", nargs="?")
     p.add_argument(
         "--self",
         help="perform gender analysis on own user handle",
         action="store_true",
     )
     p.add_argument("--dry-run", help="fake results", action="store_true")
+    p.add_argument(
+        "--batch",
+        metavar="FILE",
+        help="analyze every handle listed in FILE, one per line, through "
+        "the instance of the first",
+    )
+    p.add_argument(
+        "--output",
+        default="results.jsonl",
+        help="batch results file, JSONL or .csv; resumed if it exists",
+    )
+    p.add_argument(
+        "--concurrency",
+        type=int,
+        default=4,
+        help="handles analyzed in parallel in batch mode, or collections "
+        "of the handle otherwise",
+    )
+    p.add_argument(
+        "--seed",
+        type=int,
+        help="seed the sampling of large collections, for reproducible "
+        "results as long as no analysis runs out of time or budget",
+    )
+    p.add_argument(
+        "--json",
+        help="print the results as JSON",
+        action="store_true",
+    )
+    p.add_argument(
+        "--export",
+        metavar="FILE",
+        help="write every account's classification to FILE, "
+        "CSV or .parquet",
+    )
+    p.add_argument(
+        "--record",
+        metavar="FILE",
+        help="record the API responses to a compressed archive",
+    )
+    p.add_argument(
+        "--replay",
+        metavar="FILE",
+        help="replay API responses recorded with --record, offline",
+    )
+    p.add_argument(
+        "--index",
+        metavar="FILE",
+        default=os.environ.get("GRAPH_INDEX_DB"),
+        help="keep follow graphs and classifications in FILE, and reuse "
+        "them in later runs",
+    )
+    p.add_argument(
+        "--snapshot",
+        metavar="FILE",
+        help="save today's analyses of the handle, or of the --batch "
+        "handles, to FILE; with an --index, graph.db by default",
+    )
+    p.add_argument(
+        "--history",
+        metavar="FILE",
+        help="print the handle's snapshots saved in FILE and exit",
+    )
+    p.add_argument(
+        "--provenance",
+        help="count what decided each classification, and print it",
+        action="store_true",
+    )
     args = p.parse_args()
-    [user_handle] = args.user_handle
 
-    username, instance = parse_mastodon_handle(user_handle)
-
-    client_id = os.environ.get("CLIENT_KEY") or input(
-        "Enter your client key: "
-    )
+    if args.provenance:
+        os.environ["ANALYSIS_PROVENANCE"] = "1"
+    rng = None if args.seed is None else random.Random(args.seed)
+    if args.record:
+        os.environ["MASTODON_RECORD"] = args.record
+    if args.replay:
+        os.environ["MASTODON_REPLAY"] = args.replay
+
+    if args.batch:
+        with open(args.batch, encoding="utf-8") as f:
+            handles = [line.strip() for line in f if line.strip()]
+        if not handles:
+            p.error(f"no handles in {args.batch}")
+        user_handle = handles[0]
+    elif args.user_handle:
+        user_handle = args.user_handle
+    else:
+        p.error("a user handle or --batch FILE is required")
 
-    client_secret = os.environ.get("CLIENT_SECRET") or input(
-        "Enter your client secret: "
-    )
+    username, instance = parse_mastodon_handle(user_handle)
 
     if instance is None:
         instance = input("Enter your Mastodon instance: ")
 
-    if args.dry_run:
+    if args.batch:
+        # The token is only good on one instance, see run_batch.
+        others = {
+            handle_instance.lower()
+            for _, handle_instance in map(parse_mastodon_handle, handles)
+            if handle_instance
+        } - {instance.lower()}
+        if others:
+            print(
+                "Handles on {} are analyzed through {}, from the accounts "
+                "it knows".format(", ".join(sorted(others)), instance),
+                file=sys.stderr,
+            )
+
+    if args.history:
+        from snapshots import SnapshotStore, user_key
+
+        history = SnapshotStore(args.history).history(
+            user_key(user_handle, instance)
+        )
+        print(
+            "{:>12s}\t{:>10s}\t{:>10s}\t{:>10s}\t{:>10s}".format(
+                "", "", "NONBINARY", "MEN", "WOMEN"
+            )
+        )
+        for collection, snapshots in history.items():
+            for date, an in snapshots:
+                print(
+                    "{:>12s}\t{:>10s}\t{:>9.2f}%\t{:>9.2f}%\t{:>9.2f}%"
+                    "{}".format(
+                        collection,
+                        date.isoformat(),
+                        an.pct("nonbinary"),
+                        an.pct("male"),
+                        an.pct("female"),
+                        "" if an.complete else "\t(incomplete)",
+                    )
+                )
+        sys.exit()
+
+    if args.dry_run or os.environ.get("MASTODON_REPLAY"):
         tok = None
+    elif os.environ.get("ACCESS_TOKEN"):
+        tok = os.environ["ACCESS_TOKEN"]
     else:
+        client_id = os.environ.get("CLIENT_KEY") or input(
+            "Enter your client key: "
+        )
+
+        client_secret = os.environ.get("CLIENT_SECRET") or input(
+            "Enter your client secret: "
+        )
+
         tok = get_access_token(client_id, client_secret, instance)
 
+    exporter = None
+    if args.export and not args.dry_run:
+        from export import open_exporter
+
+        exporter = open_exporter(args.export)
+
+    handle_cache = None
+    # Recordings must include the handle lookups to replay them.
+    if not (args.dry_run or args.record or args.replay):
+        handle_cache = HandleCache(
+            os.environ.get("HANDLE_CACHE_DB", "handles.db")
+        )
+
+    index = None
+    if args.snapshot and not args.index:
+        # Daily snapshots only fetch what changed since the day before.
+        args.index = "graph.db"
+    if args.index and not (args.dry_run or args.record or args.replay):
+        index = GraphIndex(args.index)
+
+    if args.snapshot:
+        from snapshots import SnapshotStore, run_snapshots
+
+        session = make_pooled_session(args.concurrency)
+        api = CoalescingApi(
+            get_mastodon_api(tok, instance, session=session), instance
+        )
+        viewer = get_viewer_id(api) if index is not None else None
+        run_snapshots(
+            handles if args.batch else [user_handle],
+            instance,
+            api,
+            Cache(index, instance, viewer),
+            SnapshotStore(args.snapshot),
+            args.concurrency,
+            handle_cache=handle_cache,
+        )
+        sys.exit()
+
+    if args.batch:
+        session = make_pooled_session(args.concurrency)
+        api = CoalescingApi(
+            get_mastodon_api(tok, instance, session=session), instance
+        )
+        viewer = get_viewer_id(api) if index is not None else None
+        try:
+            run_batch(
+                handles,
+                api,
+                Cache(index, instance, viewer),
+                args.output,
+                args.concurrency,
+                exporter=exporter,
+                handle_cache=handle_cache,
+                seed=args.seed,
+            )
+        except ValueError as exc:
+            p.error(str(exc))
+        finally:
+            if exporter is not None:
+                exporter.close()
+        sys.exit()
+
     if args.self:
         if args.dry_run:
             g, declared = "male", True
         else:
             api = get_mastodon_api(tok, instance)
-            g, declared = analyze_self(user_handle, api)
+            g, declared = analyze_self(user_handle, api, handle_cache)
 
-        print("{} ({})".format(g, "declared pronoun" if declared else "guess"))
+        if args.json:
+            print(json.dumps({"gender": g, "declared": declared}))
+        else:
+            print(
+                "{} ({})".format(
+                    g, "declared pronoun" if declared else "guess"
+                )
+            )
         sys.exit()
 
-    print(
-        "{:>25s}\t{:>10s}\t{:>10s}\t{:>10s}\t{:>10s}".format(
-            "", "NONBINARY", "MEN", "WOMEN", "UNKNOWN"
-        )
-    )
-
     start = time.time()
-    cache = Cache()
+    cache = Cache(index, instance)
+    budget = Budget.from_env()
     if args.dry_run:
-        following, followers, timeline, boosts, replies, mentions = (
-            dry_run_analysis()
-        )
+        results = dict(zip(COLLECTIONS, dry_run_analysis()))
     else:
-        api = get_mastodon_api(tok, instance)
-        user_id = get_user_from_handle(user_handle, api).id
-        following = analyze_following(user_id, None, api, cache)
-        followers = analyze_followers(user_id, api, cache)
-        timeline = analyze_timeline(user_id, None, api, cache)
-        # TODO: implement Mastodon-compatible analyze_my_timeline
-        # mytimeline = analyze_my_timeline(user_id, api, cache)
-        # boosts = mytimeline.get("boosts")
-        # replies = mytimeline.get("replies")
-        # mentions = mytimeline.get("mentions")
+        session = make_pooled_session(args.concurrency)
+        api = get_mastodon_api(tok, instance, session=session)
+        if index is not None:
+            cache.viewer = get_viewer_id(api)
+        try:
+            results = analyze_handle(
+                user_handle,
+                api,
+                cache,
+                exporter,
+                rng=rng,
+                handle_cache=handle_cache,
+                budget=budget,
+                concurrency=args.concurrency,
+                progress=sys.stderr if sys.stderr.isatty() else None,
+            )
+        finally:
+            if exporter is not None:
+                exporter.close()
 
     duration = time.time() - start
+    usage = budget.usage()
 
-    for user_type, an in [
-        ("following", following),
-        ("followers", followers),
-        ("timeline", timeline),
-        # ("boosts", boosts),
-        # ("replies", replies),
-        # ("mentions", mentions),
-    ]:
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    "handle": user_handle,
+                    "results": {
+                        collection: an.summary()
+                        for collection, an in results.items()
+                    },
+                    "seconds": duration,
+                    "usage": usage,
+                },
+                indent=2,
+            )
+        )
+        sys.exit()
+
+    print(
+        "{:>25s}\t{:>10s}\t{:>10s}\t{:>10s}\t{:>10s}".format(
+            "", "NONBINARY", "MEN", "WOMEN", "UNKNOWN"
+        )
+    )
+    for user_type in COLLECTIONS:
+        an = results.get(user_type)
 
         # Check if the list is empty
         if not an:  # If an is an empty list
@@ -801,45 +3296,51 @@ if __name__ == "__main__":
             print("\n")
             continue  # Skip to the next iteration
 
-        nb, men, women, andy = (
-            an.nonbinary.n,
-            an.male.n,
-            an.female.n,
-            an.andy.n,
-        )
+        s = an.summary()
 
         print(
             "{:>25s}\t{:>10.2f}%\t{:10.2f}%\t{:10.2f}%".format(
-                user_type,
-                an.pct("nonbinary"),
-                an.pct("male"),
-                an.pct("female"),
+                incomplete_label(user_type, an),
+                s["pct"]["nonbinary"],
+                s["pct"]["male"],
+                s["pct"]["female"],
             )
         )
 
         print(
             "{:>25s}\t{:>10d} \t{:10d} \t{:10d} \t{:10d}".format(
                 "Guessed from name:",
-                an.guessed("nonbinary"),
-                an.guessed("male"),
-                an.guessed("female"),
-                an.andy.n,
+                s["guessed"]["nonbinary"],
+                s["guessed"]["male"],
+                s["guessed"]["female"],
+                s["n"]["andy"],
             )
         )
 
         print(
             "{:>25s}\t{:>10d} \t{:10d} \t{:10d}".format(
                 "Declared pronouns:",
-                an.declared("nonbinary"),
-                an.declared("male"),
-                an.declared("female"),
+                s["declared"]["nonbinary"],
+                s["declared"]["male"],
+                s["declared"]["female"],
             )
         )
         print("\n")
 
     print("")
     print(
-        "Analysis took {:.2f} seconds, cache hit ratio {}%".format(
-            duration, cache.hit_percentage
+        "Analysis took {:.2f} seconds, {:.0f} accounts/s, "
+        "cache hit ratio {}%".format(
+            duration, div(usage["accounts"], duration), cache.hit_percentage
+        )
+    )
+    print(
+        "Pronoun pre-filter skipped {:.2f}% of bios".format(
+            prefilter_stats.fast_percentage
         )
     )
+    print(budget_summary(usage))
+    if usage["sources"]:
+        print("\nDecided by:")
+        for line in provenance_summary(usage["sources"]):
+            print(line)
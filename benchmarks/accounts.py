@@ -0,0 +1,103 @@
+"""
+Measure how long classifying an account takes, and how much memory the
+short-lived strings made along the way take at their peak.
+
+    py benchmarks/accounts.py
+    py benchmarks/accounts.py -n 50000 --runs 10
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import tracemalloc
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import analyze  # noqa: E402
+from benchmarks.names import make_display_names  # noqa: E402
+from tests.fakes import account  # noqa: E402
+
+BIOS = [
+    "",
+    "<p>Coffee, cats and open source. Views my own.</p>",
+    "<p>Écrivaine, lectrice, <a href='https://example.com'>blog</a></p>",
+    "<p>she/her · Software engineer in Berlin :blobcat:</p>",
+    "<p>Dad, runner &amp; amateur astronomer. He/Him</p>",
+    "<p>they/them. Queer, trans, tired.</p>",
+    "<p>" + "Long bio about many things. " * 40 + "</p>",
+]
+
+
+def make_accounts(n, rng):
+    accounts = []
+    for i, display_name in enumerate(make_display_names(n, rng)):
+        user = account(i, display_name, rng.choice(BIOS))
+        if rng.random() < 0.1:
+            user.fields = [{"name": "Pronouns", "value": "she/they"}]
+        accounts.append(user)
+    return accounts
+
+
+def per_account(accounts, runs):
+    """
+    Get the median microseconds per account over runs.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for user in accounts:
+            analyze.classify_user(user)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) / len(accounts) * 1e6
+
+
+def peak_bytes(accounts):
+    """
+    Get the peak of memory allocated while classifying an account, on
+    average.
+    """
+    peaks = []
+    tracemalloc.start()
+    for user in accounts:
+        tracemalloc.reset_peak()
+        before, _ = tracemalloc.get_traced_memory()
+        analyze.classify_user(user)
+        _, peak = tracemalloc.get_traced_memory()
+        peaks.append(peak - before)
+    tracemalloc.stop()
+    return statistics.mean(peaks)
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("-n", type=int, default=20000)
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    # Suppress unidecode warning "Surrogate character will be ignored".
+    warnings.filterwarnings("ignore")
+
+    analyze.get_name_table()
+    accounts = make_accounts(args.n, random.Random(args.seed))
+    print("{} accounts".format(len(accounts)))
+    print(
+        "classify: {:.2f} µs per account".format(
+            per_account(accounts, args.runs)
+        )
+    )
+    print("peak:     {:.0f} bytes per account".format(peak_bytes(accounts)))
+
+    # What decided the classifications, i.e. which paths are worth making
+    # faster.
+    budget = analyze.Budget(None, None, None, provenance=True)
+    analyze.analyze_users(accounts, budget=budget)
+    print("decided by:")
+    for line in analyze.provenance_summary(budget.sources):
+        print(line)
@@ -0,0 +1,62 @@
+"""
+Measure how long importing a module takes in a fresh interpreter, using
+python -X importtime, and list its slowest imports.
+
+    py benchmarks/importtime.py server
+    py benchmarks/importtime.py analyze --runs 10
+"""
+
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def importtime(module):
+    """
+    Get {imported module: cumulative microseconds} for one cold import.
+    """
+    env = dict(os.environ)
+    env.setdefault("COOKIE_SECRET", "benchmark")
+    env.pop("PRELOAD", None)
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    times = {}
+    for line in proc.stderr.splitlines():
+        m = _LINE.match(line)
+        if m:
+            times[m.group(4)] = int(m.group(2))
+    return times
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("module", nargs="?", default="server")
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--top", type=int, default=15)
+    args = p.parse_args()
+
+    runs = [importtime(args.module) for _ in range(args.runs)]
+    totals = [run[args.module] / 1000 for run in runs]
+    print(
+        "import {}: median {:.1f} ms, min {:.1f} ms over {} runs".format(
+            args.module, statistics.median(totals), min(totals), args.runs
+        )
+    )
+
+    print("\nSlowest imports (cumulative ms, last run):")
+    slowest = sorted(runs[-1].items(), key=lambda kv: kv[1], reverse=True)
+    for name, us in slowest[1 : args.top + 1]:
+        print("{:>10.1f}  {}".format(us / 1000, name))
@@ -0,0 +1,414 @@
+"""
+Load test the streaming analyze route against a local stub Mastodon
+instance, comparing how many concurrent users one gunicorn worker serves
+with sync, threaded and gevent workers. Requires gevent and gunicorn.
+
+    py benchmarks/load.py
+    py benchmarks/load.py --users 50,500 --workers sync,gevent --latency 0.2
+
+Once a worker doesn't wait on API calls one at a time, its CPU time per
+analysis, mostly spent by Mastodon.py parsing responses, limits how many
+analyses it finishes a second.
+"""
+
+# The stub instance and the simulated users are greenlets too, so that this
+# process isn't what limits the test.
+from gevent import monkey
+
+monkey.patch_all()
+
+import argparse  # noqa: E402
+import http.client  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import shutil  # noqa: E402
+import socket  # noqa: E402
+import ssl  # noqa: E402
+import statistics  # noqa: E402
+import subprocess  # noqa: E402
+import sys  # noqa: E402
+import tempfile  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # noqa
+from urllib.parse import parse_qs, urlparse  # noqa: E402
+
+import gevent  # noqa: E402
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sessions import SqliteSessionInterface  # noqa: E402
+
+# Worker classes and their gunicorn options; sync is how the app is served
+# by default.
+WORKERS = {
+    "sync": ["-k", "sync"],
+    "gthread": ["-k", "gthread", "--threads", "8"],
+    "gevent": ["-k", "gevent", "--worker-connections", "1000"],
+}
+
+BIOS = ["", "<p>she/her</p>", "<p>he/him. Runner.</p>", "<p>they/them</p>"]
+NAMES = ["Alice", "Bob", "Carol", "Dave", "Robin", "Sam", "🐘 fan"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def make_certificate(directory):
+    """
+    Make a self-signed certificate for 127.0.0.1, since the analyses only
+    talk to instances over HTTPS. Returns (certificate path, key path).
+    """
+    cert = os.path.join(directory, "cert.pem")
+    key = os.path.join(directory, "key.pem")
+    subprocess.run(
+        [
+            "openssl", "req", "-x509", "-nodes", "-days", "1",
+            "-newkey", "ec", "-pkeyopt", "ec_paramgen_curve:prime256v1",
+            "-keyout", key, "-out", cert, "-subj", "/CN=127.0.0.1",
+            "-addext", "subjectAltName=IP:127.0.0.1",
+        ],
+        check=True,
+        capture_output=True,
+    )  # fmt: skip
+    return cert, key
+
+
+class StubInstance(object):
+    """
+    A Mastodon instance serving the endpoints the analyses use, for users
+    named user1, user2 and so on, each with their own followers, follows
+    and statuses. Every response takes latency seconds.
+    """
+
+    def __init__(self, port, cert, key, latency, follows=200, statuses=120):
+        self.port = port
+        self.latency = latency
+        self.follows = follows
+        self.statuses = statuses
+
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                time.sleep(stub.latency)
+                url = urlparse(self.path)
+                status, body, link = stub.respond(
+                    url.path, parse_qs(url.query)
+                )
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                if link:
+                    self.send_header("Link", f'<{link}>; rel="next"')
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingHTTPServer):
+            daemon_threads = True
+            # Hundreds of users connect at once.
+            request_queue_size = 1024
+
+        self.server = Server(("127.0.0.1", port), Handler)
+        context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        context.load_cert_chain(cert, key)
+        # Handshakes happen in each connection's thread, not one by one in
+        # the thread accepting them.
+        self.server.socket = context.wrap_socket(
+            self.server.socket,
+            server_side=True,
+            do_handshake_on_connect=False,
+        )
+        self.base_url = f"https://127.0.0.1:{port}"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+    def account(self, id):
+        return {
+            "id": str(id),
+            "username": f"user{id}",
+            "acct": f"user{id}",
+            "display_name": NAMES[id % len(NAMES)],
+            "note": BIOS[id % len(BIOS)],
+            "fields": [],
+            "indexable": True,
+            "locked": False,
+            "bot": False,
+            "created_at": "2023-01-01T00:00:00.000Z",
+            "followers_count": 0,
+            "following_count": 0,
+            "statuses_count": 0,
+        }
+
+    def status(self, id, account_id, reply_to=None, mentions=()):
+        return {
+            "id": str(id),
+            "account": self.account(account_id),
+            "reblog": None,
+            "in_reply_to_account_id": reply_to and str(reply_to),
+            "mentions": [
+                {"id": str(m), "username": f"user{m}", "acct": f"user{m}"}
+                for m in mentions
+            ],
+            "content": "",
+            "created_at": "2023-01-01T00:00:00.000Z",
+        }
+
+    def page(self, path, query, items, limit):
+        """
+        Get (items, next page URL) of the items older than max_id.
+        """
+        limit = int(query.get("limit", [limit])[0])
+        if "max_id" in query:
+            max_id = int(query["max_id"][0])
+            items = [item for item in items if int(item["id"]) < max_id]
+        page = items[:limit]
+        link = None
+        if len(items) > limit:
+            link = f"{self.base_url}{path}?max_id={page[-1]['id']}"
+        return page, link
+
+    def respond(self, path, query):
+        """
+        Get (HTTP status, JSON body, next page URL) for a request.
+        """
+        parts = path.strip("/").split("/")
+        if parts[:2] != ["api", "v1"] and parts[:2] != ["api", "v2"]:
+            return 404, {"error": "Record not found"}, None
+
+        if parts[2] == "instance":
+            return 200, {"uri": self.base_url, "version": "4.2.0"}, None
+
+        if parts[2] == "search" or parts[3:] == ["search"]:
+            # Mastodon.py versions without accounts/lookup search instead.
+            username = query["q"][0].lstrip("@").split("@")[0]
+            accounts = [self.account(int(username[len("user") :]))]
+            if parts[2] == "search":
+                accounts = {"accounts": accounts, "statuses": []}
+            return 200, accounts, None
+
+        if parts[2] == "timelines":
+            # Every session is logged in as the same user, who follows
+            # user1's follows.
+            statuses = [
+                self.status(100000 + i, 10000 + i % self.follows)
+                for i in range(self.statuses, 0, -1)
+            ]
+            return (200, *self.page(path, query, statuses, 20))
+
+        if len(parts) == 3:
+            ids = query.get("id[]", [])
+            return 200, [self.account(int(id)) for id in ids], None
+
+        if parts[3] == "lookup":
+            username = query["acct"][0].split("@")[0]
+            return 200, self.account(int(username[len("user") :])), None
+
+        user = int(parts[3])
+        if len(parts) == 4:
+            return 200, self.account(user), None
+
+        if parts[4] in ("following", "followers"):
+            offset = 0 if parts[4] == "following" else 5000
+            accounts = [
+                self.account(user * 10000 + offset + i)
+                for i in range(self.follows, 0, -1)
+            ]
+            return (200, *self.page(path, query, accounts, 40))
+
+        if parts[4] == "statuses":
+            statuses = [
+                self.status(
+                    user * 100000 + i,
+                    user,
+                    reply_to=user * 10000 + i,
+                    mentions=[user * 10000 + 5000 + i],
+                )
+                for i in range(40, 0, -1)
+            ]
+            return (200, *self.page(path, query, statuses, 20))
+
+        return 404, {"error": "Record not found"}, None
+
+
+def make_sessions(path, instance, n):
+    """
+    Store a logged in session for each simulated user, and get their ids.
+    """
+    interface = SqliteSessionInterface(path)
+    sids = []
+    with interface._connect() as db:
+        for i in range(n):
+            sid = f"load-{i}"
+            data = {
+                "mastodon_user": f"me@{instance}",
+                "mastodon_user_id": "0",
+                "mastodon_token": "token",
+                "instance": instance,
+                "lists": [],
+            }
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (sid, data, expires) "
+                "VALUES (?, ?, ?)",
+                (sid, interface.serializer.dumps(data), time.time() + 3600),
+            )
+            sids.append(sid)
+    return sids
+
+
+class Server(object):
+    """
+    The app served by one gunicorn worker of a worker class.
+    """
+
+    def __init__(self, worker, port, env):
+        self.port = port
+        self.proc = subprocess.Popen(
+            [
+                sys.executable, "-m", "gunicorn", "-w", "1",
+                "-b", f"127.0.0.1:{port}", "--timeout", "300",
+                *WORKERS[worker], "server:app",
+            ],
+            cwd=ROOT,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )  # fmt: skip
+
+    def wait(self, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                socket.create_connection(("127.0.0.1", self.port)).close()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError("gunicorn didn't start")
+
+    def stop(self):
+        self.proc.terminate()
+        self.proc.wait()
+
+
+def analyze(port, sid, user, timeout):
+    """
+    Stream one analysis of user, and get its seconds, or None if it failed
+    or timed out.
+    """
+    start = time.monotonic()
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=timeout)
+    try:
+        conn.request(
+            "GET",
+            f"/analyze/stream?analyze_acct=user{user}&lst=none",
+            headers={"Cookie": f"session={sid}"},
+        )
+        response = conn.getresponse()
+        for line in response:
+            if line.startswith(b"event: done"):
+                return time.monotonic() - start
+            if line.startswith(b"event: failure"):
+                return None
+            if time.monotonic() - start > timeout:
+                return None
+    except OSError:
+        return None
+    finally:
+        conn.close()
+    return None
+
+
+def run(port, sids, timeout):
+    """
+    Run one analysis per session at once, and get (seconds of each
+    analysis that finished, failures, wall seconds).
+    """
+    start = time.monotonic()
+    jobs = [
+        gevent.spawn(analyze, port, sid, i + 1, timeout)
+        for i, sid in enumerate(sids)
+    ]
+    gevent.joinall(jobs)
+    wall = time.monotonic() - start
+    times = [job.value for job in jobs if job.value is not None]
+    return times, len(jobs) - len(times), wall
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--users", default="10,100,300")
+    p.add_argument("--workers", default="sync,gthread,gevent")
+    p.add_argument("--latency", type=float, default=0.1)
+    p.add_argument("--timeout", type=float, default=60)
+    args = p.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    try:
+        cert, key = make_certificate(tmp)
+        stub_port = free_port()
+        stub = StubInstance(stub_port, cert, key, args.latency)
+        stub.start()
+        instance = f"127.0.0.1:{stub_port}"
+
+        levels = [int(n) for n in args.users.split(",")]
+        session_db = os.path.join(tmp, "sessions.db")
+        sids = make_sessions(session_db, instance, max(levels) + 1)
+        env = dict(
+            os.environ,
+            COOKIE_SECRET="load",
+            SESSION_DB=session_db,
+            HANDLE_CACHE_DB=os.path.join(tmp, "handles.db"),
+            # Trust the stub's certificate.
+            REQUESTS_CA_BUNDLE=cert,
+        )
+
+        print(
+            f"{args.latency * 1000:.0f} ms per API call, "
+            f"{args.timeout:.0f} s timeout"
+        )
+        print(
+            "worker   users  done  failed  wall s  analyses/s"
+            "  median s  p95 s"
+        )
+        for worker in args.workers.split(","):
+            server = Server(worker, free_port(), env)
+            try:
+                server.wait()
+                # Load the name detector before timing anything.
+                analyze(server.port, sids[-1], len(sids), args.timeout)
+
+                for n in levels:
+                    times, failed, wall = run(
+                        server.port, sids[:n], args.timeout
+                    )
+                    p95 = (
+                        statistics.quantiles(times, n=20)[-1]
+                        if len(times) > 1
+                        else sum(times)
+                    )
+                    print(
+                        f"{worker:8s} {n:5d} {len(times):5d} {failed:7d}"
+                        f" {wall:7.1f} {len(times) / wall:11.1f}"
+                        f" {statistics.median(times or [0]):9.1f}"
+                        f" {p95:6.1f}"
+                    )
+            finally:
+                server.stop()
+
+        stub.stop()
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,115 @@
+"""
+Compare guessing genders from display names with the name table against
+running the whole detector cascade for each name.
+
+    py benchmarks/names.py
+    py benchmarks/names.py --file display_names.txt --runs 10
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+import warnings
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.chdir(ROOT)
+
+import analyze  # noqa: E402
+
+SURNAMES = ["Smith", "Müller", "García", "Dubois", "Rossi", "Nowak", "Kim"]
+NON_NAMES = ["🐘 Fediverse fan", "xX_coder_Xx", "Cat Pictures Daily", "🌻"]
+
+
+def make_display_names(n, rng):
+    """
+    Display names like those found on Mastodon: first names alone or with
+    a surname, in any case, and handles or phrases that aren't names.
+    """
+    names = sorted(analyze.get_detector().names)
+    display_names = []
+    for _ in range(n):
+        r = rng.random()
+        name = rng.choice(names).title()
+        if r < 0.4:
+            display_names.append(f"{name} {rng.choice(SURNAMES)}")
+        elif r < 0.7:
+            display_names.append(name)
+        elif r < 0.8:
+            display_names.append(name.upper())
+        else:
+            display_names.append(rng.choice(NON_NAMES))
+    return display_names
+
+
+def per_name(fn, display_names, runs):
+    """
+    Get the median microseconds per display name over runs.
+    """
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        for display_name in display_names:
+            fn(display_name)
+        times.append(time.perf_counter() - start)
+    return statistics.median(times) / len(display_names) * 1e6
+
+
+if __name__ == "__main__":
+    p = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    p.add_argument("--file", help="display names to use, one per line")
+    p.add_argument("-n", type=int, default=20000)
+    p.add_argument("--runs", type=int, default=5)
+    p.add_argument("--seed", type=int, default=0)
+    args = p.parse_args()
+
+    # Suppress unidecode warning "Surrogate character will be ignored".
+    warnings.filterwarnings("ignore")
+
+    if args.file:
+        with open(args.file, encoding="utf-8") as f:
+            display_names = [line.rstrip("\n") for line in f]
+    else:
+        display_names = make_display_names(args.n, random.Random(args.seed))
+
+    start = time.perf_counter()
+    analyze.get_name_table()
+    print(
+        "load name table: {:.1f} ms".format(
+            1000 * (time.perf_counter() - start)
+        )
+    )
+
+    cascades = 0
+    cascade_gender = analyze.cascade_gender
+
+    def counting_cascade(display_name):
+        global cascades
+        cascades += 1
+        return cascade_gender(display_name)
+
+    analyze.cascade_gender = counting_cascade
+    mismatches = sum(
+        analyze.guess_gender(name) != cascade_gender(name)
+        for name in display_names
+    )
+    analyze.cascade_gender = cascade_gender
+
+    cascade_us = per_name(cascade_gender, display_names, args.runs)
+    table_us = per_name(analyze.guess_gender, display_names, args.runs)
+    print(
+        "{} display names, {:.1f}% needed the cascade, {} mismatches".format(
+            len(display_names),
+            100 * analyze.div(cascades, len(display_names)),
+            mismatches,
+        )
+    )
+    print("cascade:    {:.2f} µs per name".format(cascade_us))
+    print(
+        "name table: {:.2f} µs per name ({:.1f}x)".format(
+            table_us, analyze.div(cascade_us, table_us)
+        )
+    )
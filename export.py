@@ -0,0 +1,117 @@
+"""
+Stream per-account classification decisions to disk, one row per account
+per collection, for offline analysis with dataframe tools.
+
+Rows are written as they're produced, so memory use doesn't grow with the
+number of accounts. CSV needs nothing extra; Parquet requires pyarrow.
+"""
+
+import csv
+import threading
+
+EXPORT_FIELDS = [
+    "handle",
+    "collection",
+    "id",
+    "acct",
+    "gender",
+    "declared",
+    "source",
+]
+
+
+class Exporter(object):
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+        # Batch mode writes from several threads.
+        self._lock = threading.Lock()
+
+    def write(self, handle, collection, user, gender, declared, source):
+        row = {
+            "handle": handle,
+            "collection": collection,
+            "id": str(user.id),
+            "acct": user.acct,
+            "gender": gender,
+            "declared": declared,
+            "source": source,
+        }
+        with self._lock:
+            self._write(row)
+            self.rows += 1
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class CsvExporter(Exporter):
+    def __init__(self, path):
+        super().__init__(path)
+        self._file = open(path, "w", newline="", encoding="utf-8")
+        self._writer = csv.DictWriter(self._file, fieldnames=EXPORT_FIELDS)
+        self._writer.writeheader()
+
+    def _write(self, row):
+        self._writer.writerow(row)
+
+    def _close(self):
+        self._file.close()
+
+
+class ParquetExporter(Exporter):
+    """
+    Buffers up to row_group_size rows and writes each full buffer as a
+    Parquet row group.
+    """
+
+    def __init__(self, path, row_group_size=10000):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError(
+                "Exporting to Parquet requires pyarrow: "
+                "py -m pip install pyarrow"
+            )
+
+        super().__init__(path)
+        self._pa = pa
+        self._schema = pa.schema(
+            [
+                (name, pa.bool_() if name == "declared" else pa.string())
+                for name in EXPORT_FIELDS
+            ]
+        )
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._row_group_size = row_group_size
+        self._buffer = []
+
+    def _write(self, row):
+        self._buffer.append(row)
+        if len(self._buffer) >= self._row_group_size:
+            self._flush()
+
+    def _flush(self):
+        if self._buffer:
+            table = self._pa.Table.from_pylist(self._buffer, self._schema)
+            self._writer.write_table(table)
+            self._buffer = []
+
+    def _close(self):
+        self._flush()
+        self._writer.close()
+
+
+def open_exporter(path):
+    if path.endswith(".parquet"):
+        return ParquetExporter(path)
+
+    return CsvExporter(path)
@@ -0,0 +1,196 @@
+"""
+A read-only index of first names, memory-mapped so that every process
+using it shares one copy in the page cache.
+
+It stands in for both the gender detector, answering get_gender for the
+countries the analyses ask about, and the name table built from it, so
+gunicorn workers neither load the detector's data nor build the table: a
+worker's memory doesn't grow with the index, and more workers don't
+multiply it.
+
+The file is a header, then an open-addressing hash table of record
+offsets keyed by the CRC-32 of the name, then the records: the length of
+the name in UTF-8, the name, then one byte each for its gender in the USA
+and in any country, and for its two outcomes in the name table.
+"""
+
+import json
+import mmap
+import os
+import struct
+import sys
+import zlib
+from array import array
+
+MAGIC = b"NAMEIDX\n"
+# Bump when the format changes. Changes to what the index is built from are
+# told by the source hash stored with it.
+VERSION = 1
+
+DETECTOR_GENDERS = (
+    "unknown",
+    "andy",
+    "male",
+    "female",
+    "mostly_male",
+    "mostly_female",
+)
+_GENDER_CODES = {g: i for i, g in enumerate(DETECTOR_GENDERS)}
+# Outcome code of a name table entry that's None.
+NO_OUTCOME = 255
+
+_HEADER_SIZE = struct.Struct("<I")
+
+
+def write_name_index(path, detector, table, source=None):
+    """
+    Write the index of every name in the detector's data, with its entry in
+    table, to path, along with source, a hash of what they were made from.
+    The file is replaced at once, so processes building it at the same time
+    don't see it half written.
+    """
+    outcomes = {}
+
+    def code(outcome):
+        if outcome is None:
+            return NO_OUTCOME
+        return outcomes.setdefault(outcome, len(outcomes))
+
+    records = bytearray()
+    offsets = []
+    for name in detector.names:
+        key = name.encode("utf-8")
+        outcome, single_outcome = table[name]
+        offsets.append((zlib.crc32(key), len(records)))
+        records += bytes([len(key)]) + key
+        records += bytes(
+            [
+                _GENDER_CODES[detector.get_gender(name, "usa")],
+                _GENDER_CODES[detector.get_gender(name)],
+                code(outcome),
+                code(single_outcome),
+            ]
+        )
+    assert len(outcomes) < NO_OUTCOME
+
+    # At most half full, so probes stay short.
+    n_slots = 1
+    while n_slots < 2 * len(offsets):
+        n_slots *= 2
+
+    header = json.dumps(
+        {
+            "version": VERSION,
+            "byteorder": sys.byteorder,
+            "source": source,
+            "slots": n_slots,
+            "outcomes": list(outcomes),
+        }
+    ).encode("utf-8")
+    # Align the slots for reading them in place.
+    header += b" " * (-(len(MAGIC) + _HEADER_SIZE.size + len(header)) % 4)
+    start = len(MAGIC) + _HEADER_SIZE.size + len(header) + 4 * n_slots
+
+    slots = array("I", [0]) * n_slots
+    mask = n_slots - 1
+    for h, offset in offsets:
+        i = h & mask
+        while slots[i]:
+            i = (i + 1) & mask
+        slots[i] = start + offset
+
+    tmp = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp, "wb") as f:
+        f.write(MAGIC + _HEADER_SIZE.pack(len(header)) + header)
+        f.write(slots.tobytes())
+        f.write(records)
+    os.replace(tmp, path)
+
+
+class NameIndex(object):
+    """
+    A name index file, mapped read-only. Raises ValueError if the file
+    isn't an index of this version, or, if source is given, wasn't built
+    from that source.
+    """
+
+    def __init__(self, path, source=None):
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        mm = self._mm
+        if mm[: len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} isn't a name index")
+        at = len(MAGIC) + _HEADER_SIZE.size
+        (size,) = _HEADER_SIZE.unpack_from(mm, len(MAGIC))
+        header = json.loads(mm[at : at + size])
+        version = (header["version"], header["byteorder"])
+        if version != (VERSION, sys.byteorder):
+            raise ValueError(f"{path} is an index of another version")
+        if source is not None and header.get("source") != source:
+            raise ValueError(f"{path} was built from other names or code")
+
+        at += size
+        self._slots = memoryview(mm)[at : at + 4 * header["slots"]].cast("I")
+        self._mask = header["slots"] - 1
+        outcomes = [tuple(outcome) for outcome in header["outcomes"]]
+        # Indexed by code, up to NO_OUTCOME.
+        self._outcomes = outcomes + [None] * (NO_OUTCOME + 1 - len(outcomes))
+
+    def _find(self, name):
+        """
+        Get the offset of the codes of name's record, or -1.
+        """
+        key = name.encode("utf-8", "surrogatepass")
+        n = len(key)
+        mm = self._mm
+        i = zlib.crc32(key) & self._mask
+        while True:
+            offset = self._slots[i]
+            if not offset:
+                return -1
+            if mm[offset] == n and mm[offset + 1 : offset + 1 + n] == key:
+                return offset + 1 + n
+            i = (i + 1) & self._mask
+
+    def get_gender(self, name, country=None):
+        """
+        Like gender_guesser's Detector.get_gender, for the USA or any
+        country.
+        """
+        if country not in ("usa", None):
+            raise ValueError(f"No such country in the index: {country}")
+
+        at = self._find(name.lower())
+        if at < 0:
+            return "unknown"
+        return DETECTOR_GENDERS[self._mm[at if country else at + 1]]
+
+    def get(self, name, default=None):
+        """
+        Get the name table entry of name, a lowercased first name.
+        """
+        at = self._find(name)
+        if at < 0:
+            return default
+        return (
+            self._outcomes[self._mm[at + 2]],
+            self._outcomes[self._mm[at + 3]],
+        )
+
+    def __contains__(self, name):
+        return self._find(name) >= 0
+
+    @property
+    def names(self):
+        """
+        Every name in the index, in no particular order.
+        """
+        names = []
+        for offset in self._slots:
+            if offset:
+                n = self._mm[offset]
+                names.append(
+                    self._mm[offset + 1 : offset + 1 + n].decode("utf-8")
+                )
+        return names
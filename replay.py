@@ -0,0 +1,192 @@
+"""
+Record Mastodon API responses to a compressed archive, and replay them
+without a network connection.
+
+Set MASTODON_RECORD to an archive path to record every response the
+analyses get, and MASTODON_REPLAY to the same path to run them again from
+the archive; see get_mastodon_api. Responses are stored as gzipped JSON
+lines keyed on the method and its arguments, pages after the first on the
+key of the page before them, so the paginated collectors replay exactly
+the pages they saw.
+"""
+
+import atexit
+import functools
+import gzip
+import json
+import threading
+import weakref
+
+_write_lock = threading.Lock()
+# The archives being recorded to, by path, each written through one gzip
+# stream shared by every RecordingApi, so that it's compressed as a whole.
+_writers = {}
+
+
+def _write(path, line):
+    with _write_lock:
+        f = _writers.get(path)
+        if f is None:
+            f = _writers[path] = gzip.open(path, "at", encoding="utf-8")
+        f.write(line)
+
+
+@atexit.register
+def close_archives(path=None):
+    """
+    Finish writing the archive at path, or every archive, so that it can be
+    read. Recording to it again appends to it.
+    """
+    with _write_lock:
+        for p in [path] if path is not None else list(_writers):
+            f = _writers.pop(p, None)
+            if f is not None:
+                f.close()
+
+
+class Record(dict):
+    """
+    A replayed JSON object, with attribute access like Mastodon.py's.
+    """
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+class RecordedPage(list):
+    """
+    A page that was a plain list, which can't be weakly referenced.
+    """
+
+
+class ReplayPage(list):
+    def __init__(self, items, key):
+        super().__init__(items)
+        self._replay_key = key
+
+
+def call_key(name, args, kwargs):
+    return json.dumps([name, args, kwargs], sort_keys=True, default=str)
+
+
+def next_page_key(key):
+    return json.dumps(["fetch_next", key])
+
+
+class RecordingApi(object):
+    """
+    Wraps a Mastodon API and appends every response to the archive at path.
+    """
+
+    def __init__(self, api, path):
+        self._api = api
+        self._path = path
+        # Keys of the pages returned, by id, for fetch_next, as long as the
+        # pages are alive.
+        self._page_keys = {}
+
+    def _record(self, key, result=None, error=None):
+        if error is not None:
+            entry = {"key": key, "error": type(error).__name__}
+            entry["message"] = str(error)
+        else:
+            entry = {"key": key, "result": result}
+
+        _write(self._path, json.dumps(entry, default=str) + "\n")
+
+    def _call(self, key, fn):
+        try:
+            result = fn()
+        except Exception as exc:
+            self._record(key, error=exc)
+            raise
+
+        self._record(key, result)
+        if isinstance(result, list):
+            if type(result) is list:
+                result = RecordedPage(result)
+            self._page_keys[id(result)] = key
+            weakref.finalize(result, self._page_keys.pop, id(result), None)
+        return result
+
+    def __getattr__(self, name):
+        method = getattr(self._api, name)
+        if not callable(method):
+            return method
+
+        def recorded(*args, **kwargs):
+            key = call_key(name, args, kwargs)
+            return self._call(key, lambda: method(*args, **kwargs))
+
+        return recorded
+
+    def fetch_next(self, page):
+        key = self._page_keys.get(id(page))
+        if key is None:
+            return self._api.fetch_next(page)
+
+        return self._call(
+            next_page_key(key), lambda: self._api.fetch_next(page)
+        )
+
+
+@functools.lru_cache(maxsize=None)
+def _load_responses(path):
+    responses = {}
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            entry = json.loads(line, object_hook=Record)
+            responses[entry["key"]] = entry
+    return responses
+
+
+class ReplayApi(object):
+    """
+    Serves the responses recorded in an archive in place of a Mastodon API.
+    """
+
+    api_base_url = "replay"
+
+    def __init__(self, responses):
+        self._responses = responses
+
+    @classmethod
+    def load(cls, path):
+        close_archives(path)
+        return cls(_load_responses(path))
+
+    def _replay(self, key):
+        try:
+            entry = self._responses[key]
+        except KeyError:
+            raise LookupError(f"No recorded response for {key}")
+
+        if "error" in entry:
+            import mastodon
+
+            error = getattr(mastodon, entry["error"], Exception)
+            raise error(entry["message"])
+
+        result = entry["result"]
+        if isinstance(result, list):
+            return ReplayPage(result, key)
+        return result
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def replayed(*args, **kwargs):
+            return self._replay(call_key(name, args, kwargs))
+
+        return replayed
+
+    def fetch_next(self, page):
+        key = getattr(page, "_replay_key", None)
+        if key is None:
+            return None
+
+        return self._replay(next_page_key(key))
@@ -1,38 +1,55 @@
+import functools
+import json
 import logging
 import os
+import threading
+import time
+import traceback
 from urllib.parse import urlparse
-import requests
-import webfinger
 
-from authlib.integrations.flask_client import (
-    OAuth,
-    OAuthError,
-)
 from flask import (
     Flask,
+    Response,
     flash,
+    jsonify,
     redirect,
     render_template,
     request,
     session,
+    stream_with_context,
     url_for,
 )
-from mastodon import Mastodon, MastodonNetworkError, MastodonNotFoundError
+from authlib.common.errors import AuthlibBaseError
+from markupsafe import Markup, escape
 from wtforms import Form, SelectField, StringField
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 from analyze import (
+    ANALYSIS_TIME_BUDGET,
+    COLLECTIONS,
+    Budget,
     Cache,
+    CoalescingApi,
+    GraphIndex,
+    HandleCache,
     analyze_followers,
     analyze_following,
+    analyze_my_timeline,
+    analyze_lists,
     analyze_timeline,
-    div,
+    budget_summary,
     dry_run_analysis,
     get_mastodon_api,
     get_user_from_handle,
     parse_mastodon_handle,
     get_following_lists,
+    iter_followers,
+    iter_following,
+    iter_lists,
+    iter_timeline,
+    preload,
 )
+from sessions import SqliteSessionInterface
 
 logging.getLogger("requests").setLevel(logging.WARNING)
 logging.getLogger("urllib3").setLevel(logging.WARNING)
@@ -46,12 +63,59 @@ app.config["SECRET_KEY"] = os.environ["COOKIE_SECRET"]
 app.config["DRY_RUN"] = False
 app.config["PREFERRED_URL_SCHEME"] = "https"
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)
+app.session_interface = SqliteSessionInterface(
+    os.environ.get("SESSION_DB", "sessions.db")
+)
+
+# Authlib, webfinger, requests and Mastodon.py are slow to import and only
+# needed once a user logs in or runs an analysis, so they're imported on
+# first use to keep worker startup fast. Set PRELOAD=1 and run gunicorn with
+# --preload to load them, and map the name index, in the master process
+# instead, where forked workers share them copy-on-write. gevent workers,
+# which patch the standard library as they start, can't be preloaded, but
+# they share the name index anyway, as every process maps the same file.
+if os.environ.get("PRELOAD"):
+    preload()
+
+handle_cache = HandleCache(os.environ.get("HANDLE_CACHE_DB", "handles.db"))
+
+# Follow graphs and classifications shared by every analysis, if
+# GRAPH_INDEX_DB is set. Recordings and replays go through the API instead.
+graph_index = None
+if os.environ.get("GRAPH_INDEX_DB") and not (
+    os.environ.get("MASTODON_RECORD") or os.environ.get("MASTODON_REPLAY")
+):
+    graph_index = GraphIndex(os.environ["GRAPH_INDEX_DB"])
+
+# Today's analyses of each user are saved to SNAPSHOT_DB, if set, to follow
+# their trends along with scheduled snapshots.
+snapshot_store = None
+if os.environ.get("SNAPSHOT_DB"):
+    from snapshots import SnapshotStore
+
+    snapshot_store = SnapshotStore(os.environ["SNAPSHOT_DB"])
+
+_oauth = None
+_oauth_lock = threading.Lock()
+
+
+def get_oauth():
+    global _oauth
+    if _oauth is None:
+        with _oauth_lock:
+            if _oauth is None:
+                from authlib.integrations.flask_client import OAuth
 
-oauth = OAuth(app)
+                _oauth = OAuth(app)
+    return _oauth
 
 
 @app.route("/login")
 def login():
+    import requests
+    import webfinger
+    from mastodon import Mastodon
+
     # Get handle from login field
     handle = request.args.get("handle", "alexkalopsia@mastodon.social")
 
@@ -118,6 +182,7 @@ def login():
     _, handle_instance = parse_mastodon_handle(handle)
     session["handle_instance"] = handle_instance
 
+    oauth = get_oauth()
     oauth.register(
         name=instance,
         client_id=session["client_id"],
@@ -139,22 +204,30 @@ def login():
 @app.route("/logout")
 def logout():
     session.clear()
+    session.regenerate()
     flash("Logged out.")
     return redirect("/")
 
 
-@app.errorhandler(OAuthError)
+# Registered on the base class of Authlib's errors, which is light to
+# import, rather than on OAuthError, which would import the whole client.
+@app.errorhandler(AuthlibBaseError)
 def handle_error(error):
+    # Authlib's client is loaded by the time one of its errors is raised.
+    from authlib.integrations.flask_client import OAuthError
+
+    if not isinstance(error, OAuthError):
+        raise error
+
     flash("You denied the request to sign in.")
     return redirect("/")
 
 
 @app.route("/authorized")
 def oauth_authorized():
-
     # Get existing oauth client
     instance = session["instance"]
-    client = oauth.create_client(instance)
+    client = get_oauth().create_client(instance)
 
     token = client.authorize_access_token()
     response = client.get(
@@ -173,21 +246,37 @@ def oauth_authorized():
     handle_instance = session["handle_instance"]
     handle = f"{username}@{handle_instance}"
     session["mastodon_user"] = handle
+    session["mastodon_user_id"] = profile["id"]
     session["mastodon_token"] = token["access_token"]
-
-    try:
-        session["lists"] = get_following_lists(
-            profile["id"],
-            token["access_token"],
-            instance,
-        )
-    except Exception:
-        app.logger.exception("Error in get_following_lists, ignoring")
-        session["lists"] = []
+    # Lists are fetched on first use, see session_lists().
+    session.pop("lists", None)
+    # A sid set before logging in, e.g. by someone else, isn't logged in.
+    session.regenerate()
 
     return redirect(url_for("index"))
 
 
+def session_lists():
+    """
+    The logged in user's lists, fetched once per session.
+    """
+    if "lists" not in session:
+        if not session.get("mastodon_token"):
+            return []
+
+        try:
+            session["lists"] = get_following_lists(
+                session.get("mastodon_user_id"),
+                session["mastodon_token"],
+                session["instance"],
+            )
+        except Exception:
+            app.logger.exception("Error in get_following_lists, ignoring")
+            session["lists"] = []
+
+    return session["lists"]
+
+
 class LoginForm(Form):
     login_acct = StringField("Mastodon user handle")
 
@@ -197,22 +286,232 @@ class AnalyzeForm(Form):
     lst = SelectField("List")
 
 
+# The list choice that compares all of the user's lists.
+ALL_LISTS = "all"
+
+
+def list_choices():
+    choices = [("none", "No list")]
+    # Populate lists if the user has any
+    lists = session_lists()
+    if len(lists) > 1:
+        choices.append((ALL_LISTS, "Compare all lists"))
+    choices += [(str(list["id"]), list["name"]) for list in lists]
+    return choices
+
+
+def list_analyses(lists, api, cache, deadline, budget):
+    """
+    Get (list name, Analysis) of every list, analyzed concurrently.
+    """
+    results = analyze_lists(
+        lists, api, cache, deadline=deadline, budget=budget
+    )
+    return [(list["name"], results[list["id"]]) for list in lists]
+
+
+def selected_list(lst):
+    """
+    Get (list_id, list_name) of the list chosen in the analyze form, or
+    (None, None).
+    """
+    if lst and lst != "none":
+        for list in session_lists():
+            if str(list["id"]) == lst:
+                return int(list["id"]), list["name"]
+
+    return None, None
+
+
+def analyzed_handle(acct):
+    """
+    The handle to look acct up by on the logged in user's instance. Accounts
+    of the user's own handle instance are looked up on the instance found
+    with webfinger, which may have another domain; others keep theirs.
+    """
+    username, domain = parse_mastodon_handle(acct)
+    own = session.get("handle_instance") or session["instance"]
+    if domain is None or domain.lower() in (
+        own.lower(),
+        session["instance"].lower(),
+    ):
+        domain = session["instance"]
+    return f"{username}@{domain}"
+
+
+class UserNotFound(Exception):
+    """The handle to analyze doesn't resolve to an account."""
+
+
+class NotIndexable(Exception):
+    """The account to analyze opted out of being searched."""
+
+
+def find_analyzed_user(handle, acct, different_user, api):
+    user = get_user_from_handle(handle, api, handle_cache)
+
+    if not user:
+        raise UserNotFound(f"Failed to find user {handle}.")
+
+    if different_user and user.indexable is False:
+        raise NotIndexable(
+            f"User {acct} is not indexable.\n"
+            f"If the account is yours, you can change the setting on: "
+            f"Settings > Public profile > Privacy and reach > "
+            f"Include public posts in search results"
+        )
+
+    return user
+
+
+def save_snapshot(handle, instance, list_id, results):
+    # A list's analyses aren't the user's own.
+    if snapshot_store is None or list_id is not None:
+        return
+
+    from snapshots import user_key
+
+    snapshot_store.add(user_key(handle, instance), results)
+
+
+def error_message(exc, acct, instance):
+    from mastodon import MastodonNetworkError, MastodonNotFoundError
+
+    if isinstance(exc, MastodonNotFoundError):
+        return f"Could not find user {acct}."
+    elif isinstance(exc, MastodonNetworkError):
+        return (
+            f"Could not connect to the Mastodon server {instance}.\n"
+            "Please check the instance name or try again later."
+        )
+    return str(exc)
+
+
+def describe_error(exc, acct, instance):
+    # The message may quote the acct as typed, so only the line breaks are
+    # markup.
+    lines = error_message(exc, acct, instance).split("\n")
+    return Markup("<br>").join(escape(line) for line in lines)
+
+
+COLLECTION_LABELS = {
+    "following": "People you follow",
+    "followers": "Followers",
+    "timeline": "Timeline",
+    "boosts": "Boosts",
+    "replies": "Replies",
+    "mentions": "Mentions",
+}
+
+
+def run_analyses(tok, handle, acct, different_user, lst, snapshot=True):
+    """
+    Run the analyses of the analyze form, and get (results, lists,
+    list_name, usage): the Analysis of each collection, (name, Analysis) of
+    every list when comparing all lists, the name of the selected list,
+    and the Budget's usage(). The results are saved as today's snapshot
+    too, unless snapshot is False.
+    """
+    if app.config["DRY_RUN"]:
+        return dict(zip(COLLECTIONS, dry_run_analysis())), [], None, None
+
+    list_id, list_name = selected_list(lst)
+    instance = session["instance"]
+    api = CoalescingApi(get_mastodon_api(tok, instance), instance)
+    cache = Cache(graph_index, instance, session.get("mastodon_user_id"))
+    user = find_analyzed_user(handle, acct, different_user, api)
+
+    # Pages that can't be fetched in time are left out and the analyses
+    # flagged incomplete, rather than failing the whole request.
+    deadline = time.monotonic() + ANALYSIS_TIME_BUDGET
+    budget = Budget.from_env()
+    results = {
+        "following": analyze_following(
+            user.id, list_id, api, cache, deadline=deadline, budget=budget
+        ),
+        "followers": analyze_followers(
+            user.id, api, cache, deadline=deadline, budget=budget
+        ),
+        "timeline": analyze_timeline(
+            user.id, list_id, api, cache, deadline=deadline, budget=budget
+        ),
+    }
+    results.update(
+        analyze_my_timeline(
+            user.id, api, cache, deadline=deadline, budget=budget
+        )
+    )
+    lists = []
+    if lst == ALL_LISTS:
+        lists = list_analyses(session_lists(), api, cache, deadline, budget)
+
+    if snapshot:
+        save_snapshot(handle, instance, list_id, results)
+
+    return results, lists, list_name, budget.usage()
+
+
+def analysis_row(an, **row):
+    """
+    Flatten an Analysis to the numbers shown in a row of results: rounded
+    percentages, then guessed and declared counts, per gender.
+    """
+    row.update(
+        complete=an.complete,
+        rate_limited=an.rate_limited,
+        ids_sampled=an.ids_sampled,
+        ids_fetched=an.ids_fetched,
+        andy=an.andy.n,
+    )
+    for gender in ("nonbinary", "male", "female"):
+        # Halves round up, as in the streamed results.
+        row["pct_" + gender] = int(an.pct(gender) + 0.5)
+        row["guessed_" + gender] = an.guessed(gender)
+        row["declared_" + gender] = an.declared(gender)
+    return row
+
+
+def analysis_view(acct, results, lists=(), list_name=None, usage=None):
+    """
+    Every number the results show, computed once, as a JSON-ready dict
+    that the results template only has to print.
+    """
+    own = [results[c] for c in ("following", "followers", "timeline")]
+    return {
+        "acct": acct,
+        "list_name": list_name,
+        "usage": usage and budget_summary(usage),
+        # How many accounts each source decided, if ANALYSIS_PROVENANCE is
+        # set.
+        "provenance": usage and usage["sources"],
+        "total_declared": sum(an.declared() for an in own),
+        "total_guessed": sum(an.guessed() for an in own),
+        "complete": all(an.complete for an in results.values()),
+        "rate_limited": any(an.rate_limited for an in results.values()),
+        "collections": [
+            analysis_row(results[c], collection=c, label=COLLECTION_LABELS[c])
+            for c in COLLECTIONS
+        ],
+        "lists": [analysis_row(an, name=name) for name, an in lists],
+    }
+
+
+@functools.lru_cache(maxsize=None)
+def results_template():
+    # Compiled once, rather than looked up and checked for changes on every
+    # render.
+    return app.jinja_env.get_template("results.html")
+
+
 @app.route("/", methods=["GET", "POST"])
 def index():
     tok = session.get("mastodon_token")
-    results = {}
-    list_name = list_id = error = form = None
+    results_html = error = form = None
 
     if request.method == "GET":
         if session.get("mastodon_user"):
             form = AnalyzeForm()
-            form.lst.choices = [("none", "No list")]
-            # Populate lists if there are any stored in the session
-            if session.get("lists"):
-                form.lst.choices += [
-                    (str(list["id"]), list["name"])
-                    for list in session["lists"]
-                ]
+            form.lst.choices = list_choices()
         else:
             form = LoginForm()
 
@@ -231,109 +530,194 @@ def index():
 
         elif form_type == "analyze":
             form = AnalyzeForm(request.form)
-            form.lst.choices = [("none", "No list")]
-            if session.get("lists"):
-                form.lst.choices += [
-                    (str(list["id"]), list["name"])
-                    for list in session["lists"]
-                ]
-
-            # We take the form handle, and replace the instance with
-            # the correct one obtained with webfinger
-            handle = form.analyze_acct.data
-            username = handle.split("@")[0]
+            form.lst.choices = list_choices()
+
+            acct = form.analyze_acct.data
             instance = session["instance"]
-            handle = f"{username}@{instance}"
-
-            session_user = session.get("mastodon_user")
-            different_user = form.analyze_acct.data != session_user
-
-            if form.validate() and form.analyze_acct.data:
-
-                if app.config["DRY_RUN"]:
-                    list_name = None
-                    following, followers, timeline = dry_run_analysis()
-                    results = {
-                        "following": following,
-                        "followers": followers,
-                        "timeline": timeline,
-                    }
-                else:
-                    # Get selected list
-                    if (
-                        session.get("lists")
-                        and form.lst
-                        and form.lst.data != "none"
-                    ):
-                        list_id = int(form.lst.data)
-                        list_name = [
-                            list["name"]
-                            for list in session["lists"]
-                            if int(list["id"]) == list_id
-                        ][0]
-                    try:
-                        _, instance = parse_mastodon_handle(handle)
-                        api = get_mastodon_api(tok, instance)
-                        cache = Cache()
-                        user = get_user_from_handle(handle, api)
-
-                        if user:
-                            if different_user and user.indexable is False:
-                                raise Exception(
-                                    f"User {form.analyze_acct.data} is not indexable.\n"
-                                    f"If the account is yours, you can change the setting on: "
-                                    f"Settings > Public profile > Privacy and reach > "
-                                    f"Include public posts in search results"
-                                )
-
-                            results = {
-                                "following": analyze_following(
-                                    user.id, list_id, api, cache
-                                ),
-                                "followers": analyze_followers(
-                                    user.id, api, cache
-                                ),
-                                "timeline": analyze_timeline(
-                                    user.id, list_id, api, cache
-                                ),
-                            }
-                            for key, value in results.items():
-                                if not value:
-                                    raise Exception(
-                                        f"Failed to fetch results "
-                                        f"for user {handle}."
-                                    )
-                        else:
-                            raise Exception(f"Failed to find user {handle}.")
-                    except Exception as exc:
-                        import traceback
-
-                        traceback.print_exc()
-                        if isinstance(exc, MastodonNotFoundError):
-                            error = f"Could not find user {form.analyze_acct.data}."
-                        elif isinstance(exc, MastodonNetworkError):
-                            error = (
-                                f"Could not connect to the Mastodon server {instance}.\n"
-                                "Please check the instance name or try again later."
-                            )
-                        else:
-                            error = exc
-
-                    if error is not None:
-                        error = str(error).replace("\n", "<br>")
-                pass
+            handle = analyzed_handle(acct)
+            different_user = acct != session.get("mastodon_user")
+
+            if form.validate() and acct:
+                try:
+                    view = analysis_view(
+                        acct,
+                        *run_analyses(
+                            tok, handle, acct, different_user, form.lst.data
+                        ),
+                    )
+                    results_html = Markup(results_template().render(**view))
+                except Exception as exc:
+                    traceback.print_exc()
+                    error = describe_error(exc, acct, instance)
 
     return render_template(
         "index.html",
         form=form,
-        results=results,
+        results_html=results_html,
         error=error,
-        div=div,
-        list_name=list_name,
         TRACKING_ID=TRACKING_ID,
     )
 
 
+@app.route("/api/analysis")
+def api_analysis():
+    """
+    Run the analyses of the analyze form, with the same query parameters as
+    analyze_stream, and get every number of the results as JSON, or an
+    "error" message: with status 404 if the account isn't found, 403 if it
+    can't be analyzed, and 502 if the analyses failed. Unlike the page, the
+    API doesn't save snapshots.
+    """
+    tok = session.get("mastodon_token")
+    acct = request.args.get("analyze_acct", "")
+    if not session.get("mastodon_user") or not acct:
+        return jsonify(error="Log in to analyze an account."), 403
+
+    instance = session["instance"]
+    handle = analyzed_handle(acct)
+    different_user = acct != session.get("mastodon_user")
+    try:
+        results = run_analyses(
+            tok,
+            handle,
+            acct,
+            different_user,
+            request.args.get("lst"),
+            snapshot=False,
+        )
+    except Exception as exc:
+        from mastodon import MastodonNotFoundError
+
+        if isinstance(exc, (UserNotFound, MastodonNotFoundError)):
+            status = 404
+        elif isinstance(exc, NotIndexable):
+            status = 403
+        else:
+            traceback.print_exc()
+            status = 502
+        return jsonify(error=error_message(exc, acct, instance)), status
+
+    return jsonify(analysis_view(acct, *results))
+
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@app.route("/analyze/stream")
+def analyze_stream():
+    """
+    Run the analyses of the analyze form as server-sent events: a "result"
+    event with the summary of a collection's Analysis so far after every
+    page, a "list" event with the name and summary of each list when
+    comparing all lists, then "done", or "failure" with an error message.
+    """
+    tok = session.get("mastodon_token")
+    acct = request.args.get("analyze_acct", "")
+    if not session.get("mastodon_user") or not acct:
+        return "Log in to analyze an account.", 403
+
+    instance = session["instance"]
+    handle = analyzed_handle(acct)
+    different_user = acct != session.get("mastodon_user")
+    viewer = session.get("mastodon_user_id")
+    list_id, list_name = selected_list(request.args.get("lst"))
+    lists = session_lists() if request.args.get("lst") == ALL_LISTS else []
+
+    def events():
+        if app.config["DRY_RUN"]:
+            for collection, an in zip(COLLECTIONS, dry_run_analysis()):
+                yield sse(
+                    "result",
+                    {"collection": collection, "summary": an.summary()},
+                )
+            yield sse("done", {"list_name": None})
+            return
+
+        try:
+            api = CoalescingApi(get_mastodon_api(tok, instance), instance)
+            cache = Cache(graph_index, instance, viewer)
+            user = find_analyzed_user(handle, acct, different_user, api)
+            deadline = time.monotonic() + ANALYSIS_TIME_BUDGET
+            budget = Budget.from_env()
+            results = {}
+
+            for collection, analyses in [
+                (
+                    "following",
+                    iter_following(
+                        user.id,
+                        list_id,
+                        api,
+                        cache,
+                        deadline=deadline,
+                        budget=budget,
+                    ),
+                ),
+                (
+                    "followers",
+                    iter_followers(
+                        user.id, api, cache, deadline=deadline, budget=budget
+                    ),
+                ),
+                (
+                    "timeline",
+                    iter_timeline(
+                        user.id,
+                        list_id,
+                        api,
+                        cache,
+                        deadline=deadline,
+                        budget=budget,
+                    ),
+                ),
+            ]:
+                for an in analyses:
+                    yield sse(
+                        "result",
+                        {"collection": collection, "summary": an.summary()},
+                    )
+                results[collection] = an
+
+            for collection, an in analyze_my_timeline(
+                user.id, api, cache, deadline=deadline, budget=budget
+            ).items():
+                yield sse(
+                    "result",
+                    {"collection": collection, "summary": an.summary()},
+                )
+                results[collection] = an
+            save_snapshot(handle, instance, list_id, results)
+
+            for list, an in iter_lists(
+                lists, api, cache, deadline=deadline, budget=budget
+            ):
+                yield sse(
+                    "list", {"name": list["name"], "summary": an.summary()}
+                )
+
+            yield sse(
+                "done",
+                {
+                    "list_name": list_name,
+                    "usage": budget_summary(budget.usage()),
+                    "provenance": budget.sources,
+                },
+            )
+        except Exception as exc:
+            traceback.print_exc()
+            yield sse(
+                "failure", {"message": error_message(exc, acct, instance)}
+            )
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        # Don't let proxies buffer the stream.
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 if __name__ == "__main__":
     import argparse
 
@@ -0,0 +1,125 @@
+"""
+Server-side sessions stored in SQLite.
+
+Flask's default session serializes and signs the whole session into the
+cookie, which is sent and verified on every request. Here the cookie only
+carries a random session id, and the data stays in a local database.
+"""
+
+import sqlite3
+import secrets
+import time
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class SqliteSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(self):
+            self.modified = True
+
+        CallbackDict.__init__(self, initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        # The sid this session had before regenerate(), if any.
+        self.old_sid = None
+
+    def regenerate(self):
+        """
+        Move the session to a new sid, e.g. when the user logs in or out, so
+        that a sid known before can't be used for the session after. The old
+        one is deleted when the session is saved.
+        """
+        if not self.new:
+            self.old_sid = self.old_sid or self.sid
+        self.sid = new_sid()
+        self.new = True
+        self.modified = True
+
+
+def new_sid():
+    return secrets.token_urlsafe(32)
+
+
+class SqliteSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, path="sessions.db"):
+        self.path = path
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "sid TEXT PRIMARY KEY, data TEXT NOT NULL, "
+                "expires REAL NOT NULL)"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def _new_session(self):
+        return SqliteSession(sid=new_sid(), new=True)
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(app.config["SESSION_COOKIE_NAME"])
+        if not sid:
+            return self._new_session()
+
+        with self._connect() as db:
+            row = db.execute(
+                "SELECT data FROM sessions WHERE sid = ? AND expires > ?",
+                (sid, time.time()),
+            ).fetchone()
+
+        if row is None:
+            return self._new_session()
+
+        return SqliteSession(self.serializer.loads(row[0]), sid=sid)
+
+    def save_session(self, app, session, response):
+        name = app.config["SESSION_COOKIE_NAME"]
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.old_sid is not None:
+            with self._connect() as db:
+                db.execute(
+                    "DELETE FROM sessions WHERE sid = ?", (session.old_sid,)
+                )
+
+        if not session:
+            if session.modified:
+                with self._connect() as db:
+                    db.execute(
+                        "DELETE FROM sessions WHERE sid = ?", (session.sid,)
+                    )
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        if not session.modified:
+            return
+
+        now = time.time()
+        expires = now + app.permanent_session_lifetime.total_seconds()
+        with self._connect() as db:
+            if session.new:
+                # Creating sessions is rare enough to clean up on.
+                db.execute("DELETE FROM sessions WHERE expires <= ?", (now,))
+            db.execute(
+                "INSERT OR REPLACE INTO sessions (sid, data, expires) "
+                "VALUES (?, ?, ?)",
+                (session.sid, self.serializer.dumps(dict(session)), expires),
+            )
+
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app),
+        )
@@ -0,0 +1,205 @@
+"""
+Keep a daily snapshot of users' analyses, to follow how their distributions
+change over months.
+
+Each snapshot is a fixed-size record per user, collection and day: the
+counts of its Analysis packed into RECORD.size bytes, so a year of daily
+snapshots of a user's six collections takes about 100 kB. Snapshots taken
+again on the same day replace the earlier ones, unless only the earlier
+ones are complete. Run them with a GraphIndex, so that each day only
+fetches what changed since the day before:
+
+    py analyze.py --batch handles.txt --snapshot snapshots.db
+"""
+
+import datetime
+import sqlite3
+import struct
+import sys
+import time
+from contextlib import closing
+
+from analyze import (
+    GENDERS,
+    Analysis,
+    analyze_handle,
+    iter_concurrently,
+    parse_mastodon_handle,
+)
+
+# ids_sampled, ids_fetched, then the count and declared count of each gender
+# as in Analysis.as_tuple, and whether the analysis was complete. Unknown
+# ids_fetched is stored as -1.
+RECORD = struct.Struct("<{}i?".format(2 + 2 * len(GENDERS)))
+
+EPOCH = datetime.date(1970, 1, 1)
+
+
+def today():
+    """
+    Days since the epoch, in UTC.
+    """
+    return int(time.time() // (24 * 60 * 60))
+
+
+def user_key(handle, instance=None):
+    """
+    The user@instance a snapshot is stored under, for a handle in any of the
+    formats analyze.py accepts.
+    """
+    username, handle_instance = parse_mastodon_handle(handle.lower())
+    return "{}@{}".format(username, handle_instance or instance.lower())
+
+
+def pack(an):
+    t = an.as_tuple()
+    ids_fetched = -1 if t[1] is None else t[1]
+    return RECORD.pack(t[0], ids_fetched, *t[2:], an.complete)
+
+
+def unpack(record):
+    *t, complete = RECORD.unpack(record)
+    if t[1] == -1:
+        t[1] = None
+    return Analysis.from_tuple(t, complete)
+
+
+class SnapshotStore(object):
+    def __init__(self, path="snapshots.db"):
+        self.path = path
+        with self._connect() as db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS snapshots ("
+                "user TEXT NOT NULL, collection TEXT NOT NULL, "
+                "day INTEGER NOT NULL, record BLOB NOT NULL, "
+                "PRIMARY KEY (user, collection, day)) WITHOUT ROWID"
+            )
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=10)
+
+    def add(self, user, results, day=None):
+        """
+        Save results, an Analysis per collection name, as the snapshot of
+        user on day, by default today. Complete snapshots already taken
+        that day aren't replaced by incomplete ones.
+        """
+        day = today() if day is None else day
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT collection, record FROM snapshots "
+                "WHERE user = ? AND day = ?",
+                (user, day),
+            )
+            complete = {
+                collection
+                for collection, record in rows
+                if unpack(record).complete
+            }
+            db.executemany(
+                "INSERT OR REPLACE INTO snapshots VALUES (?, ?, ?, ?)",
+                [
+                    (user, collection, day, pack(an))
+                    for collection, an in results.items()
+                    if an.complete or collection not in complete
+                ],
+            )
+
+    def taken(self, day=None):
+        """
+        The users with a snapshot on day, by default today.
+        """
+        day = today() if day is None else day
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT DISTINCT user FROM snapshots WHERE day = ?", (day,)
+            )
+            return {user for user, in rows}
+
+    def history(self, user, since=None):
+        """
+        Get the snapshots of user as {collection: [(date, Analysis)]},
+        oldest first, from the date since on if given.
+        """
+        first = 0 if since is None else (since - EPOCH).days
+        history = {}
+        with self._connect() as db:
+            rows = db.execute(
+                "SELECT collection, day, record FROM snapshots "
+                "WHERE user = ? AND day >= ? ORDER BY collection, day",
+                (user, first),
+            )
+            for collection, day, record in rows:
+                history.setdefault(collection, []).append(
+                    (EPOCH + datetime.timedelta(days=day), unpack(record))
+                )
+        return history
+
+    def trend(self, user, collection, gender, since=None):
+        """
+        Get the percentage of gender in collection over time, as a list of
+        (date, percentage), leaving out incomplete snapshots.
+        """
+        return [
+            (date, an.pct(gender))
+            for date, an in self.history(user, since).get(collection, [])
+            if an.complete
+        ]
+
+
+def run_snapshots(
+    handles,
+    instance,
+    api,
+    cache,
+    store,
+    concurrency=4,
+    progress=sys.stderr,
+    handle_cache=None,
+):
+    """
+    Analyze handles concurrently, like run_batch, and save each one's
+    results as today's snapshot. Handles already snapshotted today are
+    skipped, so an interrupted run can be resumed.
+    """
+    done = store.taken()
+    todo = {}
+    for handle in handles:
+        key = user_key(handle, instance)
+        if key not in done:
+            todo.setdefault(key, handle)
+
+    def analyze(key):
+        return analyze_handle(todo[key], api, cache, handle_cache=handle_cache)
+
+    start = time.time()
+    failed = 0
+    with closing(iter_concurrently(todo, analyze, concurrency)) as finished:
+        for i, (key, results, error) in enumerate(finished, 1):
+            if error is None:
+                try:
+                    store.add(key, results)
+                except Exception as exc:
+                    error = exc
+            if error is not None:
+                failed += 1
+            print(
+                "[{}/{}] {}{}".format(
+                    i,
+                    len(todo),
+                    key,
+                    "" if error is None else " (failed: {})".format(error),
+                ),
+                file=progress,
+            )
+
+    print(
+        "Snapshotted {} handles ({} failed, {} skipped) in {:.2f} "
+        "seconds".format(
+            len(todo) - failed,
+            failed,
+            len(handles) - len(todo),
+            time.time() - start,
+        ),
+        file=progress,
+    )
@@ -0,0 +1,130 @@
+class AttrDict(dict):
+    """A JSON object with attribute access, like Mastodon.py's."""
+
+    def __getattr__(self, name):
+        try:
+            return self[name]
+        except KeyError:
+            raise AttributeError(name)
+
+
+def account(id, display_name, note=""):
+    return AttrDict(
+        id=id,
+        username=str(id),
+        acct=str(id),
+        display_name=display_name,
+        note=note,
+        fields=[],
+        indexable=True,
+    )
+
+
+def status(account, reblog=None, in_reply_to_account_id=None, mentions=()):
+    return AttrDict(
+        account=account,
+        reblog=reblog,
+        in_reply_to_account_id=in_reply_to_account_id,
+        mentions=[AttrDict(id=i) for i in mentions],
+    )
+
+
+class Page(list):
+    """A list of results with a link to the next page, like Mastodon.py's."""
+
+    def __init__(self, items, next_page=None):
+        super().__init__(items)
+        self.next_page = next_page
+
+
+def pages(items, size):
+    page = None
+    for i in reversed(range(0, max(len(items), 1), size)):
+        page = Page(items[i : i + size], page)
+    return page
+
+
+class FakeApi(object):
+    """
+    Stands in for mastodon.Mastodon, serving canned accounts and statuses.
+    """
+
+    def __init__(
+        self,
+        accounts=(),
+        following=(),
+        followers=(),
+        home=(),
+        statuses=(),
+        lists=None,
+        page_size=80,
+    ):
+        self._accounts = {a.id: a for a in accounts}
+        self._following = list(following)
+        self._followers = list(followers)
+        self._home = list(home)
+        self._statuses = list(statuses)
+        self._lists = lists
+        self._page_size = page_size
+        self.calls = []
+
+    def _call(self, name, *args):
+        self.calls.append((name,) + args)
+
+    def account_search(self, q, limit=None):
+        self._call("account_search", q)
+        username = q.split("@")[0]
+        return [a for a in self._accounts.values() if a.username == username][
+            :limit
+        ]
+
+    def account_lookup(self, acct):
+        from mastodon import MastodonNotFoundError
+
+        self._call("account_lookup", acct)
+        for a in self._accounts.values():
+            if a.acct == acct.split("@")[0]:
+                return a
+        raise MastodonNotFoundError("Record not found")
+
+    def account_following(self, id, limit=None):
+        self._call("account_following", id)
+        return pages(self._following, self._page_size)
+
+    def list_accounts(self, id, limit=None):
+        self._call("list_accounts", id)
+        if self._lists is not None:
+            return pages(self._lists[id], self._page_size)
+        return pages(self._following, self._page_size)
+
+    def account_followers(self, id, limit=None):
+        self._call("account_followers", id)
+        return pages(self._followers, self._page_size)
+
+    def timeline_home(self, limit=None):
+        self._call("timeline_home")
+        return pages(self._home, self._page_size)
+
+    def timeline_list(self, id, limit=None):
+        self._call("timeline_list", id)
+        return pages(self._home, self._page_size)
+
+    def account_statuses(self, id, limit=None):
+        self._call("account_statuses", id)
+        return pages(self._statuses, self._page_size)
+
+    def accounts(self, ids):
+        self._call("accounts", list(ids))
+        return [self._accounts[i] for i in ids if i in self._accounts]
+
+    def account(self, id):
+        from mastodon import MastodonNotFoundError
+
+        self._call("account", id)
+        if id not in self._accounts:
+            raise MastodonNotFoundError("Record not found")
+        return self._accounts[id]
+
+    def fetch_next(self, page):
+        self._call("fetch_next")
+        return page.next_page
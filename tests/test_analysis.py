@@ -0,0 +1,67 @@
+import pickle
+import unittest
+
+from analyze import Analysis
+
+
+def make_analysis(updates, ids_sampled=None, ids_fetched=None):
+    an = Analysis(ids_sampled or len(updates), ids_fetched)
+    for gender, declared in updates:
+        an.update(gender, declared)
+    return an
+
+
+class TestAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.an = make_analysis(
+            [
+                ("male", False),
+                ("male", True),
+                ("female", True),
+                ("nonbinary", True),
+                ("unknown", False),
+                ("andy", False),
+            ]
+        )
+
+    def test_summary(self):
+        s = self.an.summary()
+        self.assertEqual(s["n"]["male"], 2)
+        self.assertEqual(s["n"]["andy"], 2)
+        self.assertEqual(s["pct"]["male"], 50.0)
+        self.assertEqual(s["guessed"]["male"], 1)
+        self.assertEqual(s["declared"]["female"], 1)
+        self.assertEqual(s["total_declared"], 3)
+        self.assertEqual(s["total_guessed"], 1)
+
+        # The summary matches the per-gender accessors.
+        for g in ("nonbinary", "male", "female"):
+            self.assertEqual(s["pct"][g], self.an.pct(g))
+            self.assertEqual(s["guessed"][g], self.an.guessed(g))
+            self.assertEqual(s["declared"][g], self.an.declared(g))
+        self.assertEqual(s["total_guessed"], self.an.guessed())
+        self.assertEqual(s["total_declared"], self.an.declared())
+
+    def test_stat_assignment_keeps_totals(self):
+        an = Analysis(250, 400)
+        an.male.n = 200
+        an.female.n = 40
+        an.andy.n = 250
+        an.male.n_declared = 20
+        self.assertEqual(an.n_known, 240)
+        self.assertEqual(an.male.n, 200)
+        self.assertEqual(an.guessed("male"), 180)
+
+    def test_add_and_subtract(self):
+        other = make_analysis([("female", False)], ids_fetched=10)
+        total = self.an + other
+        self.assertEqual(total.female.n, 2)
+        self.assertEqual(total.n_known, 5)
+        self.assertEqual(total.ids_sampled, 7)
+        self.assertEqual(total.ids_fetched, 10)
+        self.assertEqual(total - other, self.an + Analysis(0, 0))
+
+    def test_pickle(self):
+        an = pickle.loads(pickle.dumps(self.an))
+        self.assertEqual(an, self.an)
+        self.assertEqual(an.n_known, 4)
@@ -0,0 +1,88 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from analyze import Cache, run_batch
+from tests.fakes import FakeApi, account
+
+
+class TestBatch(unittest.TestCase):
+    def setUp(self):
+        self.api = FakeApi(
+            accounts=[account(1, "alice"), account(2, "bob")],
+            following=[account(3, "Carol"), account(4, "Dave")],
+            followers=[account(5, "Erin")],
+        )
+        fd, self.output = tempfile.mkstemp(suffix=".jsonl")
+        os.close(fd)
+        os.remove(self.output)
+
+    def tearDown(self):
+        if os.path.exists(self.output):
+            os.remove(self.output)
+
+    def run_batch(self, handles):
+        run_batch(
+            handles, self.api, Cache(), self.output, progress=io.StringIO()
+        )
+        with open(self.output) as f:
+            return [json.loads(line) for line in f]
+
+    def test_batch_is_resumable(self):
+        rows = self.run_batch(["1", "nobody"])
+        self.assertEqual(
+            {(r["handle"], r["collection"]) for r in rows if not r["error"]},
+            {
+                ("1", c)
+                for c in (
+                    "following",
+                    "followers",
+                    "timeline",
+                    "boosts",
+                    "replies",
+                    "mentions",
+                )
+            },
+        )
+        following = next(r for r in rows if r["collection"] == "following")
+        self.assertEqual((following["female"], following["male"]), (1, 1))
+        self.assertTrue(
+            any(r["handle"] == "nobody" and r["error"] for r in rows)
+        )
+
+        # A second run only analyzes new and previously failed handles.
+        self.api.calls = []
+        self.run_batch(["1", "nobody", "2"])
+        looked_up = [c[1] for c in self.api.calls if c[0] == "account_lookup"]
+        self.assertEqual(sorted(looked_up), ["2", "nobody"])
+
+    def test_interrupt_cancels_handles_not_started(self):
+        analyzed = []
+
+        def interrupted(handle, *args, **kwargs):
+            analyzed.append(handle)
+            raise KeyboardInterrupt
+
+        with mock.patch("analyze.analyze_handle", interrupted):
+            with self.assertRaises(KeyboardInterrupt):
+                run_batch(
+                    ["1", "2", "3"],
+                    self.api,
+                    Cache(),
+                    self.output,
+                    concurrency=1,
+                    progress=io.StringIO(),
+                )
+        self.assertEqual(analyzed, ["1"])
+
+    def test_csv_with_other_columns_is_not_resumed(self):
+        self.output = self.output[: -len(".jsonl")] + ".csv"
+        with open(self.output, "w") as f:
+            f.write("handle,collection,andy,error\n1,following,0,\n")
+
+        with self.assertRaisesRegex(ValueError, "can't be resumed"):
+            self.run_batch(["1"])
+        self.assertEqual(self.api.calls, [])
@@ -0,0 +1,153 @@
+import itertools
+import os
+import threading
+import unittest
+from unittest import mock
+
+from analyze import (
+    Budget,
+    Cache,
+    analyze_followers,
+    analyze_handle,
+    analyze_users,
+    provenance_summary,
+)
+from tests.fakes import FakeApi, account, status
+
+
+def followers(n, note="", start=10):
+    return [account(i, "Carol", note) for i in range(start, start + n)]
+
+
+class TestBudget(unittest.TestCase):
+    def test_accounts_limit_gives_smaller_sample(self):
+        budget = Budget(max_accounts=4)
+        api = FakeApi(followers=followers(10), page_size=3)
+        an = analyze_followers(1, api, Cache(), budget=budget)
+
+        self.assertEqual(an.ids_sampled, 4)
+        self.assertFalse(an.complete)
+        self.assertEqual(budget.exceeded, "accounts")
+        # Pagination stopped with the budget.
+        self.assertEqual(api.calls.count(("fetch_next",)), 1)
+
+    def test_bio_bytes_limit(self):
+        budget = Budget(max_bio_bytes=2500)
+        api = FakeApi(followers=followers(10, "x" * 1000))
+        an = analyze_followers(1, api, Cache(), budget=budget)
+
+        self.assertEqual(an.ids_sampled, 3)
+        self.assertEqual(budget.usage()["bio_bytes"], 3000)
+        self.assertEqual(budget.exceeded, "bio_bytes")
+
+    def test_cpu_limit(self):
+        budget = Budget(max_cpu_seconds=2)
+        # Every classification takes one second of CPU time.
+        clock = itertools.count()
+        with mock.patch("analyze.time.thread_time", lambda: next(clock)):
+            an = analyze_users(followers(5), budget=budget)
+
+        self.assertEqual(an.ids_sampled, 2)
+        self.assertFalse(an.complete)
+        self.assertEqual(budget.exceeded, "cpu_seconds")
+
+    def test_collectors_share_the_budget(self):
+        api = FakeApi(
+            accounts=[account(1, "alice")],
+            following=followers(3),
+            followers=followers(3, start=20),
+            home=[status(a) for a in followers(3, start=30)],
+        )
+        budget = Budget(max_accounts=5)
+        results = analyze_handle("1@example.com", api, Cache(), budget=budget)
+
+        self.assertEqual(results["following"].ids_sampled, 3)
+        self.assertTrue(results["following"].complete)
+        self.assertEqual(results["followers"].ids_sampled, 2)
+        self.assertFalse(results["followers"].complete)
+        self.assertEqual(results["timeline"].ids_sampled, 0)
+        self.assertFalse(results["timeline"].complete)
+        self.assertEqual(budget.accounts, 5)
+
+    def test_accounts_are_charged_once(self):
+        api = FakeApi(
+            accounts=[account(1, "alice")],
+            following=followers(3, "x" * 100),
+            followers=followers(3, "x" * 100),
+        )
+        budget = Budget(max_accounts=5)
+        results = analyze_handle("1@example.com", api, Cache(), budget=budget)
+
+        self.assertTrue(results["followers"].complete)
+        self.assertEqual(results["followers"].ids_sampled, 3)
+        self.assertEqual((budget.accounts, budget.bio_bytes), (3, 300))
+
+    def test_concurrent_collectors_charge_accounts_once(self):
+        budget = Budget()
+        cache = Cache()
+        users = followers(20)
+        threads = [
+            threading.Thread(
+                target=analyze_users,
+                args=(users,),
+                kwargs=dict(budget=budget, cache=cache),
+            )
+            for _ in range(4)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(budget.accounts, 20)
+
+    def test_cache_is_bounded(self):
+        cache = Cache(max_accounts=5)
+        cache.AddUsers(followers(8))
+        for user in followers(8):
+            cache.Classify(user)
+        self.assertEqual(len(cache.UsersLookup(list(range(10, 18)))), 5)
+        # The oldest ones were dropped.
+        self.assertEqual(cache.UncachedUsers([10, 17]), [10])
+
+    def test_from_env(self):
+        env = {"ANALYSIS_MAX_ACCOUNTS": "100", "ANALYSIS_MAX_CPU_SECONDS": "0"}
+        with mock.patch.dict(os.environ, env):
+            budget = Budget.from_env()
+        self.assertEqual(budget.max_accounts, 100)
+        self.assertIsNone(budget.max_cpu_seconds)
+        self.assertIsNotNone(budget.max_bio_bytes)
+
+
+class TestProvenance(unittest.TestCase):
+    def test_sources_are_counted(self):
+        users = [
+            account(1, "Carol"),
+            account(2, "Carol"),
+            account(3, "X", note="he/him"),
+            account(4, "X.Y.Z."),
+        ]
+        users[3].fields = [{"name": "Pronouns", "value": "they/them"}]
+        budget = Budget(provenance=True)
+        analyze_users(users, budget=budget)
+
+        self.assertEqual(
+            budget.usage()["sources"],
+            {
+                "display_name:first_name/usa": 2,
+                "bio": 1,
+                "pronouns_field": 1,
+            },
+        )
+        self.assertEqual(
+            provenance_summary(budget.sources)[0].split(),
+            ["display_name:first_name/usa", "2", "50.00%"],
+        )
+
+    def test_off_by_default(self):
+        budget = Budget()
+        analyze_users(followers(2), budget=budget)
+        self.assertIsNone(budget.usage()["sources"])
+
+
+if __name__ == "__main__":
+    unittest.main()
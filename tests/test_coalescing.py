@@ -0,0 +1,126 @@
+import threading
+import time
+import unittest
+
+from mastodon import MastodonNetworkError
+
+from analyze import CoalescingApi, SingleFlight, call_with_retries
+from tests.fakes import FakeApi, account
+
+
+class SlowApi(FakeApi):
+    def account_followers(self, id, limit=None):
+        time.sleep(0.1)
+        return super().account_followers(id, limit)
+
+
+class TestCoalescing(unittest.TestCase):
+    def run_concurrently(self, fn, n=5):
+        results = [None] * n
+
+        def run(i):
+            results[i] = fn()
+
+        threads = [threading.Thread(target=run, args=(i,)) for i in range(n)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return results
+
+    def test_identical_calls_share_one_request(self):
+        flights = SingleFlight()
+        upstream = SlowApi(followers=[account(2, "Bob")])
+        api = CoalescingApi(upstream, "example.com", flights)
+
+        results = self.run_concurrently(
+            lambda: api.account_followers(id=1, limit=80)
+        )
+
+        self.assertEqual(len(upstream.calls), 1)
+        self.assertTrue(all(r is results[0] for r in results))
+        self.assertEqual((flights.calls, flights.shared), (1, 4))
+
+    def test_other_keys_and_instances_are_not_shared(self):
+        flights = SingleFlight()
+        upstream = SlowApi()
+        self.run_concurrently(
+            lambda: CoalescingApi(
+                upstream, "a.example", flights
+            ).account_followers(id=1),
+            n=2,
+        )
+        CoalescingApi(upstream, "b.example", flights).account_followers(id=1)
+        CoalescingApi(upstream, "a.example", flights).account_followers(id=2)
+        self.assertEqual(flights.calls, 3)
+
+    def test_other_credentials_are_not_shared(self):
+        flights = SingleFlight()
+        alice, bob = SlowApi(), SlowApi()
+        alice.access_token, bob.access_token = "alice", "bob"
+
+        threads = [
+            threading.Thread(
+                target=CoalescingApi(
+                    upstream, "example.com", flights
+                ).account_followers,
+                args=(1,),
+            )
+            for upstream in (alice, bob)
+        ]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(flights.calls, 2)
+        self.assertEqual((len(alice.calls), len(bob.calls)), (1, 1))
+
+    def test_errors_are_shared(self):
+        flights = SingleFlight()
+
+        def fail():
+            time.sleep(0.1)
+            raise ValueError("upstream failed")
+
+        errors = []
+
+        def call():
+            try:
+                flights.do("key", fail)
+            except ValueError as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=call) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(flights.calls, 1)
+
+    def test_waiting_is_bounded_by_the_deadline(self):
+        flights = SingleFlight()
+        release = threading.Event()
+        leader = threading.Thread(
+            target=flights.do, args=("key", lambda: release.wait(5))
+        )
+        leader.start()
+        while not flights.calls:
+            time.sleep(0.01)
+
+        start = time.monotonic()
+        try:
+            with self.assertRaises(MastodonNetworkError):
+                call_with_retries(
+                    lambda: flights.do("key", lambda: None),
+                    deadline=start + 0.2,
+                )
+            self.assertLess(time.monotonic() - start, 1)
+        finally:
+            release.set()
+            leader.join()
+
+    def test_personal_endpoints_pass_through(self):
+        upstream = FakeApi()
+        api = CoalescingApi(upstream, "example.com", SingleFlight())
+        self.assertEqual(api.timeline_home, upstream.timeline_home)
@@ -0,0 +1,90 @@
+import io
+import random
+import threading
+import time
+import unittest
+from unittest import mock
+
+from analyze import Cache, Reservoir, analyze_handle
+from tests.fakes import FakeApi, account, status
+
+
+def make_api():
+    me = account(1, "alice")
+    me.update(following_count=40, followers_count=40, statuses_count=1)
+    names = ["Carol", "Bob", "Sam", "Zzyzx"]
+    return FakeApi(
+        accounts=[me],
+        following=[account(i, names[i % 4]) for i in range(10, 50)],
+        followers=[account(i, names[i % 3]) for i in range(50, 90)],
+        home=[status(account(2, "Dave"))],
+        statuses=[status(me, reblog=status(account(3, "Erin")))],
+        page_size=8,
+    )
+
+
+class FailingApi(FakeApi):
+    """Fails to fetch one collection while the other hangs."""
+
+    def __init__(self, failing, **kwargs):
+        super().__init__(**kwargs)
+        self.failing = failing
+        self.release = threading.Event()
+
+    def fetch(self, collection, id, limit):
+        if collection == self.failing:
+            raise RuntimeError(collection + " failed")
+        self.release.wait(5)
+        return getattr(super(), "account_" + collection)(id, limit)
+
+    def account_following(self, id, limit=None):
+        return self.fetch("following", id, limit)
+
+    def account_followers(self, id, limit=None):
+        return self.fetch("followers", id, limit)
+
+
+class TestConcurrentAnalyses(unittest.TestCase):
+    def analyze(self, concurrency, seed, progress=None):
+        return analyze_handle(
+            "1",
+            make_api(),
+            Cache(),
+            rng=random.Random(seed),
+            concurrency=concurrency,
+            progress=progress,
+        )
+
+    # Samples of 10 accounts out of 40.
+    @mock.patch("analyze.Reservoir", lambda size, rng: Reservoir(10, rng))
+    def test_seeded_samples_are_reproducible(self):
+        sequential = self.analyze(1, seed=7)
+        self.assertEqual(sequential["followers"].ids_sampled, 10)
+
+        for _ in range(3):
+            concurrent = self.analyze(4, seed=7)
+            self.assertEqual(list(concurrent), list(sequential))
+            self.assertEqual(concurrent, sequential)
+
+    def test_progress(self):
+        out = io.StringIO()
+        results = self.analyze(4, seed=0, progress=out)
+
+        self.assertEqual(results["following"].ids_sampled, 40)
+        # 5 pages each of following and followers, one of the home timeline
+        # and one of the user's statuses. 80 accounts a page, and 10 pages
+        # of home timeline, are expected.
+        self.assertTrue(out.getvalue().endswith("\n"))
+        self.assertIn("12/13 pages, 82 accounts", out.getvalue())
+
+    def test_first_failure_fails_the_analysis(self):
+        # Whether or not the collectors before the failing one are done.
+        for failing in ("following", "followers"):
+            api = FailingApi(failing, accounts=[account(1, "alice")])
+            start = time.monotonic()
+            try:
+                with self.assertRaisesRegex(RuntimeError, failing):
+                    analyze_handle("1", api, Cache(), concurrency=4)
+                self.assertLess(time.monotonic() - start, 1)
+            finally:
+                api.release.set()
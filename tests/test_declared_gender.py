@@ -1,6 +1,9 @@
+import random
+import threading
 import unittest
 
-from analyze import declared_gender
+import analyze
+from analyze import declared_gender, strip_html
 
 
 class TestDeclaredGender(unittest.TestCase):
@@ -53,3 +56,97 @@ class TestDeclaredGender(unittest.TestCase):
                 "Should have guessed profile '%s' was '%s', not '%s'"
                 % (description, expected_gender, guess)
             )
+
+
+PATTERNS = list(analyze.make_pronoun_patterns())
+
+
+def declared_gender_with_patterns(description):
+    """declared_gender as it used to be, with a regular expression per term."""
+    dl = description.lower()
+    if (
+        "pronoun.is" in dl
+        and "pronoun.is/she" not in dl
+        and "pronoun.is/he" not in dl
+    ):
+        return "nonbinary"
+
+    guesses = {g for p, g in PATTERNS if p.search(dl)}
+    return next(iter(guesses)) if len(guesses) == 1 else "andy"
+
+
+class TestPrefilter(unittest.TestCase):
+    def test_matcher_matches_patterns(self):
+        words = [
+            "she", "her", "hers", "he", "him", "they", "them", "non",
+            "binary", "nb", "mom", "cardamom", "crawdad", "the", "shell",
+            "hero", "xe", "/", " /", ",", "-", ".", "pronoun.is/", "é",
+            "_", "1", "pronoun.is/", "pronounxis/", "hexyz",
+        ]  # fmt: skip
+        rng = random.Random(0)
+        for _ in range(5000):
+            description = "".join(
+                rng.choice(words) + rng.choice(["", " "])
+                for _ in range(rng.randrange(6))
+            )
+            self.assertEqual(
+                declared_gender(description),
+                declared_gender_with_patterns(description),
+                description,
+            )
+
+    def test_other_languages(self):
+        for description, expected_gender in [
+            ("sie/ihr", "female"),
+            ("Pronomen: er / ihm", "male"),
+            ("nicht-binär, dey/denen", "nonbinary"),
+            ("Mutter von zwei Kindern", "female"),
+            ("Sie finden mich hier", "andy"),
+            ("il/lui", "male"),
+            ("elle/la", "female"),
+            ("iel", "nonbinary"),
+            ("pe\u0300re de famille", "male"),
+            ("il fait beau", "andy"),
+            ("ella", "female"),
+            ("él/lo", "male"),
+            ("no binarie", "nonbinary"),
+            ("el gato", "andy"),
+            # French for she, Spanish for they.
+            ("elle", "andy"),
+            # Terms in several languages must agree, like in one.
+            ("she/her, er/ihm", "andy"),
+        ]:
+            self.assertEqual(
+                declared_gender(description), expected_gender, description
+            )
+
+    def test_fast_path_is_counted(self):
+        stats = analyze.prefilter_stats
+        fast, slow = stats.fast, stats.slow
+        declared_gender("coffee and cats")
+        declared_gender("she/her")
+        self.assertEqual((stats.fast - fast, stats.slow - slow), (1, 1))
+
+    def test_counts_from_threads_add_up(self):
+        stats = analyze.PrefilterStats()
+        threads = [
+            threading.Thread(
+                target=lambda: [stats.count(i % 2 == 0) for i in range(5000)]
+            )
+            for _ in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual((stats.fast, stats.slow), (20000, 20000))
+
+    def test_strip_html(self):
+        note = (
+            '<p>Writer :verified:</p><p>she&#39;s &amp; <a href="https://'
+            'example.com/he">her</a></p>'
+        )
+        self.assertEqual(
+            strip_html(note).split(), ["Writer", "she's", "&", "her"]
+        )
+        self.assertEqual(declared_gender(strip_html(note)), "female")
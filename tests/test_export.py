@@ -0,0 +1,60 @@
+import csv
+import os
+import shutil
+import tempfile
+import unittest
+
+from analyze import Cache, analyze_handle
+from export import CsvExporter
+from tests.fakes import FakeApi, account
+
+try:
+    import pyarrow.parquet as pq
+except ImportError:
+    pq = None
+
+
+class TestExport(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.api = FakeApi(
+            accounts=[account(1, "alice")],
+            following=[account(3, "Carol"), account(4, "X", note="he/him")],
+            followers=[account(5, "Zzyzx")],
+        )
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_csv_export(self):
+        path = os.path.join(self.dir, "accounts.csv")
+        with CsvExporter(path) as exporter:
+            analyze_handle("1", self.api, Cache(), exporter)
+
+        with open(path, newline="") as f:
+            rows = list(csv.DictReader(f))
+
+        self.assertEqual(
+            [
+                (r["collection"], r["acct"], r["gender"], r["source"])
+                for r in rows
+            ],
+            [
+                ("following", "3", "female", "display_name:first_name/usa"),
+                ("following", "4", "male", "bio"),
+                ("followers", "5", "unknown", "display_name:first_name/usa"),
+            ],
+        )
+        self.assertEqual({r["handle"] for r in rows}, {"1"})
+
+    @unittest.skipIf(pq is None, "pyarrow is not installed")
+    def test_parquet_export(self):
+        from export import ParquetExporter
+
+        path = os.path.join(self.dir, "accounts.parquet")
+        with ParquetExporter(path, row_group_size=2) as exporter:
+            analyze_handle("1", self.api, Cache(), exporter)
+
+        table = pq.read_table(path)
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(table.column("declared").to_pylist()[1], True)
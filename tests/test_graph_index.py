@@ -0,0 +1,116 @@
+import os
+import tempfile
+import unittest
+
+from analyze import (
+    Cache,
+    GraphIndex,
+    analyze_followers,
+    analyze_my_timeline,
+)
+from tests.fakes import FakeApi, account, status
+
+
+def followers(ids):
+    return [account(i, "Carol" if i % 2 else "Bob") for i in ids]
+
+
+class TestGraphIndex(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_fresh_graph_needs_no_calls(self):
+        index = GraphIndex(self.path)
+        api = FakeApi(followers=followers(range(10, 15)), page_size=2)
+        first = analyze_followers(1, api, Cache(index, "example.com", 99))
+
+        api.calls = []
+        cache = Cache(index, "example.com", 99)
+        second = analyze_followers(1, api, cache)
+
+        self.assertEqual(api.calls, [])
+        self.assertEqual(cache.index_hits, 5)
+        self.assertEqual(second.summary(), first.summary())
+        self.assertTrue(second.complete)
+
+    def test_stale_graph_is_topped_up(self):
+        index = GraphIndex(self.path, ttl=0)
+        api = FakeApi(followers=followers(range(10, 15)), page_size=2)
+        analyze_followers(1, api, Cache(index, "example.com", 99))
+
+        # A new follower comes first; the first page is enough to tell
+        # the others haven't changed.
+        api = FakeApi(followers=followers(range(9, 15)), page_size=2)
+        an = analyze_followers(1, api, Cache(index, "example.com", 99))
+
+        self.assertEqual(api.calls, [("account_followers", 1)])
+        self.assertEqual(an.ids_sampled, 6)
+        self.assertEqual(an.ids_fetched, 6)
+        self.assertEqual(
+            index.edges("example.com", 99, 1, "followers")[0][0], 9
+        )
+
+    def test_other_instances_are_separate(self):
+        index = GraphIndex(self.path)
+        api = FakeApi(followers=followers(range(10, 12)))
+        analyze_followers(1, api, Cache(index, "example.com", 99))
+
+        api.calls = []
+        analyze_followers(1, api, Cache(index, "example.org", 99))
+        self.assertEqual(
+            api.calls, [("account_followers", 1), ("fetch_next",)]
+        )
+
+    def test_other_viewers_are_separate(self):
+        # Locked accounts may show their followers to some viewers only.
+        index = GraphIndex(self.path)
+        api = FakeApi(followers=followers(range(10, 12)))
+        analyze_followers(1, api, Cache(index, "example.com", 99))
+
+        for viewer in (98, None):
+            api.calls = []
+            analyze_followers(1, api, Cache(index, "example.com", viewer))
+            self.assertEqual(
+                api.calls, [("account_followers", 1), ("fetch_next",)]
+            )
+
+    def test_exports_bypass_the_index(self):
+        index = GraphIndex(self.path)
+        api = FakeApi(followers=followers(range(10, 12)))
+        analyze_followers(1, api, Cache(index, "example.com", 99))
+
+        exported = []
+        api.calls = []
+        analyze_followers(
+            1,
+            api,
+            Cache(index, "example.com", 99),
+            export=lambda *row: exported.append(row),
+        )
+        self.assertEqual(
+            api.calls, [("account_followers", 1), ("fetch_next",)]
+        )
+        self.assertEqual(len(exported), 2)
+
+    def test_known_replies_and_mentions_are_not_fetched(self):
+        me = account(1, "Me")
+        bob = account(3, "Bob")
+        they = account(4, "Sam", note="they/them")
+        api = FakeApi(
+            accounts=[me, bob, they],
+            statuses=[status(me, in_reply_to_account_id=3, mentions=[4])],
+        )
+        index = GraphIndex(self.path)
+        analyze_my_timeline(1, api, Cache(index, "example.com", 99))
+
+        api.calls = []
+        results = analyze_my_timeline(1, api, Cache(index, "example.com", 99))
+
+        # Only the statuses are fetched.
+        self.assertNotIn("accounts", [c[0] for c in api.calls])
+        self.assertEqual(results["replies"].male.n, 1)
+        self.assertEqual(results["mentions"].nonbinary.n_declared, 1)
@@ -0,0 +1,93 @@
+import os
+import tempfile
+import unittest
+
+from mastodon import MastodonNotFoundError, MastodonVersionError
+
+from analyze import HandleCache, get_user_from_handle, resolve_account_id
+from tests.fakes import FakeApi, account
+
+
+class SearchOnlyApi(FakeApi):
+    """A server or Mastodon.py without accounts/lookup."""
+
+    account_lookup = None
+
+
+class OldServerApi(FakeApi):
+    """A server without accounts/lookup, behind a recent Mastodon.py."""
+
+    def __init__(self, error, **kwargs):
+        super().__init__(**kwargs)
+        self.error = error
+
+    def account_lookup(self, acct):
+        self._call("account_lookup", acct)
+        raise self.error
+
+
+class TestHandleResolution(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+        self.handle_cache = HandleCache(self.path)
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_lookup_is_preferred_and_cached(self):
+        api = FakeApi(accounts=[account(1, "alice")])
+
+        user = get_user_from_handle("@1@example.com", api, self.handle_cache)
+        self.assertEqual(user.id, 1)
+        self.assertEqual(api.calls, [("account_lookup", "1@example.com")])
+
+        # Cached ids need no request at all.
+        api.calls = []
+        self.assertEqual(
+            resolve_account_id("1@example.com", api, self.handle_cache), 1
+        )
+        self.assertEqual(api.calls, [])
+
+        # Full accounts are fetched directly by id.
+        get_user_from_handle("1@Example.com", api, self.handle_cache)
+        self.assertEqual(api.calls, [("account", 1)])
+
+    def test_expired_entries_are_resolved_again(self):
+        api = FakeApi(accounts=[account(1, "alice")])
+        handle_cache = HandleCache(self.path, ttl=-1)
+        resolve_account_id("1@example.com", api, handle_cache)
+        resolve_account_id("1@example.com", api, handle_cache)
+        self.assertEqual(
+            [c[0] for c in api.calls], ["account_lookup", "account_lookup"]
+        )
+
+    def test_search_fallback_only_trusts_exact_matches(self):
+        other = account(2, "bob")
+        other.update(username="alice", acct="alice@elsewhere.social")
+        api = SearchOnlyApi(accounts=[other])
+        self.assertIsNone(get_user_from_handle("alice@example.com", api))
+
+        api = SearchOnlyApi(accounts=[account(1, "alice")])
+        self.assertEqual(get_user_from_handle("1@example.com", api).id, 1)
+
+    def test_unknown_handles_are_not_searched(self):
+        api = FakeApi(accounts=[account(1, "alice")])
+        self.assertIsNone(get_user_from_handle("nobody@example.com", api))
+        self.assertEqual(api.calls, [("account_lookup", "nobody@example.com")])
+
+    def test_search_fallback_without_the_lookup_endpoint(self):
+        for error in [
+            MastodonNotFoundError(
+                "Mastodon API returned error",
+                404,
+                "Not Found",
+                "Endpoint not found.",
+            ),
+            MastodonVersionError("Version check failed"),
+        ]:
+            api = OldServerApi(error, accounts=[account(1, "alice")])
+            self.assertEqual(get_user_from_handle("1@example.com", api).id, 1)
+            self.assertEqual(
+                [c[0] for c in api.calls], ["account_lookup", "account_search"]
+            )
@@ -0,0 +1,76 @@
+import random
+import threading
+import time
+import unittest
+from unittest import mock
+
+import analyze
+from analyze import Cache, analyze_lists
+from tests.fakes import FakeApi, account
+
+ALICES = [account(i, "Alice") for i in range(10, 16)]
+BOBS = [account(i, "Bob") for i in range(20, 24)]
+
+LISTS = [
+    {"id": 1, "name": "Alices"},
+    {"id": 2, "name": "Bobs"},
+    {"id": 3, "name": "Everyone"},
+]
+
+
+class ConcurrencyApi(FakeApi):
+    """Records how many list_accounts calls run at once."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self.running = self.max_running = 0
+
+    def list_accounts(self, id, limit=None):
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.05)
+        with self._lock:
+            self.running -= 1
+        return super().list_accounts(id, limit)
+
+
+def make_api(cls=FakeApi):
+    return cls(lists={1: ALICES, 2: BOBS, 3: ALICES + BOBS}, page_size=4)
+
+
+class TestAnalyzeLists(unittest.TestCase):
+    def test_one_analysis_per_list(self):
+        results = analyze_lists(LISTS, make_api(), Cache())
+
+        self.assertEqual(list(results), [1, 2, 3])
+        self.assertEqual(results[1].female.n, 6)
+        self.assertEqual(results[2].male.n, 4)
+        self.assertEqual((results[3].female.n, results[3].male.n), (6, 4))
+        self.assertTrue(all(an.complete for an in results.values()))
+
+    def test_accounts_on_several_lists_are_classified_once(self):
+        with mock.patch.object(
+            analyze, "classify_user", wraps=analyze.classify_user
+        ) as classify:
+            analyze_lists(LISTS, make_api(), Cache())
+        self.assertEqual(classify.call_count, len(ALICES) + len(BOBS))
+
+    def test_lists_are_fetched_concurrently(self):
+        lists = [{"id": i % 3 + 1, "name": str(i)} for i in range(6)]
+        api = make_api(ConcurrencyApi)
+        analyze_lists(lists, api, Cache(), concurrency=3)
+        self.assertEqual(api.max_running, 3)
+
+    def test_samples_are_reproducible(self):
+        def sample():
+            return analyze_lists(
+                LISTS, make_api(), Cache(), rng=random.Random(1)
+            )
+
+        self.assertEqual(sample(), sample())
+
+
+if __name__ == "__main__":
+    unittest.main()
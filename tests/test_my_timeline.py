@@ -0,0 +1,79 @@
+import unittest
+from unittest import mock
+
+from mastodon import MastodonAPIError, MastodonInternalServerError
+
+from analyze import Cache, analyze_my_timeline, get_accounts
+from tests.fakes import FakeApi, account, status
+
+
+class TestMyTimeline(unittest.TestCase):
+    def test_analyze_my_timeline(self):
+        me = account(1, "Me")
+        alice = account(2, "Alice")
+        bob = account(3, "Bob")
+        they = account(4, "Sam", note="they/them")
+        api = FakeApi(
+            accounts=[me, alice, bob, they],
+            statuses=[
+                status(me, reblog=status(alice)),
+                status(me, in_reply_to_account_id=3, mentions=[3, 4]),
+                status(me, mentions=[2, 1]),
+                status(me, in_reply_to_account_id=1, mentions=[4]),
+            ],
+            page_size=2,
+        )
+
+        results = analyze_my_timeline(1, api, Cache())
+
+        self.assertEqual(results["boosts"].female.n, 1)
+        self.assertEqual(results["replies"].male.n, 1)
+        self.assertEqual(results["mentions"].ids_sampled, 3)
+        self.assertEqual(results["mentions"].female.n, 1)
+        self.assertEqual(results["mentions"].nonbinary.n_declared, 2)
+
+        # Alice was embedded in the boost, so only Bob and Sam are fetched.
+        lookups = [c[1] for c in api.calls if c[0] == "accounts"]
+        self.assertEqual(sorted(i for ids in lookups for i in ids), [3, 4])
+
+
+class ErrorApi(FakeApi):
+    def __init__(self, errors, **kwargs):
+        super().__init__(**kwargs)
+        self.errors = list(errors)
+
+    def accounts(self, ids):
+        if self.errors:
+            self._call("accounts", list(ids))
+            raise self.errors.pop(0)
+        return super().accounts(ids)
+
+
+@mock.patch("analyze.time.sleep")
+class TestGetAccounts(unittest.TestCase):
+    def test_fallback_without_the_endpoint(self, sleep):
+        missing = MastodonAPIError(
+            "Mastodon API returned error", 405, "Method Not Allowed", None
+        )
+        api = ErrorApi([missing], accounts=[account(3, "Bob")])
+        self.assertEqual([a.id for a in get_accounts([3, 4], api)], [3])
+        self.assertEqual(
+            [c[0] for c in api.calls], ["accounts", "account", "account"]
+        )
+
+    def test_server_errors_are_retried(self, sleep):
+        error = MastodonInternalServerError(
+            "Mastodon API returned error", 500, "Internal Server Error", None
+        )
+        api = ErrorApi(
+            [error],
+            accounts=[account(1, "Me"), account(3, "Bob")],
+            statuses=[status(account(1, "Me"), in_reply_to_account_id=3)],
+        )
+        results = analyze_my_timeline(1, api, Cache())
+
+        self.assertEqual(results["replies"].male.n, 1)
+        self.assertEqual(
+            [c[0] for c in api.calls if c[0] != "fetch_next"],
+            ["account_statuses", "accounts", "accounts"],
+        )
@@ -0,0 +1,223 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+import warnings
+from unittest import mock
+
+from unidecode import unidecode
+
+from nameindex import NameIndex, write_name_index
+
+import analyze
+from analyze import (
+    DisplayName,
+    build_name_table,
+    cascade_gender,
+    get_detector,
+    guess_gender,
+    load_detector,
+    load_name_index,
+    name_index_source,
+    rm_punctuation,
+    split,
+)
+
+
+def legacy_cascade(display_name, detector):
+    """
+    The detector cascade as classify_user used to run it, on detector, e.g.
+    gender_guesser's own rather than the name index.
+    """
+    for name, country in [
+        (split(display_name), "usa"),
+        (display_name, "usa"),
+        (split(unidecode(display_name)), "usa"),
+        (unidecode(display_name), "usa"),
+        (split(display_name), None),
+        (display_name, None),
+        (unidecode(display_name), None),
+        (split(unidecode(display_name)), None),
+    ]:
+        g = detector.get_gender(name, country)
+        if g != "andy":
+            break
+
+        g = detector.get_gender(rm_punctuation(name), country)
+        if g != "andy":
+            break
+
+    return g
+
+
+def display_names(name):
+    yield name
+    yield name.title()
+    yield name.upper()
+    yield f"{name.title()} Smith"
+    yield f" {name.title()}"
+    yield f"{name.title()}!"
+    yield f"{name.title()} 🌻"
+    yield f"Dr. {name.title()}"
+
+
+class TestNameTable(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Build the table rather than load a names.pickle that may be stale.
+        cls.table = build_name_table(get_detector())
+        # What the index was built from, for checking it against.
+        cls.detector = load_detector()
+        # A deterministic sample of the names, and some that aren't.
+        cls.names = sorted(get_detector().names)[::40] + [
+            "",
+            "xX_coder_Xx",
+            "🐘",
+            "Jürgen",
+            "Anne-Marie",
+            "li gen",
+        ]
+
+    def setUp(self):
+        warnings.simplefilter("ignore")
+        patcher = mock.patch.object(
+            analyze, "get_name_table", return_value=self.table
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(warnings.resetwarnings)
+
+    def test_table_agrees_with_cascade(self):
+        for name in self.names:
+            for display_name in display_names(name):
+                self.assertEqual(
+                    guess_gender(display_name),
+                    cascade_gender(display_name),
+                    display_name,
+                )
+
+    def test_cascade_agrees_with_legacy_cascade(self):
+        for name in self.names[::10]:
+            for display_name in display_names(name):
+                self.assertEqual(
+                    cascade_gender(display_name)[0],
+                    legacy_cascade(display_name, self.detector),
+                    display_name,
+                )
+
+    def test_variants(self):
+        self.assertEqual(
+            guess_gender("Alice Smith"), ("female", "first_name/usa")
+        )
+        self.assertEqual(guess_gender("🐘"), ("unknown", "first_name/usa"))
+
+    def test_common_names_skip_the_cascade(self):
+        with mock.patch.object(analyze, "cascade_gender") as cascade:
+            for display_name in ["Alice", "Bob Smith", "JÜRGEN", "Jürgen X"]:
+                guess_gender(display_name)
+        cascade.assert_not_called()
+
+    def test_variants_are_made_once(self):
+        # Androgynous, so the cascade gets to the ASCII-folded probes.
+        display_name = DisplayName("Gökçe")
+        with mock.patch.object(
+            analyze, "unidecode", wraps=unidecode
+        ) as fold, mock.patch.object(
+            analyze, "rm_punctuation", wraps=rm_punctuation
+        ) as strip:
+            cascade_gender(display_name)
+            self.assertEqual(
+                cascade_gender(display_name),
+                ("unknown", "first_name_ascii/usa"),
+            )
+
+        fold.assert_called_once_with("Gökçe")
+        # Each distinct variant is stripped once, not once per probe.
+        self.assertEqual(
+            [c.args[0] for c in strip.call_args_list], ["Gökçe", "Gokce"]
+        )
+
+
+class SampleDetector(object):
+    """gender_guesser's detector, with only some of its names listed."""
+
+    def __init__(self, detector, names):
+        self.names = names
+        self.get_gender = detector.get_gender
+
+
+class TestNameIndex(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.detector = load_detector()
+        cls.sample = SampleDetector(
+            cls.detector, sorted(cls.detector.names)[::200] + ["gökçe"]
+        )
+        cls.table = build_name_table(cls.sample)
+
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".idx")
+        os.close(fd)
+        self.addCleanup(os.remove, self.path)
+
+    def test_index_agrees_with_detector_and_table(self):
+        write_name_index(self.path, self.sample, self.table)
+        index = NameIndex(self.path)
+
+        self.assertEqual(sorted(index.names), sorted(self.sample.names))
+        for name in self.sample.names:
+            self.assertEqual(index.get(name), self.table[name], name)
+            for country in ("usa", None):
+                self.assertEqual(
+                    index.get_gender(name.upper(), country),
+                    self.detector.get_gender(name, country),
+                )
+
+        for name in ["xX_coder_Xx", "🐘", "\udcc3", ""]:
+            self.assertNotIn(name, index)
+            self.assertIsNone(index.get(name))
+            self.assertEqual(index.get_gender(name), "unknown")
+        with self.assertRaises(ValueError):
+            index.get_gender("alice", "france")
+
+    def test_stale_index_is_rebuilt(self):
+        with open(self.path, "wb") as f:
+            f.write(b"names.pickle")
+        with self.assertRaises(ValueError):
+            NameIndex(self.path)
+
+        with mock.patch.object(
+            analyze, "load_detector", return_value=self.sample
+        ):
+            index = load_name_index(self.path)
+        self.assertEqual(len(index.names), len(self.sample.names))
+
+    def test_index_of_other_source_is_rebuilt(self):
+        write_name_index(self.path, self.sample, self.table, "old")
+        with self.assertRaises(ValueError):
+            NameIndex(self.path, "new")
+
+        with mock.patch.object(
+            analyze, "load_detector", return_value=self.sample
+        ), mock.patch.object(analyze, "name_index_source", return_value="new"):
+            load_name_index(self.path)
+        NameIndex(self.path, "new")
+
+    def test_source_is_the_same_in_every_process(self):
+        other = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import analyze; print(analyze.name_index_source())",
+            ],
+            cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+            capture_output=True,
+            check=True,
+            text=True,
+        )
+        self.assertEqual(other.stdout.strip(), name_index_source())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,163 @@
+import time
+import unittest
+from unittest import mock
+
+import requests
+from mastodon import (
+    MastodonNetworkError,
+    MastodonNotFoundError,
+    MastodonRatelimitError,
+)
+
+from analyze import (
+    Cache,
+    analyze_followers,
+    analyze_timeline,
+    call_with_retries,
+    make_pooled_session,
+)
+from tests.fakes import FakeApi, account, status
+
+
+class FlakyApi(FakeApi):
+    """
+    Fails fetch_next calls with a network error, failures times in a row
+    starting with call number fail_at (counting from 1).
+    """
+
+    def __init__(self, fail_at, failures, **kwargs):
+        super().__init__(**kwargs)
+        self.fail_at = fail_at
+        self.failures = failures
+        self.next_calls = 0
+
+    def fetch_next(self, page):
+        self.next_calls += 1
+        if self.fail_at <= self.next_calls < self.fail_at + self.failures:
+            raise MastodonNetworkError("Connection reset")
+        return super().fetch_next(page)
+
+
+class RateLimitedApi(FakeApi):
+    """
+    Hits the rate limit on the first fetch_next call, until reset, a
+    time.time() value, as Mastodon.py tells with ratelimit_reset.
+    """
+
+    def __init__(self, reset, **kwargs):
+        super().__init__(**kwargs)
+        self.ratelimit_reset = reset
+        self.limited = False
+
+    def fetch_next(self, page):
+        if not self.limited:
+            self.limited = True
+            raise MastodonRatelimitError("Hit rate limit.")
+        return super().fetch_next(page)
+
+
+def followers(n):
+    return [account(i, "Carol") for i in range(10, 10 + n)]
+
+
+@mock.patch("analyze.time.sleep")
+class TestResilientPagination(unittest.TestCase):
+    def test_transient_errors_are_retried(self, sleep):
+        api = FlakyApi(2, 2, followers=followers(6), page_size=2)
+        an = analyze_followers(1, api, Cache())
+
+        self.assertTrue(an.complete)
+        self.assertEqual(an.female.n, 6)
+        # Exponential backoff between the retries.
+        self.assertEqual([c.args[0] for c in sleep.call_args_list], [0.5, 1])
+
+    def test_persistent_errors_give_partial_results(self, sleep):
+        api = FlakyApi(2, 100, followers=followers(6), page_size=2)
+        an = analyze_followers(1, api, Cache())
+
+        self.assertFalse(an.complete)
+        self.assertFalse(an.summary()["complete"])
+        # The first two pages were kept.
+        self.assertEqual(an.female.n, 4)
+        self.assertEqual(len(sleep.call_args_list), 3)
+
+    def test_deadline_stops_pagination(self, sleep):
+        api = FakeApi(
+            home=[status(account(i, "Carol")) for i in range(10, 16)],
+            page_size=2,
+        )
+        an = analyze_timeline(
+            1, None, api, Cache(), deadline=time.monotonic() - 1
+        )
+
+        self.assertFalse(an.complete)
+        self.assertEqual(an.ids_sampled, 0)
+        self.assertEqual(api.calls, [])
+
+    def test_other_errors_are_not_retried(self, sleep):
+        class GoneApi(FakeApi):
+            def account_followers(self, id, limit=None):
+                raise MastodonNotFoundError("Record not found")
+
+        with self.assertRaises(MastodonNotFoundError):
+            analyze_followers(1, GoneApi(), Cache())
+        sleep.assert_not_called()
+
+    def test_incomplete_flag_survives_adding(self, sleep):
+        api = FlakyApi(1, 100, followers=followers(4), page_size=2)
+        partial = analyze_followers(1, api, Cache())
+        full = analyze_followers(1, FakeApi(followers=followers(4)), Cache())
+
+        self.assertTrue(full.complete)
+        self.assertFalse((full + partial).complete)
+
+    def test_rate_limits_are_waited_out(self, sleep):
+        api = RateLimitedApi(
+            time.time() + 30, followers=followers(4), page_size=2
+        )
+        an = analyze_followers(1, api, Cache())
+
+        self.assertTrue(an.complete)
+        self.assertFalse(an.rate_limited)
+        self.assertGreater(sleep.call_args.args[0], 29)
+
+    def test_rate_limits_past_the_deadline_are_flagged(self, sleep):
+        api = RateLimitedApi(
+            time.time() + 300, followers=followers(4), page_size=2
+        )
+        an = analyze_followers(1, api, Cache(), deadline=time.monotonic() + 10)
+
+        self.assertFalse(an.complete)
+        self.assertTrue(an.summary()["rate_limited"])
+        self.assertEqual(an.female.n, 2)
+        sleep.assert_not_called()
+
+    def test_at_most_nine_pages_are_sampled(self, sleep):
+        api = FakeApi(followers=followers(30), page_size=2)
+        an = analyze_followers(1, api, Cache())
+
+        self.assertEqual(an.ids_fetched, 18)
+        self.assertEqual(len(api.calls), 9)
+
+
+class TestRequestTimeouts(unittest.TestCase):
+    @mock.patch("requests.adapters.HTTPAdapter.send")
+    def test_timeouts_are_capped_by_the_deadline(self, send):
+        send.return_value = requests.Response()
+        session = make_pooled_session(1)
+
+        def get():
+            return session.get("https://example.com", timeout=10)
+
+        get()
+        self.assertEqual(send.call_args.kwargs["timeout"], 10)
+
+        call_with_retries(get, deadline=time.monotonic() + 2)
+        self.assertLessEqual(send.call_args.kwargs["timeout"], 2)
+
+        call_with_retries(get, deadline=time.monotonic() - 1)
+        self.assertEqual(send.call_args.kwargs["timeout"], 0.01)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+import gc
+import os
+import shutil
+import tempfile
+import unittest
+import zlib
+from unittest import mock
+
+from analyze import Cache, analyze_handle, get_mastodon_api
+from replay import RecordingApi, ReplayApi, close_archives
+from tests.fakes import FakeApi, account, status
+
+
+class TestReplay(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.archive = os.path.join(self.dir, "responses.jsonl.gz")
+
+    def tearDown(self):
+        shutil.rmtree(self.dir)
+
+    def test_replay_matches_recording(self):
+        me, bob = account(1, "alice"), account(3, "Bob")
+        upstream = FakeApi(
+            accounts=[me, bob],
+            following=[account(i, "Carol") for i in range(10, 17)],
+            followers=[bob, account(4, "X", note="<p>they/them</p>")],
+            home=[status(bob), status(me)],
+            statuses=[status(me, in_reply_to_account_id=3, mentions=[3])],
+            page_size=3,
+        )
+
+        recorded = analyze_handle(
+            "1", RecordingApi(upstream, self.archive), Cache()
+        )
+        replayed = analyze_handle("1", ReplayApi.load(self.archive), Cache())
+
+        self.assertEqual(replayed, recorded)
+        self.assertEqual(replayed["following"].ids_fetched, 7)
+        self.assertEqual(replayed["followers"].nonbinary.n_declared, 1)
+
+    def test_recorded_errors_are_replayed(self):
+        from mastodon import MastodonNotFoundError
+
+        api = RecordingApi(FakeApi(), self.archive)
+        with self.assertRaises(MastodonNotFoundError):
+            api.account_lookup("nobody")
+
+        with self.assertRaises(MastodonNotFoundError):
+            ReplayApi.load(self.archive).account_lookup("nobody")
+
+    def test_get_mastodon_api_replays_from_environment(self):
+        RecordingApi(FakeApi(), self.archive).account_search("x", limit=1)
+        with mock.patch.dict(os.environ, {"MASTODON_REPLAY": self.archive}):
+            api = get_mastodon_api(None, "example.com")
+        self.assertEqual(api.account_search("x", limit=1), [])
+        with self.assertRaises(LookupError):
+            api.account_search("y", limit=1)
+
+    def test_archive_is_one_gzip_stream(self):
+        api = RecordingApi(
+            FakeApi(followers=[account(i, "Carol") for i in range(10)]),
+            self.archive,
+        )
+        page = api.account_followers(1)
+        while page:
+            page = api.fetch_next(page)
+        close_archives(self.archive)
+
+        with open(self.archive, "rb") as f:
+            stream = zlib.decompressobj(wbits=16 + zlib.MAX_WBITS)
+            lines = stream.decompress(f.read()).decode().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(stream.unused_data, b"")
+
+        # Pages are forgotten once they're gone.
+        gc.collect()
+        self.assertEqual(api._page_keys, {})
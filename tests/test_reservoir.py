@@ -0,0 +1,41 @@
+import random
+import unittest
+from collections import Counter
+
+from analyze import Reservoir
+
+
+class TestReservoir(unittest.TestCase):
+    def test_short_stream_is_kept_whole(self):
+        sample = Reservoir(10)
+        sample.extend(range(7))
+        self.assertEqual(sample.items, list(range(7)))
+        self.assertEqual(sample.seen, 7)
+
+    def test_size_is_bounded(self):
+        sample = Reservoir(10)
+        sample.extend(range(100000))
+        self.assertEqual(len(sample.items), 10)
+        self.assertEqual(len(set(sample.items)), 10)
+        self.assertEqual(sample.seen, 100000)
+
+    def test_seeded_sample_is_reproducible(self):
+        samples = []
+        for _ in range(2):
+            sample = Reservoir(50, random.Random(42))
+            sample.extend(range(10000))
+            samples.append(sample.items)
+        self.assertEqual(samples[0], samples[1])
+
+    def test_sample_is_uniform(self):
+        counts = Counter()
+        rng = random.Random(0)
+        for _ in range(2000):
+            sample = Reservoir(5, rng)
+            sample.extend(range(50))
+            counts.update(sample.items)
+
+        # Each item is expected 2000 * 5 / 50 = 200 times.
+        self.assertEqual(set(counts), set(range(50)))
+        self.assertLess(max(counts.values()), 280)
+        self.assertGreater(min(counts.values()), 130)
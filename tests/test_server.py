@@ -0,0 +1,259 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+os.environ.setdefault("COOKIE_SECRET", "test")
+_tmp = tempfile.mkdtemp()
+os.environ.setdefault("SESSION_DB", os.path.join(_tmp, "sessions.db"))
+os.environ.setdefault("HANDLE_CACHE_DB", os.path.join(_tmp, "handles.db"))
+
+import server  # noqa: E402
+from tests.fakes import FakeApi, account  # noqa: E402
+
+
+def parse_events(body):
+    for chunk in body.decode().strip().split("\n\n"):
+        event, data = chunk.split("\n")
+        yield event[len("event: ") :], json.loads(data[len("data: ") :])
+
+
+class TestAnalyzeStream(unittest.TestCase):
+    def setUp(self):
+        self.client = server.app.test_client()
+        with self.client.session_transaction() as session:
+            session["mastodon_user"] = "1@example.com"
+            session["mastodon_token"] = "token"
+            session["instance"] = "example.com"
+            session["lists"] = []
+
+    def stream(self, api):
+        with mock.patch.object(
+            server, "get_mastodon_api", return_value=api
+        ), mock.patch.object(server, "handle_cache", None):
+            response = self.client.get(
+                "/analyze/stream?analyze_acct=1@example.com&lst=none"
+            )
+            self.assertEqual(response.mimetype, "text/event-stream")
+            return list(parse_events(response.data))
+
+    def test_results_are_streamed_per_page(self):
+        api = FakeApi(
+            accounts=[account(1, "alice")],
+            following=[account(i, "Carol") for i in range(10, 15)],
+            page_size=2,
+        )
+        events = self.stream(api)
+
+        following = [
+            data["summary"]["n"]["female"]
+            for event, data in events
+            if event == "result" and data["collection"] == "following"
+        ]
+        # One result per page, then the final one flagged complete or not.
+        self.assertEqual(following, [2, 4, 5, 5])
+        event, data = events[-1]
+        self.assertEqual((event, data["list_name"]), ("done", None))
+        self.assertIn("Classified 5 accounts", data["usage"])
+
+    def test_all_lists_are_compared(self):
+        with self.client.session_transaction() as session:
+            session["lists"] = [
+                {"id": 1, "name": "Alices"},
+                {"id": 2, "name": "Bobs"},
+            ]
+        api = FakeApi(
+            accounts=[account(1, "alice")],
+            lists={
+                1: [account(10, "Alice"), account(11, "Carol")],
+                2: [account(20, "Bob")],
+            },
+        )
+        with mock.patch.object(
+            server, "get_mastodon_api", return_value=api
+        ), mock.patch.object(server, "handle_cache", None):
+            response = self.client.get(
+                "/analyze/stream?analyze_acct=1@example.com&lst=all"
+            )
+        lists = {
+            data["name"]: data["summary"]["n"]
+            for event, data in parse_events(response.data)
+            if event == "list"
+        }
+        self.assertEqual(lists["Alices"]["female"], 2)
+        self.assertEqual(lists["Bobs"]["male"], 1)
+
+    def test_failure_is_reported(self):
+        events = self.stream(FakeApi())
+        self.assertEqual(events[-1][0], "failure")
+        self.assertIn("Failed to find user", events[-1][1]["message"])
+
+    def test_errors_quoting_the_acct_are_escaped(self):
+        hidden = account(1, "alice")
+        hidden.indexable = False
+        with self.client.session_transaction() as session:
+            session["mastodon_user"] = "2@example.com"
+        acct = "<b>1</b>@example.com"
+        with mock.patch.object(
+            server, "get_mastodon_api", return_value=FakeApi()
+        ), mock.patch.object(server, "handle_cache", None):
+            page = self.client.post(
+                "/",
+                data={
+                    "form_type": "analyze",
+                    "analyze_acct": acct,
+                    "lst": "none",
+                },
+            ).data.decode()
+        self.assertIn("Failed to find user &lt;b&gt;1&lt;/b&gt;", page)
+        self.assertNotIn("<b>1</b>", page)
+
+        # Streamed errors are plain text, shown as such by the page.
+        events = self.stream(FakeApi(accounts=[hidden]))
+        message = events[-1][1]["message"]
+        self.assertIn("is not indexable.\nIf the account", message)
+        self.assertNotIn("<br>", message)
+
+
+class RemoteApi(FakeApi):
+    """Looks accounts up by their whole acct, as servers do."""
+
+    def account_lookup(self, acct):
+        from mastodon import MastodonNotFoundError
+
+        self._call("account_lookup", acct)
+        username, domain = acct.split("@")
+        for a in self._accounts.values():
+            if a.acct in (acct, username if domain == "example.com" else None):
+                return a
+        raise MastodonNotFoundError("Record not found")
+
+
+class TestAnalysisApi(unittest.TestCase):
+    def setUp(self):
+        self.client = server.app.test_client()
+        with self.client.session_transaction() as session:
+            session["mastodon_user"] = "1@example.com"
+            session["mastodon_token"] = "token"
+            session["instance"] = "example.com"
+            session["lists"] = []
+        self.api = FakeApi(
+            accounts=[account(1, "alice")],
+            following=[account(i, "Carol") for i in range(10, 13)]
+            + [account(13, "Bob"), account(14, "Sam", note="they/them")],
+        )
+
+    def get(self, api, acct="1@example.com"):
+        with mock.patch.object(
+            server, "get_mastodon_api", return_value=api
+        ), mock.patch.object(server, "handle_cache", None):
+            return self.client.get(
+                f"/api/analysis?analyze_acct={acct}&lst=none"
+            )
+
+    def test_view_model(self):
+        view = self.get(self.api).get_json()
+
+        following = view["collections"][0]
+        self.assertEqual(following["collection"], "following")
+        self.assertEqual(following["label"], "People you follow")
+        self.assertEqual(following["pct_female"], 60)
+        self.assertEqual(following["guessed_female"], 3)
+        self.assertEqual(following["declared_nonbinary"], 1)
+        self.assertEqual(view["total_declared"], 1)
+        self.assertEqual(view["total_guessed"], 4)
+        self.assertTrue(view["complete"])
+        self.assertIn("Classified 5 accounts", view["usage"])
+
+    def test_remote_accounts_keep_their_domain(self):
+        remote = account(5, "Carol")
+        remote.acct = "5@other.social"
+        api = RemoteApi(accounts=[account(1, "alice"), remote])
+
+        response = self.get(api, acct="@5@other.social")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(("account_lookup", "5@other.social"), api.calls)
+
+        # The user's own instance is looked up by the API host.
+        with self.client.session_transaction() as session:
+            session["handle_instance"] = "example.org"
+        api.calls = []
+        self.assertEqual(self.get(api, acct="1@example.org").status_code, 200)
+        self.assertIn(("account_lookup", "1@example.com"), api.calls)
+
+    def test_snapshots_are_not_saved(self):
+        with mock.patch.object(server, "save_snapshot") as save_snapshot:
+            self.assertEqual(self.get(self.api).status_code, 200)
+        save_snapshot.assert_not_called()
+
+    def test_page_shows_the_view_model(self):
+        with mock.patch.object(
+            server, "get_mastodon_api", return_value=self.api
+        ), mock.patch.object(server, "handle_cache", None):
+            response = self.client.post(
+                "/",
+                data={
+                    "form_type": "analyze",
+                    "analyze_acct": "1@example.com",
+                    "lst": "none",
+                },
+            )
+        page = response.data.decode()
+        self.assertIn("Results for @1@example.com", page)
+        self.assertIn("Sampled 5 people @1@example.com follows", page)
+        self.assertIn('<td class="td-important">60%</td>', page)
+
+    def test_errors(self):
+        response = self.get(FakeApi())
+        self.assertEqual(response.status_code, 404)
+        self.assertIn("Failed to find user", response.get_json()["error"])
+
+        hidden = account(1, "alice")
+        hidden.indexable = False
+        with self.client.session_transaction() as session:
+            session["mastodon_user"] = "2@example.com"
+        response = self.get(FakeApi(accounts=[hidden]))
+        self.assertEqual(response.status_code, 403)
+        self.assertIn("not indexable", response.get_json()["error"])
+
+        with mock.patch.object(
+            server, "run_analyses", side_effect=RuntimeError("API down")
+        ):
+            response = self.get(self.api)
+        self.assertEqual(response.status_code, 502)
+
+        with self.client.session_transaction() as session:
+            del session["mastodon_user"]
+        self.assertEqual(self.get(self.api).status_code, 403)
+
+
+class TestAuthorized(unittest.TestCase):
+    def test_logout_invalidates_the_session_id(self):
+        client = server.app.test_client()
+        with client.session_transaction() as session:
+            session["mastodon_user"] = "1@example.com"
+        before = client.get_cookie("session").value
+
+        client.get("/logout")
+        self.assertNotEqual(client.get_cookie("session").value, before)
+        client.set_cookie("session", before)
+        with client.session_transaction() as session:
+            self.assertNotIn("mastodon_user", session)
+
+    def test_denied_sign_in_is_flashed(self):
+        from authlib.integrations.flask_client import OAuthError
+
+        client = server.app.test_client()
+        with client.session_transaction() as session:
+            session["instance"] = "example.com"
+        oauth = mock.Mock()
+        oauth.create_client().authorize_access_token.side_effect = OAuthError(
+            "access_denied"
+        )
+
+        with mock.patch.object(server, "get_oauth", return_value=oauth):
+            response = client.get("/authorized")
+        self.assertEqual(response.status_code, 302)
+        with client.session_transaction() as session:
+            self.assertIn("denied", str(session["_flashes"]))
@@ -0,0 +1,67 @@
+import os
+import tempfile
+import unittest
+
+from flask import Flask, session
+
+from sessions import SqliteSessionInterface
+
+
+class TestSqliteSessions(unittest.TestCase):
+    def setUp(self):
+        fd, self.path = tempfile.mkstemp(suffix=".db")
+        os.close(fd)
+
+        app = Flask(__name__)
+        app.session_interface = SqliteSessionInterface(self.path)
+
+        @app.route("/set")
+        def set_():
+            session["lists"] = [{"id": i, "name": str(i)} for i in range(500)]
+            return ""
+
+        @app.route("/get")
+        def get():
+            return str(len(session.get("lists", [])))
+
+        @app.route("/clear")
+        def clear():
+            session.clear()
+            return ""
+
+        @app.route("/login")
+        def login():
+            session["user"] = "alice"
+            session.regenerate()
+            return ""
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_session_round_trip(self):
+        response = self.client.get("/set")
+        cookie = response.headers["Set-Cookie"]
+        # Only the session id travels in the cookie.
+        self.assertLess(len(cookie), 150)
+        self.assertEqual(self.client.get("/get").data, b"500")
+
+        self.client.get("/clear")
+        self.assertEqual(self.client.get("/get").data, b"0")
+
+    def test_unknown_session_id_starts_a_new_session(self):
+        self.client.set_cookie("session", "forged")
+        self.assertEqual(self.client.get("/get").data, b"0")
+
+    def test_login_moves_the_session_to_a_new_id(self):
+        self.client.get("/set")
+        before = self.client.get_cookie("session").value
+        self.client.get("/login")
+        after = self.client.get_cookie("session").value
+
+        self.assertNotEqual(after, before)
+        self.assertEqual(self.client.get("/get").data, b"500")
+        # The id from before logging in is no longer valid.
+        self.client.set_cookie("session", before)
+        self.assertEqual(self.client.get("/get").data, b"0")
@@ -0,0 +1,121 @@
+import datetime
+import io
+import os
+import tempfile
+import unittest
+
+from analyze import Analysis, Cache, GraphIndex
+from snapshots import RECORD, SnapshotStore, pack, run_snapshots, unpack
+from tests.fakes import FakeApi, account
+
+
+def analysis(male, female, complete=True):
+    an = Analysis(male + female, None)
+    an.male.n = male
+    an.female.n = female
+    an.female.n_declared = 1
+    an.complete = complete
+    return an
+
+
+class TestSnapshots(unittest.TestCase):
+    def setUp(self):
+        self.paths = []
+        for _ in range(2):
+            fd, path = tempfile.mkstemp(suffix=".db")
+            os.close(fd)
+            self.paths.append(path)
+        self.store = SnapshotStore(self.paths[0])
+
+    def tearDown(self):
+        for path in self.paths:
+            os.remove(path)
+
+    def test_records_are_fixed_size(self):
+        an = analysis(3, 1, complete=False)
+        self.assertEqual(len(pack(an)), RECORD.size)
+        self.assertEqual(len(pack(Analysis(10**6, 10**6))), RECORD.size)
+        self.assertEqual(unpack(pack(an)), an)
+
+    def test_trend(self):
+        user = "alice@example.com"
+        self.store.add(user, {"following": analysis(3, 1)}, day=19000)
+        self.store.add(user, {"following": analysis(1, 1)}, day=19001)
+        # Snapshots taken again the same day replace the earlier ones.
+        self.store.add(user, {"following": analysis(1, 3)}, day=19001)
+        self.store.add(
+            user, {"following": analysis(1, 0, complete=False)}, day=19002
+        )
+
+        day = datetime.date(2022, 1, 8)
+        self.assertEqual(
+            self.store.trend(user, "following", "female"),
+            [(day, 25.0), (day + datetime.timedelta(days=1), 75.0)],
+        )
+        history = self.store.history(user, since=day + datetime.timedelta(1))
+        self.assertEqual(len(history["following"]), 2)
+        self.assertEqual(self.store.history("bob@example.com"), {})
+
+    def test_incomplete_snapshots_dont_replace_complete_ones(self):
+        user = "alice@example.com"
+        self.store.add(
+            user,
+            {"following": analysis(3, 1), "followers": analysis(1, 1)},
+            day=19000,
+        )
+        self.store.add(
+            user,
+            {
+                "following": analysis(1, 0, complete=False),
+                "followers": analysis(1, 3),
+            },
+            day=19000,
+        )
+        history = self.store.history(user)
+        self.assertEqual(history["following"][0][1], analysis(3, 1))
+        self.assertEqual(history["followers"][0][1], analysis(1, 3))
+
+    def test_daily_runs_reuse_the_index(self):
+        api = FakeApi(
+            accounts=[account(1, "alice")],
+            following=[account(i, "Carol") for i in range(10, 15)],
+            followers=[account(i, "Bob") for i in range(20, 25)],
+        )
+        index = GraphIndex(self.paths[1])
+        progress = io.StringIO()
+        handles = ["1@example.com", "@1@Example.com"]
+        run_snapshots(
+            handles,
+            "example.com",
+            api,
+            Cache(index, "example.com", 99),
+            self.store,
+            progress=progress,
+        )
+
+        history = self.store.history("1@example.com")
+        self.assertEqual(history["following"][0][1].female.n, 5)
+        self.assertEqual(history["followers"][0][1].male.n, 5)
+
+        # Already snapshotted today.
+        api.calls = []
+        run_snapshots(
+            handles, "example.com", api, Cache(), self.store, progress=progress
+        )
+        self.assertEqual(api.calls, [])
+
+        # Another day only needs the statuses.
+        with self.store._connect() as db:
+            db.execute("UPDATE snapshots SET day = day - 1")
+        run_snapshots(
+            handles,
+            "example.com",
+            api,
+            Cache(index, "example.com", 99),
+            self.store,
+            progress=progress,
+        )
+        called = {c[0] for c in api.calls}
+        self.assertNotIn("account_following", called)
+        self.assertNotIn("account_followers", called)
+        self.assertEqual(len(self.store.history("1@example.com")), 6)